@@ -2,6 +2,128 @@ import argparse
 import datetime
 import json
 import logging
+import os
+
+from indaleko_serialize import IndalekoSerializer, get_serializer, add_serializer_argument
+
+
+class IndalekoRecordSink:
+    '''
+    Output sink that writes one record at a time as pages arrive (JSON lines
+    by default, see indaleko_serialize for the other formats), so a crawl never
+    holds more than a page in memory.  The sink can be reopened at a byte
+    offset (taken from a checkpoint) to resume an interrupted crawl; anything
+    written after that offset is discarded so records are not duplicated.
+    '''
+
+    def __init__(self, output_file: str, offset: int = None, serializer: IndalekoSerializer = None) -> None:
+        self.output_file = output_file
+        self.serializer = serializer if serializer is not None else get_serializer()
+        self.count = 0
+        if offset is None:
+            self.fd = open(output_file, 'wb')
+        else:
+            self.fd = open(output_file, 'r+b')
+            self.fd.truncate(offset)
+            self.fd.seek(offset)
+
+    def write_records(self, records: list) -> int:
+        '''Append records and flush them to disk; returns the new offset.'''
+        encode = self.serializer.encode
+        self.fd.write(b''.join([encode(record) for record in records]))
+        self.count += len(records)
+        self.fd.flush()
+        os.fsync(self.fd.fileno())
+        return self.fd.tell()
+
+    def tell(self) -> int:
+        return self.fd.tell()
+
+    def close(self) -> None:
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+
+class IndalekoCrawlCheckpoint:
+    '''
+    Persisted crawl position: the provider specific cursor state (pending
+    folders, page tokens, next links) plus the output offset it corresponds
+    to.  Saved atomically after every page so a crash leaves either the old or
+    the new checkpoint, never a partial one.
+    '''
+
+    def __init__(self, checkpoint_file: str) -> None:
+        self.checkpoint_file = checkpoint_file
+
+    @staticmethod
+    def for_output(output_file: str) -> 'IndalekoCrawlCheckpoint':
+        return IndalekoCrawlCheckpoint(output_file + '.checkpoint')
+
+    def load(self) -> dict:
+        if not os.path.exists(self.checkpoint_file):
+            return None
+        with open(self.checkpoint_file, 'rt') as fd:
+            return json.load(fd)
+
+    def save(self, state: dict, offset: int, count: int) -> None:
+        checkpoint = {
+            'state': state,
+            'offset': offset,
+            'count': count,
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+        }
+        with open(self.checkpoint_file + '.tmp', 'wt') as fd:
+            json.dump(checkpoint, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(self.checkpoint_file + '.tmp', self.checkpoint_file)
+
+    def remove(self) -> None:
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+
+class IndalekoCrawlStream:
+    '''Ties a sink and its checkpoint together: record_page() writes a
+    page and then checkpoints the cursor state that follows it.'''
+
+    def __init__(self, output_file: str, resume: bool = False, serializer: IndalekoSerializer = None, append: bool = False) -> None:
+        '''With append, records are added after the existing contents of
+        output_file (e.g., changes recorded after a completed crawl.)'''
+        self.output_file = output_file
+        self.checkpoint = IndalekoCrawlCheckpoint.for_output(output_file)
+        self.state = None
+        offset = None
+        previous = 0
+        if append:
+            offset = os.path.getsize(output_file)
+        elif resume:
+            saved = self.checkpoint.load()
+            assert saved is not None, f'No checkpoint found for {output_file}'
+            self.state = saved['state']
+            offset = saved['offset']
+            previous = saved['count']
+            logging.info(f'Resuming {output_file} after {previous} records')
+        self.sink = IndalekoRecordSink(output_file, offset, serializer)
+        self.sink.count = previous
+
+    def record_page(self, records: list, state: dict) -> None:
+        offset = self.sink.write_records(records)
+        self.checkpoint.save(state, offset, self.sink.count)
+        self.state = state
+
+    def get_count(self) -> int:
+        return self.sink.count
+
+    def finish(self) -> None:
+        '''The crawl completed, so the checkpoint is no longer needed.'''
+        self.sink.close()
+        self.checkpoint.remove()
+
+    def close(self) -> None:
+        self.sink.close()
+
 
 class IndalekoIngest:
     '''
@@ -11,6 +133,9 @@ class IndalekoIngest:
     config_dir = 'config/'
     data_dir = 'data/'
     timestamp = datetime.datetime.utcnow()
+    # Ingestors that implement stream_metadata() set this; their output is
+    # written a page at a time (JSON lines) and can be resumed.
+    supports_streaming = False
 
     def __init__(self):
         self.parser = argparse.ArgumentParser()
@@ -19,23 +144,83 @@ class IndalekoIngest:
         self.parser.add_argument('--loglevel', type=int, default=logging.WARNING, choices=logging_levels,
                                  help='Logging level to use (lower number = more logging)')
         self.parser.add_argument('--output', type=str, default=None, help='Name of output file for captured data')
+        add_serializer_argument(self.parser)
+        if self.supports_streaming:
+            self.parser.add_argument('--resume', type=str, default=None,
+                                     help='Resume the interrupted crawl that was writing this output file')
+            self.parser.add_argument('--spool', type=str, default=None,
+                                     help='Also normalize each page into Indaleko objects and append them to this spool directory')
+            self.parser.add_argument('--blobs', type=str, default=None,
+                                     help='With --spool, keep the raw items in this blob store instead of inline')
         self.args = None
         self.output_file = None
         self.metadata = []
+        self.stream = None
 
     def get_metadata(self):
         assert False, 'get_metadata must be overridden by a subclass'
 
+    def get_serializer(self) -> IndalekoSerializer:
+        return get_serializer(getattr(self.args, 'format', None))
+
+    def stream_metadata(self, stream: IndalekoCrawlStream):
+        '''Streaming version of get_metadata: call stream.record_page(records,
+        state) for each page, and start from stream.state if it is not None.'''
+        assert False, 'stream_metadata must be overridden by a subclass'
+
+    def get_normalizer(self):
+        '''The IndalekoNormalizer for this ingestor's records (used with
+        --spool.)'''
+        assert False, 'get_normalizer must be overridden by a subclass'
+
     def main(self):
         '''This is the entry point for all ingestors'''
         if self.args is None:
             self.args = self.parser.parse_args()
         self.start = datetime.datetime.utcnow()
+        if self.supports_streaming:
+            self.stream_to_output()
+            return
         self.metadata = self.get_metadata()
         self.end = datetime.datetime.utcnow()
         self.get_output_file()
         self.record_metadata()
 
+    def normalize_stream(self, stream: IndalekoCrawlStream):
+        '''With --spool, wrap stream so each page is also normalized into the
+        spool; otherwise return it unchanged.'''
+        if getattr(self.args, 'spool', None) is None:
+            return stream
+        from indaleko_normalize import IndalekoNormalizingStream
+        from indaleko_spool import IndalekoSpool
+        normalizer = self.get_normalizer()
+        if getattr(self.args, 'blobs', None) is not None:
+            from indaleko_blobstore import IndalekoBlobStore
+            normalizer.set_blob_store(IndalekoBlobStore(self.args.blobs))
+        return IndalekoNormalizingStream(stream, normalizer, IndalekoSpool(self.args.spool))
+
+    def stream_to_output(self):
+        if self.args.resume is not None:
+            self.output_file = self.args.resume
+            self.stream = IndalekoCrawlStream(self.output_file, resume=True, serializer=self.get_serializer())
+        else:
+            self.get_output_file()
+            self.stream = IndalekoCrawlStream(self.output_file, serializer=self.get_serializer())
+        self.stream = self.normalize_stream(self.stream)
+        try:
+            self.stream_metadata(self.stream)
+        except BaseException:
+            self.stream.close()
+            print(f'Crawl interrupted after {self.stream.get_count()} records; rerun with --resume {self.output_file}')
+            raise
+        self.stream.finish()
+        self.end = datetime.datetime.utcnow()
+        count = self.stream.get_count()
+        elapsed = self.end - self.start
+        if count > 0:
+            print(f'Saved {count} records to {self.output_file} in {elapsed} seconds ({elapsed/count} seconds per record)')
+        return self
+
     def _get_output_file(self) -> str:
         '''Override this in derived classes if needed.'''
         return self.output_file
@@ -53,8 +238,8 @@ class IndalekoIngest:
 
     def record_metadata(self):
         if self.output_file is not None and len(self.metadata) > 0:
-            with open(self.output_file, 'wt') as output_file:
-                json.dump(self.metadata, output_file, indent=4)
+            with open(self.output_file, 'wb') as output_file:
+                self.get_serializer().dump(self.metadata, output_file)
             elapsed = self.end - self.start
             print(
                 f'Saved {len(self.metadata)} records to {self.output_file} in {elapsed} seconds ({elapsed/len(self.metadata)} seconds per record)')
@@ -8,11 +8,10 @@ import string
 import subprocess
 import datetime
 import logging
-from indaleko import *
-from arango import ArangoClient
-import arango.exceptions
-import requests
+from indaleko import IndalekoObject, IndalekoRelationship, IndalekoSource
 import time
+# arango and requests are imported where they are used: they are slow to load
+# and most invocations (e.g., --help) never need them
 
 
 def resetdb(args : argparse.Namespace) -> None:
@@ -66,6 +65,8 @@ class IndalekoDBConfig:
     def start(self):
         '''Once the container is running, this method will set up connections to
         the database and configure it if needed'''
+        import requests
+        from arango import ArangoClient
         url = f"http://{self.config['database']['host']}:{self.config['database']['port']}"
         while True:
             try:
@@ -200,6 +201,7 @@ class IndalekoDBConfig:
 
 
     def setup_collections(self, reset: bool = False) -> None:
+        import arango.exceptions
         assert self.collections is not None, 'No collections found'
         for collection in self.collections:
             try:
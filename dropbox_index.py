@@ -0,0 +1,258 @@
+import datetime
+import json
+import logging
+import os
+import time
+
+import IndalekoIngest
+from indaleko_http import IndalekoHttpClient, IndalekoHttpError
+from indaleko_normalize import DropboxNormalizer
+from indaleko_projections import DefaultProfile, dropbox_list_folder_options, add_profile_argument
+
+'''
+Dropbox ingester.  This replaces old/dropbox-ingest.py, which restarted the
+listing on every loop iteration and re-listed the whole account on every run.
+
+* A full run pages through files/list_folder (recursive) with its cursor and
+  writes the entries as JSON lines (resumable with --resume, like the other
+  streaming ingesters.)  The cursor at the end of the listing is saved per
+  account in data/.
+* --incremental starts from the saved cursor with files/list_folder/continue,
+  so only the changes since the last run are fetched.  If there is no saved
+  cursor, or Dropbox has reset it, it falls back to a full listing.
+* --watch then blocks in files/list_folder/longpoll and fetches (and records)
+  changes only when Dropbox reports that something changed.  If Dropbox
+  resets the cursor while watching, the account is listed again.
+
+Incremental and watch output is a change stream, one record per entry:
+
+    {"change": "changed" | "deleted", "id": "...", "path": "...", "item": {...}}
+
+When they fall back to a full listing, its entries are written as "changed"
+records, so a changes file only ever holds change records.
+'''
+
+class DropboxCredentials:
+    '''Token provider for IndalekoHttpClient.  Note: this should be converted
+    to use the OAuth2 work flow that Dropbox prefers, but for now it reads a
+    token from a file.'''
+
+    def __init__(self, token_file: str = 'data/dropbox-token.json') -> None:
+        assert os.path.exists(token_file), f'File {token_file} does not exist, aborting'
+        with open(token_file, 'rt') as fd:
+            self.token = json.load(fd)['token']
+
+    def get_token(self) -> str:
+        return self.token
+
+
+class DropboxCursorReset(Exception):
+    '''Dropbox no longer accepts a saved cursor (files/list_folder/continue
+    returned a reset error); the folder must be listed again.'''
+    pass
+
+
+class DropboxIngest(IndalekoIngest.IndalekoIngest):
+    '''This is the ingestor for Dropbox.'''
+
+    ApiEndpoint = 'https://api.dropboxapi.com/2'
+    NotifyEndpoint = 'https://notify.dropboxapi.com/2'
+    PageLimit = 2000
+
+    supports_streaming = True
+
+    def __init__(self):
+        super().__init__()
+        self.client = None
+        self.account = None
+
+    def main(self):
+        '''Set up the specific features for this ingestor'''
+        self.parser.add_argument('--token', type=str, default=f'{self.data_dir}dropbox-token.json',
+                                 help='File containing the Dropbox access token')
+        self.parser.add_argument('--rate', type=float, default=None,
+                                 help='Maximum Dropbox API requests per second (default: no limit)')
+        add_profile_argument(self.parser)
+        self.parser.add_argument('--incremental', action='store_true', default=False,
+                                 help='Only fetch the changes since the saved cursor (writes a change stream)')
+        self.parser.add_argument('--watch', action='store_true', default=False,
+                                 help='After syncing, wait for changes with longpoll and record them as they happen')
+        self.parser.add_argument('--longpoll-timeout', type=int, default=480,
+                                 help='Seconds each longpoll waits for a change (30-480)')
+        self.parser.add_argument('--cursor-reset', action='store_true', default=False,
+                                 help='Discard the saved cursor and start again with a full listing')
+        self.args = self.parser.parse_args()
+        if self.args.cursor_reset:
+            self.reset_cursor()
+        super().main()
+        if self.args.watch:
+            self.watch()
+
+    def get_client(self) -> IndalekoHttpClient:
+        if self.client is None:
+            self.client = IndalekoHttpClient(token_provider=DropboxCredentials(self.args.token), rate=self.args.rate)
+        return self.client
+
+    def get_account_name(self) -> str:
+        if self.account is None:
+            self.account = self.get_client().post_json(f'{self.ApiEndpoint}/users/get_current_account')['email']
+        return self.account
+
+    def get_normalizer(self) -> DropboxNormalizer:
+        return DropboxNormalizer(self.get_account_name(), self.get_folder_file_name())
+
+    def get_cursor_file_name(self) -> str:
+        account = self.get_account_name().replace(' ', '_').replace(':', '-')
+        return os.path.join(self.data_dir, f'dropbox-cursor-{account}.json')
+
+    def get_folder_file_name(self) -> str:
+        '''The normalizer's folder map (path to ObjectIdentifier), kept with
+        the cursor so incremental runs can resolve folders listed earlier.'''
+        account = self.get_account_name().replace(' ', '_').replace(':', '-')
+        return os.path.join(self.data_dir, f'dropbox-folders-{account}.jsonl')
+
+    def _get_output_file(self) -> str:
+        '''This method returns the output file name'''
+        kind = 'changes' if self.args.incremental or self.args.watch else 'data'
+        return f'{self.data_dir}dropbox-{kind}-{self.get_account_name()}-{self.timestamp}.jsonl'.replace(' ', '_').replace(':', '-')
+
+    def load_cursor(self) -> str:
+        cursor_file = self.get_cursor_file_name()
+        if not os.path.exists(cursor_file):
+            return None
+        with open(cursor_file, 'rt') as fd:
+            return json.load(fd).get('cursor')
+
+    def save_cursor(self, cursor: str) -> None:
+        cursor_file = self.get_cursor_file_name()
+        state = {'cursor': cursor, 'timestamp': datetime.datetime.now(datetime.UTC).isoformat()}
+        with open(cursor_file + '.tmp', 'wt') as fd:
+            json.dump(state, fd, indent=4)
+        os.replace(cursor_file + '.tmp', cursor_file)
+
+    def reset_cursor(self) -> 'DropboxIngest':
+        cursor_file = self.get_cursor_file_name()
+        if os.path.exists(cursor_file):
+            os.remove(cursor_file)
+        return self
+
+    def list_folder(self, path: str = '') -> dict:
+        body = {'path': path, 'recursive': True, 'limit': self.PageLimit}
+        body.update(dropbox_list_folder_options(self.args.profile if self.args is not None else DefaultProfile))
+        return self.get_client().post_json(f'{self.ApiEndpoint}/files/list_folder', body)
+
+    def list_folder_continue(self, cursor: str) -> dict:
+        try:
+            return self.get_client().post_json(f'{self.ApiEndpoint}/files/list_folder/continue', {'cursor': cursor})
+        except IndalekoHttpError as e:
+            if e.status == 409 and 'reset' in e.text:
+                raise DropboxCursorReset(e.text) from e
+            raise
+
+    def longpoll(self, cursor: str) -> dict:
+        '''Wait until there are changes after cursor (or the timeout expires).
+        The notify endpoint is not authenticated: the cursor identifies the
+        account.'''
+        timeout = self.args.longpoll_timeout
+        try:
+            return self.get_client().post_json(f'{self.NotifyEndpoint}/files/list_folder/longpoll',
+                                               {'cursor': cursor, 'timeout': timeout},
+                                               authenticate=False, timeout=timeout + 90)
+        except IndalekoHttpError as e:
+            if e.status == 409 and 'reset' in e.text:
+                raise DropboxCursorReset(e.text) from e
+            raise
+
+    @staticmethod
+    def to_change(entry: dict) -> dict:
+        return {
+            'change': 'deleted' if entry['.tag'] == 'deleted' else 'changed',
+            'id': entry.get('id'),
+            'path': entry.get('path_lower'),
+            'item': entry,
+        }
+
+    def __start__(self, state: dict) -> tuple:
+        '''Returns the first page to record and whether it is a change stream.'''
+        if state is not None:
+            return self.list_folder_continue(state['cursor']), state['changes']
+        if self.args.incremental or self.args.watch:
+            cursor = self.load_cursor()
+            if cursor is not None:
+                try:
+                    return self.list_folder_continue(cursor), True
+                except DropboxCursorReset:
+                    logging.warning('Saved Dropbox cursor was reset, starting over with a full listing')
+                    self.reset_cursor()
+            else:
+                logging.info('No Dropbox cursor saved, listing the whole account')
+            # the output is a change stream, so the full listing is recorded
+            # as change records too
+            return self.list_folder(), True
+        return self.list_folder(), False
+
+    def stream_metadata(self, stream: IndalekoIngest.IndalekoCrawlStream):
+        '''Write each page as it arrives, checkpointing the list_folder
+        cursor.  The cursor is saved for the next incremental run only once
+        the listing has been completely written.'''
+        result, changes = self.__start__(stream.state)
+        while True:
+            entries = result['entries']
+            records = [self.to_change(entry) for entry in entries] if changes else entries
+            stream.record_page(records, {'cursor': result['cursor'], 'changes': changes})
+            if not result['has_more']:
+                break
+            result = self.list_folder_continue(result['cursor'])
+        self.save_cursor(result['cursor'])
+        self.get_client().log_metrics()
+
+    def __continue_or_list__(self, cursor: str) -> dict:
+        '''The changes after cursor, or a full listing if Dropbox has reset
+        it.'''
+        try:
+            return self.list_folder_continue(cursor)
+        except DropboxCursorReset:
+            logging.warning('Dropbox cursor was reset while watching, listing the whole account again')
+            self.reset_cursor()
+            return self.list_folder()
+
+    def watch(self) -> None:
+        '''Record changes as they happen, until interrupted.  Changes are
+        appended to the output file (and normalized into the spool with
+        --spool) and the cursor is saved after each page, so a restarted
+        watch picks up where this one stopped.'''
+        cursor = self.load_cursor()
+        assert cursor is not None, 'No Dropbox cursor to watch from'
+        self.stream = self.normalize_stream(
+            IndalekoIngest.IndalekoCrawlStream(self.output_file, serializer=self.get_serializer(), append=True))
+        print(f'Watching for changes, recording them to {self.output_file}')
+        try:
+            while True:
+                try:
+                    result = self.longpoll(cursor)
+                except DropboxCursorReset:
+                    result = {'changes': True}
+                if result.get('changes'):
+                    while True:
+                        page = self.__continue_or_list__(cursor)
+                        cursor = page['cursor']
+                        self.stream.record_page([self.to_change(entry) for entry in page['entries']],
+                                                {'cursor': cursor, 'changes': True})
+                        self.save_cursor(cursor)
+                        logging.info(f"Recorded {len(page['entries'])} changes")
+                        if not page['has_more']:
+                            break
+                if 'backoff' in result:
+                    time.sleep(result['backoff'])
+        except KeyboardInterrupt:
+            print(f'Stopped watching after {self.stream.get_count()} changes')
+        finally:
+            self.stream.finish()
+
+def main():
+    ingest = DropboxIngest()
+    ingest.main()
+
+
+if __name__ == '__main__':
+    main()
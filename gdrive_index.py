@@ -0,0 +1,378 @@
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+
+import IndalekoIngest
+from indaleko_http import IndalekoHttpClient, IndalekoHttpError
+from indaleko_normalize import GoogleDriveNormalizer
+from indaleko_projections import get_projection, drive_fields, add_profile_argument
+from indaleko_serialize import read_records
+
+'''
+Google Drive ingester (formerly old/gd-ingest.py).  The Drive API is called
+through the shared IndalekoHttpClient; the Google client libraries are only
+needed to obtain credentials and the account's e-mail address, so they are
+imported when those are first needed.
+
+* A full run lists the drive in --partitions modifiedTime ranges, fetched
+  concurrently, and writes the files as they arrive (resumable with
+  --resume.)  The changes feed position taken before the listing is saved
+  per account in data/.
+* --incremental starts from the saved position and fetches only the changes
+  (a change stream of {"change": "changed" | "removed", "id", "time",
+  "item"} records); without a saved position, or once it has expired, it
+  falls back to a full listing recorded as change records.
+'''
+
+
+class GoogleCredentialsTokenProvider:
+    '''Adapts google.oauth2 credentials to the token provider interface used
+    by IndalekoHttpClient.  The token is refreshed proactively when it is
+    about to expire.'''
+
+    def __init__(self, creds: 'Credentials', margin: int = 300):
+        self.creds = creds
+        self.margin = margin
+
+    def get_token(self) -> str:
+        expiry = self.creds.expiry
+        if not self.creds.token or (expiry is not None and expiry - datetime.timedelta(seconds=self.margin) < datetime.datetime.utcnow()):
+            from google.auth.transport.requests import Request
+            self.creds.refresh(Request())
+        return self.creds.token
+
+    def clear_token(self) -> 'GoogleCredentialsTokenProvider':
+        self.creds.token = None
+        return self
+
+
+class GoogleDriveIngest(IndalekoIngest.IndalekoIngest):
+    '''This is the ingestor for Google Drive.'''
+
+    SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly',
+              'https://www.googleapis.com/auth/userinfo.profile',
+              'openid',
+              'https://www.googleapis.com/auth/userinfo.email']
+
+    FILE_METADATA_FIELDS = get_projection('gdrive', 'full')
+
+    DriveEndpoint = 'https://www.googleapis.com/drive/v3'
+
+    supports_streaming = True
+
+    # lower bound of the modifiedTime partitions; older files fall in the
+    # first (open ended) partition
+    PartitionStart = datetime.datetime(2010, 1, 1)
+
+    def __init__(self):
+        super().__init__()
+        self.gdrive_creds = None
+        self.email = None
+        self.client = None
+
+    def _get_output_file(self) -> str:
+        '''This method returns the output file name'''
+        kind = 'changes-' if self.args.incremental else ''
+        return f'{self.data_dir}gdrive-{kind}{self.get_email()}-{self.timestamp}.jsonl'.replace(' ', '_').replace(':', '-')
+
+    def main(self):
+        '''Set up the specific features for this ingestor'''
+        self.parser.add_argument('--creds', type=str, default=f'{self.config_dir}gdrive-credentials.json',
+                                 help='Name of the credentials file')
+        self.parser.add_argument('--token', type=str, default=f'{self.config_dir}gdrive-token.json',
+                                 help='Where the temporary token should be stored')
+        self.parser.add_argument('--rate', type=float, default=None,
+                                 help='Maximum Drive API requests per second (default: no limit)')
+        add_profile_argument(self.parser)
+        self.parser.add_argument('--workers', type=int, default=8,
+                                 help='Number of listing partitions fetched concurrently')
+        self.parser.add_argument('--partitions', type=int, default=16,
+                                 help='Number of modifiedTime ranges the full listing is split into (1 = serial listing)')
+        self.parser.add_argument('--incremental', action='store_true', default=False,
+                                 help='Only fetch the files changed or removed since the last run (writes a change stream)')
+        self.parser.add_argument('--changes-reset', action='store_true', default=False,
+                                 help='Discard the saved start page token so the next run lists the whole drive')
+        self.args = self.parser.parse_args()
+        if self.args.changes_reset:
+            self.reset_start_page_token()
+        super().main()
+
+    def get_client(self) -> IndalekoHttpClient:
+        if self.client is None:
+            if self.gdrive_creds is None:
+                self._get_credentials()
+            self.client = IndalekoHttpClient(token_provider=GoogleCredentialsTokenProvider(self.gdrive_creds),
+                                             rate=self.args.rate if self.args is not None else None)
+        return self.client
+
+    def get_metadata(self):
+        '''This method extracts the metadata from the Google Drive API'''
+        client = self.get_client()
+        page_token = None
+        field_to_use = drive_fields(self.args.profile if self.args is not None else 'full')
+        self.metadata = []
+
+        while True:
+            params = {'fields': field_to_use, 'pageSize': 1000}
+            if page_token is not None:
+                params['pageToken'] = page_token
+            results = client.get_json(f'{self.DriveEndpoint}/files', params=params)
+            self.metadata.extend(results.get('files', []))
+            page_token = results.get('nextPageToken', None)
+            if not page_token:
+                break
+        client.log_metrics()
+        return self.metadata
+
+
+    def get_normalizer(self) -> GoogleDriveNormalizer:
+        return GoogleDriveNormalizer(self.get_email())
+
+    def get_changes_state_file_name(self) -> str:
+        '''The changes feed start page token is saved per account.'''
+        return f'{self.data_dir}gdrive-changes-{self.get_email()}.json'.replace(' ', '_').replace(':', '-')
+
+    def load_start_page_token(self) -> str:
+        state_file = self.get_changes_state_file_name()
+        if not os.path.exists(state_file):
+            return None
+        with open(state_file, 'rt') as fd:
+            return json.load(fd).get('startPageToken')
+
+    def save_start_page_token(self, token: str) -> None:
+        state_file = self.get_changes_state_file_name()
+        state = {'startPageToken': token, 'timestamp': datetime.datetime.utcnow().isoformat()}
+        with open(state_file + '.tmp', 'wt') as fd:
+            json.dump(state, fd, indent=4)
+        os.replace(state_file + '.tmp', state_file)
+
+    def reset_start_page_token(self) -> 'GoogleDriveIngest':
+        state_file = self.get_changes_state_file_name()
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        return self
+
+    def get_start_page_token(self) -> str:
+        '''The changes feed position as of now.'''
+        return self.get_client().get_json(f'{self.DriveEndpoint}/changes/startPageToken')['startPageToken']
+
+    @staticmethod
+    def to_change(file: dict = None, change: dict = None) -> dict:
+        '''Change stream record, from either a changes feed entry or (for a
+        full listing in incremental mode) a file.'''
+        if change is None:
+            return {'change': 'changed', 'id': file['id'], 'time': file.get('modifiedTime'), 'item': file}
+        removed = change.get('removed', False) or change.get('file', {}).get('trashed', False)
+        return {'change': 'removed' if removed else 'changed', 'id': change['fileId'], 'time': change.get('time'), 'item': change.get('file')}
+
+    def stream_metadata(self, stream: IndalekoIngest.IndalekoCrawlStream):
+        '''Write each page as it arrives, checkpointing the page token so an
+        interrupted run resumes where it stopped.  In incremental mode only
+        the changes since the saved start page token are fetched; the whole
+        drive is listed only on the first run or when the token has
+        expired.'''
+        state = stream.state
+        if state is None and self.args.incremental:
+            token = self.load_start_page_token()
+            if token is not None:
+                state = {'feed': 'changes', 'pageToken': token}
+            else:
+                logging.info('No start page token saved, listing the whole drive')
+        if state is not None and state.get('feed') == 'changes':
+            try:
+                self.stream_changes(stream, state['pageToken'])
+                return
+            except IndalekoHttpError as e:
+                # Drive rejects page tokens it no longer has history for
+                if e.status not in (400, 404, 410) or stream.get_count() > 0:
+                    raise
+                logging.warning(f'Start page token expired ({e.status}), listing the whole drive')
+                self.reset_start_page_token()
+                state = None
+        self.stream_files(stream, state)
+
+    @staticmethod
+    def partition_queries(count: int, start: datetime.datetime = None, end: datetime.datetime = None) -> list:
+        '''Split the drive into count disjoint q= filters on modifiedTime,
+        so the partitions can be listed independently (each has its own
+        pageToken chain.)  The ranges are equal slices of [start, end), with
+        the first and last open ended.'''
+        if count <= 1:
+            return [None]
+        if start is None:
+            start = GoogleDriveIngest.PartitionStart
+        if end is None:
+            end = datetime.datetime.utcnow()
+        step = (end - start) / (count - 1)
+        bounds = [(start + step * i).strftime('%Y-%m-%dT%H:%M:%S') for i in range(count - 1)]
+        queries = [f"modifiedTime < '{bounds[0]}'"]
+        queries.extend(f"modifiedTime >= '{low}' and modifiedTime < '{high}'" for low, high in zip(bounds, bounds[1:]))
+        queries.append(f"modifiedTime >= '{bounds[-1]}'")
+        return queries
+
+    def list_files(self, q: str, page_token: str) -> dict:
+        '''One page of the listing of partition q.'''
+        params = {'fields': drive_fields(self.args.profile), 'pageSize': 1000}
+        if q is not None:
+            params['q'] = q
+        if page_token is not None:
+            params['pageToken'] = page_token
+        return self.get_client().get_json(f'{self.DriveEndpoint}/files', params=params)
+
+    @staticmethod
+    def __upgrade_state__(state: dict) -> dict:
+        '''Converts a checkpoint of an unpartitioned listing (one pageToken
+        chain, as written before the listing was partitioned) into the
+        partitioned form: a single partition covering the whole drive.'''
+        if 'partitions' in state:
+            return state
+        if 'pageToken' not in state:
+            raise ValueError(f'Unrecognized checkpoint state {state}; start a new listing instead of resuming')
+        logging.warning('Resuming an unpartitioned listing; it continues as a single partition')
+        return {'feed': 'files', 'startPageToken': state.get('startPageToken'), 'partitions': {'None': state['pageToken']}}
+
+    def __open_seen_ids__(self, stream: IndalekoIngest.IndalekoCrawlStream, resume: bool) -> tuple:
+        '''The ids already written (a set) and the file they are appended to.
+        The ids are kept next to the output, one per line, and written before
+        the page is checkpointed, so on resume the first get_count() lines
+        are exactly the ids of the records in the output.'''
+        ids_file = stream.output_file + '.ids'
+        seen = set()
+        if not resume:
+            return seen, open(ids_file, 'wt')
+        if os.path.exists(ids_file):
+            with open(ids_file, 'r+t') as fd:
+                for _ in range(stream.get_count()):
+                    line = fd.readline()
+                    if not line.endswith('\n'):
+                        break
+                    seen.add(line[:-1])
+                fd.truncate(fd.tell())
+        if len(seen) < stream.get_count():
+            # no (complete) ids file: take the ids from the output itself
+            seen = set(record['id'] for record in read_records(stream.output_file, self.get_serializer()))
+            with open(ids_file, 'wt') as fd:
+                fd.writelines(f'{identifier}\n' for identifier in seen)
+        return seen, open(ids_file, 'at')
+
+    def stream_files(self, stream: IndalekoIngest.IndalekoCrawlStream, state: dict = None):
+        '''Full listing.  The drive is split into --partitions q= filters
+        that are listed concurrently by --workers threads; pages are written
+        (and checkpointed) from this thread as they complete.  A file can move
+        between partitions while the listing runs, so results are
+        deduplicated by id (the ids written so far are kept next to the
+        output, so a resumed run does not read the output back.)
+
+        The changes feed position is taken before the listing starts, so
+        changes made while it runs are picked up by the next incremental
+        run.'''
+        client = self.get_client()
+        if state is None:
+            state = {
+                'feed': 'files',
+                'startPageToken': self.get_start_page_token(),
+                # remaining partitions: q -> next pageToken (None = first page)
+                'partitions': {str(q): None for q in self.partition_queries(self.args.partitions)},
+            }
+        else:
+            state = self.__upgrade_state__(state)
+        seen, ids_fd = self.__open_seen_ids__(stream, stream.state is not None)
+        start_page_token = state.get('startPageToken')
+        remaining = dict(state['partitions'])
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.args.workers) as executor:
+            pending = {}
+            for q, page_token in remaining.items():
+                pending[executor.submit(self.list_files, None if q == 'None' else q, page_token)] = q
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                records = []
+                for future in done:
+                    q = pending.pop(future)
+                    results = future.result()
+                    for file in results.get('files', []):
+                        if file['id'] in seen:
+                            continue
+                        seen.add(file['id'])
+                        records.append(self.to_change(file=file) if self.args.incremental else file)
+                    page_token = results.get('nextPageToken', None)
+                    if page_token:
+                        remaining[q] = page_token
+                        pending[executor.submit(self.list_files, None if q == 'None' else q, page_token)] = q
+                    else:
+                        del remaining[q]
+                ids_fd.writelines(f"{record['id']}\n" for record in records)
+                ids_fd.flush()
+                stream.record_page(records, {'feed': 'files', 'startPageToken': start_page_token, 'partitions': dict(remaining)})
+        ids_fd.close()
+        os.remove(ids_fd.name)
+        logging.info(f'Listed {len(seen)} files')
+        if start_page_token is not None:
+            self.save_start_page_token(start_page_token)
+        client.log_metrics()
+
+    def stream_changes(self, stream: IndalekoIngest.IndalekoCrawlStream, page_token: str):
+        '''Changes feed: only files changed or removed since page_token.'''
+        client = self.get_client()
+        field_to_use = f"nextPageToken, newStartPageToken, changes(changeType, removed, fileId, time, {drive_fields(self.args.profile, container='file', prefix=None)})"
+        while True:
+            params = {'pageToken': page_token, 'fields': field_to_use, 'pageSize': 1000,
+                      'includeRemoved': 'true', 'spaces': 'drive'}
+            results = client.get_json(f'{self.DriveEndpoint}/changes', params=params)
+            changes = [self.to_change(change=change) for change in results.get('changes', []) if change.get('changeType', 'file') == 'file']
+            if 'nextPageToken' in results:
+                page_token = results['nextPageToken']
+                stream.record_page(changes, {'feed': 'changes', 'pageToken': page_token})
+                continue
+            stream.record_page(changes, {'feed': 'changes', 'pageToken': results['newStartPageToken']})
+            self.save_start_page_token(results['newStartPageToken'])
+            break
+        client.log_metrics()
+
+    def _get_credentials(self) -> None:
+        '''This method obtains credentials if we have them stored, fetches new
+        ones if we don't, and refreshes the token upon expiration. The token is
+        stored in the given file.'''
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+        if os.path.exists(self.args.token):
+            self.gdrive_creds = Credentials.from_authorized_user_file(self.args.token, GoogleDriveIngest.SCOPES)
+        if not self.gdrive_creds or not self.gdrive_creds.valid:
+            if self.gdrive_creds and self.gdrive_creds.expired and self.gdrive_creds.refresh_token:
+                self.gdrive_creds.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    self.args.creds, GoogleDriveIngest.SCOPES)
+                self.gdrive_creds = flow.run_local_server(port=0, prompt='consent')
+            with open(self.args.token, 'wt') as token:
+                token.write(self.gdrive_creds.to_json())
+
+    def get_email(self) -> str:
+        '''This method returns the email address associated with the
+        credentials'''
+        if self.email is None:
+            if self.gdrive_creds is None:
+                self._get_credentials()
+            from googleapiclient.discovery import build
+            service = build('people', 'v1', credentials=self.gdrive_creds)
+            results = service.people().get(resourceName='people/me', personFields='emailAddresses').execute()
+            email='dummy@dummy.com'
+            if 'emailAddresses' not in results:
+                logging.warning('No email addresses found in %s', results)
+            else:
+                if len(results['emailAddresses']) > 1:
+                    logging.info('More than one email address found in %s', results)
+                email = results['emailAddresses'][0]['value']
+            self.email = email
+        return self.email
+
+
+def main():
+    ingest = GoogleDriveIngest()
+    ingest.main()
+
+
+if __name__ == '__main__':
+    main()
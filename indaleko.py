@@ -46,6 +46,23 @@ system, we have strived to "keep it simple" yet focus on allowing us to explore
 a broad range of storage systems, semantic transducers, and activity data sources.
 '''
 
+# Namespace for the name based (uuid5) identifiers.  An object's
+# ObjectIdentifier is the name based UUID of its URI, so anything that can
+# build the URI can compute the identifier without a lookup (see
+# indaleko_normalize for the URIs of cloud items and local_index for local
+# files.)  A relationship's key is derived from its two objects and its type,
+# so writing the same relationship twice yields the same document.
+IndalekoNamespace = uuid.UUID('3f5a0f4c-3c2e-4b49-9c1e-7c8a8f4e2d61')
+
+
+def object_identifier(uri : str) -> str:
+    return str(uuid.uuid5(IndalekoNamespace, uri))
+
+
+def relationship_key(object1 : str, relationship : str, object2 : str) -> str:
+    return str(uuid.uuid5(IndalekoNamespace, f'{object1}/{relationship}/{object2}'))
+
+
 class IndalekoObject:
     '''
     This defines the information that makes up an Indaleko Object (the
@@ -107,6 +124,11 @@ class IndalekoObject:
                     "contentEncoding" : "base64",
                     "contentMediaType" : "application/octet-stream",
                 },
+                "RawDataDigest" : {
+                    "type" : "string",
+                    "description" : "SHA-256 (hex) of the raw data captured for this object, which is kept in the blob store instead of RawData.",
+                    "pattern" : "^[0-9a-f]{64}$",
+                },
                 "SemanticAttributes" : {
                     "type" : "array",
                     "description" : "Semantic attributes associated with this object.",
@@ -136,6 +158,98 @@ class IndalekoObject:
         }
     }
 
+    __slots__ = ('label', 'uri', 'object_identifier', 'local_identifier', 'timestamps', 'size',
+                 'raw_data', 'semantic_attributes', 'key', 'raw_data_digest')
+
+    # (attribute, document field) pairs; the first four fields are required
+    Fields = (
+        ('uri', 'URI'),
+        ('object_identifier', 'ObjectIdentifier'),
+        ('timestamps', 'Timestamps'),
+        ('size', 'Size'),
+        ('label', 'Label'),
+        ('local_identifier', 'LocalIdentifier'),
+        ('raw_data', 'RawData'),
+        ('semantic_attributes', 'SemanticAttributes'),
+        ('key', '_key'),
+        ('raw_data_digest', 'RawDataDigest'),
+    )
+
+    def __init__(self, uri : str, object_identifier : str, timestamps : list, size : int,
+                 label : str = None, local_identifier : str = None, raw_data : str = None,
+                 semantic_attributes : list = None, key : str = None, raw_data_digest : str = None) -> None:
+        '''A runtime Indaleko object.  Instances use __slots__ (no per
+        instance __dict__), so they are smaller than the equivalent document
+        dicts; to_dict() produces the document.
+        Timestamps and SemanticAttributes are kept in their document form
+        (lists of {Label, Value} and {UUID, Data}), and RawData stays base64
+        encoded.  key is the database document key, if there is one.  When
+        the raw data is in the blob store (indaleko_blobstore), raw_data is
+        None and raw_data_digest names the blob.'''
+        self.uri = uri
+        self.object_identifier = object_identifier
+        self.timestamps = timestamps
+        self.size = size
+        self.label = label
+        self.local_identifier = local_identifier
+        self.raw_data = raw_data
+        self.semantic_attributes = semantic_attributes
+        self.key = key
+        self.raw_data_digest = raw_data_digest
+
+    def to_dict(self) -> dict:
+        '''The document for this object; optional fields that are not set
+        are left out.'''
+        document = {
+            'URI': self.uri,
+            'ObjectIdentifier': self.object_identifier,
+            'Timestamps': self.timestamps,
+            'Size': self.size,
+        }
+        if self.label is not None:
+            document['Label'] = self.label
+        if self.local_identifier is not None:
+            document['LocalIdentifier'] = self.local_identifier
+        if self.raw_data is not None:
+            document['RawData'] = self.raw_data
+        if self.semantic_attributes is not None:
+            document['SemanticAttributes'] = self.semantic_attributes
+        if self.key is not None:
+            document['_key'] = self.key
+        if self.raw_data_digest is not None:
+            document['RawDataDigest'] = self.raw_data_digest
+        return document
+
+    @classmethod
+    def from_dict(cls, document : dict) -> 'IndalekoObject':
+        '''Builds an object from a document (fields outside the schema, such
+        as _id and _rev, are ignored.)'''
+        get = document.get
+        return cls(document['URI'], document['ObjectIdentifier'], document['Timestamps'], document['Size'],
+                   get('Label'), get('LocalIdentifier'), get('RawData'), get('SemanticAttributes'), get('_key'),
+                   get('RawDataDigest'))
+
+    @classmethod
+    def to_dicts(cls, objects : list) -> list:
+        return [obj.to_dict() for obj in objects]
+
+    @classmethod
+    def from_dicts(cls, documents : list) -> list:
+        from_dict = cls.from_dict
+        return [from_dict(document) for document in documents]
+
+    def __eq__(self, other : object) -> bool:
+        if not isinstance(other, IndalekoObject):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field, _ in self.Fields)
+
+    def __repr__(self) -> str:
+        return f'IndalekoObject({self.uri!r}, {self.object_identifier!r})'
+
+    def __str__(self) -> str:
+        return json.dumps(self.to_dict())
+
+
 class IndalekoRelationship:
     '''
     This schema defines the fields that are required as part of identifying
@@ -188,6 +302,61 @@ class IndalekoRelationship:
         },
     }
 
+    __slots__ = ('object1', 'object2', 'relationship', 'metadata', 'key')
+
+    def __init__(self, object1 : str, object2 : str, relationship : str, metadata : list = None,
+                 key : str = None) -> None:
+        '''A runtime relationship between two objects (by ObjectIdentifier),
+        using __slots__ like IndalekoObject.  It is stored as an edge in the
+        Relationships collection, with _from and _to pointing at object1 and
+        object2 in Objects; the key defaults to relationship_key() of the two
+        objects and the relationship.'''
+        self.object1 = object1
+        self.object2 = object2
+        self.relationship = relationship
+        self.metadata = metadata
+        self.key = key if key is not None else relationship_key(object1, relationship, object2)
+
+    def to_dict(self) -> dict:
+        document = {
+            '_key': self.key,
+            '_from': f'Objects/{self.object1}',
+            '_to': f'Objects/{self.object2}',
+            'object1': self.object1,
+            'object2': self.object2,
+            'relationship': self.relationship,
+        }
+        if self.metadata is not None:
+            document['metadata'] = self.metadata
+        return document
+
+    @classmethod
+    def from_dict(cls, document : dict) -> 'IndalekoRelationship':
+        return cls(document['object1'], document['object2'], document['relationship'],
+                   document.get('metadata'), document.get('_key'))
+
+    @classmethod
+    def to_dicts(cls, relationships : list) -> list:
+        return [relationship.to_dict() for relationship in relationships]
+
+    @classmethod
+    def from_dicts(cls, documents : list) -> list:
+        from_dict = cls.from_dict
+        return [from_dict(document) for document in documents]
+
+    def __eq__(self, other : object) -> bool:
+        if not isinstance(other, IndalekoRelationship):
+            return NotImplemented
+        return (self.object1, self.object2, self.relationship, self.metadata, self.key) == \
+               (other.object1, other.object2, other.relationship, other.metadata, other.key)
+
+    def __repr__(self) -> str:
+        return f'IndalekoRelationship({self.object1!r}, {self.object2!r}, {self.relationship!r})'
+
+    def __str__(self) -> str:
+        return json.dumps(self.to_dict())
+
+
 class IndalekoSource:
         '''This schema defines the fields that are required as part of this
         metadata.  Additional (optional) metadata can be included.'''
@@ -225,19 +394,36 @@ class IndalekoSource:
                 raise TypeError('version must be a string')
             self.__version = version
             ## now we have internal fields that are not part of the stored data type
-            if type(description) is not str and type(description) is not None:
+            if type(description) is not str and description is not None:
                 raise TypeError('description must be a string or None')
             self.__description = description
-            self.__db_key = datetime.datetime.utcnow() # preserve date this was created
+            self.__created = datetime.datetime.utcnow() # preserve date this was created
+            self.__db_key = None # not known until stored in (or loaded from) the Sources collection
 
-            def to_dict(self) -> dict:
-                return {
-                    'SourceIdentifier': str(self.__identifier),
-                    'Version': self.__version,
-                }
 
-            def __str__(self) -> str:
-                return json.dumps(self.to_dict())
+        @staticmethod
+        def from_dict(document : dict) -> 'IndalekoSource':
+            '''Builds a source from a Sources collection document (the schema
+            fields, identifier and version, or the to_dict() fields.)'''
+            identifier = document.get('identifier', document.get('SourceIdentifier'))
+            version = document.get('version', document.get('Version'))
+            source = IndalekoSource(uuid.UUID(identifier), version, document.get('description', document.get('Description')))
+            return source.set_db_key(document.get('_key', document.get('DBKey')))
+
+
+        def to_document(self) -> dict:
+            '''The document stored in the Sources collection.'''
+            document = {
+                'identifier': str(self.__identifier),
+                'version': self.__version,
+            }
+            if self.__description is not None:
+                document['description'] = self.__description
+            return document
+
+
+        def get_created(self) -> datetime.datetime:
+            return self.__created
 
 
         def set_db_key(self, db_key : str) -> 'IndalekoSource':
@@ -290,20 +476,38 @@ class IndalekoRecord:
 
     keyword_map = (
         ('__raw_data__', 'Data'),
+        ('__raw_data_digest__', 'DataDigest'),
         ('__attributes__', 'Attributes'),
         ('__source__', 'Source'),
     )
 
+    __slots__ = ('__raw_data__', '__raw_data_digest__', '__attributes__', '__source__')
+
     def __init__(self, raw_data : bytes, attributes : dict, source : IndalekoSource) -> None:
         self.__raw_data__ = raw_data
         self.__attributes__ = attributes
         self.__source__ = source
 
+    def store_raw_data(self, blob_store) -> 'IndalekoRecord':
+        '''Move the raw data into a blob store (see indaleko_blobstore); the
+        record keeps only its digest.'''
+        if hasattr(self, '__raw_data__'):
+            self.__raw_data_digest__ = blob_store.put(self.__raw_data__)
+            del self.__raw_data__
+        return self
+
+    def get_raw_data(self, blob_store = None):
+        '''The raw data: inline, or a memoryview from the blob store.'''
+        if hasattr(self, '__raw_data__'):
+            return self.__raw_data__
+        assert blob_store is not None, 'The raw data of this record is in a blob store'
+        return blob_store.get(self.__raw_data_digest__)
+
     def to_json(self):
         tmp = {}
         for field, keyword in self.keyword_map:
             if hasattr(self, field):
-                tmp[keyword] = self.__dict__[field]
+                tmp[keyword] = getattr(self, field)
         return json.dumps(tmp, indent=4)
 
 
@@ -497,11 +701,57 @@ class Indaleko:
         pass
 
 
+# The indaleko command line: each subcommand is the main() of one of the
+# scripts, which is only imported when that subcommand is run (so the cost of
+# importing the database client, MSAL and so on is only paid by the commands
+# that use them.)
+Commands = {
+    'setup' : ('dbsetup', 'Set up and start the database'),
+    'collections' : ('indalekocolletions', 'Check the Indaleko collections'),
+    'machine-config' : ('get_machine_config', 'Capture the machine configuration (Windows)'),
+    'index-linux' : ('linux_local_index', 'Index a local Linux file system'),
+    'index-windows' : ('windows_local_index', 'Index a local Windows file system'),
+    'onedrive' : ('onedrive_index', 'Index a OneDrive account'),
+    'dropbox' : ('dropbox_index', 'Index a Dropbox account'),
+    'gdrive' : ('gdrive_index', 'Index a Google Drive account'),
+    'multi-account' : ('multi_account_index', 'Index several cloud accounts concurrently'),
+    'normalize' : ('indaleko_normalize', 'Normalize cloud metadata into Indaleko objects'),
+    'reconcile' : ('indaleko_reconcile', 'Link locally synced files to their cloud items'),
+    'spool' : ('indaleko_spool', 'Upload spooled batches to the database'),
+    'blobs' : ('indaleko_blobstore', 'Inspect or check a raw data blob store'),
+    'queries' : ('indaleko_queries', 'Run the named queries'),
+    'replay' : ('indaleko_replay', 'Serve recorded cloud APIs locally'),
+    'db-benchmark' : ('indaleko_db_benchmark', 'Benchmark database ingestion'),
+    'serialize-benchmark' : ('indaleko_serialize', 'Compare the serialization formats'),
+    'model-benchmark' : ('indaleko_model_benchmark', 'Compare the runtime classes with document dicts'),
+    'startup-benchmark' : ('indaleko_startup', 'Measure the start up time of the commands'),
+}
+
+
+def run_command(command : str, arguments : list) -> Any:
+    '''Import the module for a subcommand and run its main() with the given
+    arguments.'''
+    import importlib
+    import sys
+    module = importlib.import_module(Commands[command][0])
+    sys.argv = [f'indaleko {command}'] + list(arguments)
+    return module.main()
+
+
 def main():
-    parser = argparse.ArgumentParser()
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] in Commands:
+        run_command(sys.argv[1], sys.argv[2:])
+        return
+    epilog = 'commands:\n' + '\n'.join(f'  {name:<22}{description}' for name, (_, description) in Commands.items())
+    parser = argparse.ArgumentParser(prog='indaleko', usage='%(prog)s [-h] [--version] COMMAND ...',
+                                     epilog=epilog + '\n\nRun "indaleko COMMAND --help" for the options of a command.',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('--version', action='version', version='%(prog)s 1.0')
-    args = parser.parse_args()
-    print(args)
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        parser.error(f'unknown command {sys.argv[1]}')
+    parser.parse_args()
+    parser.print_help()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,174 @@
+import argparse
+import hashlib
+import logging
+import mmap
+import os
+import threading
+
+from indaleko_serialize import get_serializer
+
+'''
+Content addressed store for the raw data captured with each object.  Objects
+used to carry their raw data inline (RawData, base64), which makes every
+document about a third larger than the data itself and means every fetch of
+an object carries the blob along with it.  With a blob store the raw data is
+written once to a local file named by its SHA-256 digest and the object
+carries only the digest (RawDataDigest); identical payloads (the same item
+captured by repeated crawls, for instance) are stored once.
+
+Blobs live in a sharded directory tree, so that no directory grows too large:
+
+    <root>/ab/cd/abcd...   (the full hex digest)
+
+A small index (index.jsonl, one {"digest", "size"} record per blob, appended
+as blobs are added) lets the store report what it holds without walking the
+tree; rebuild_index() recreates it from the tree if it is lost.
+
+Reads map the blob file (read only) and return a memoryview over it, so the
+data is not copied until the caller needs it to be.
+'''
+
+
+class IndalekoBlobStore:
+    '''A directory of content addressed blobs.'''
+
+    DefaultBlobDir = './data/blobs'
+    IndexFile = 'index.jsonl'
+
+    def __init__(self, root: str = DefaultBlobDir, shard_depth: int = 2) -> None:
+        '''Parameters:
+            root: directory holding the blobs and the index
+
+            shard_depth: levels of two hex digit directories above each blob
+        '''
+        self.root = root
+        self.shard_depth = shard_depth
+        self.lock = threading.Lock()
+        self.serializer = get_serializer()
+        self.stored = 0
+        self.duplicates = 0
+        os.makedirs(self.root, exist_ok=True)
+        self.index_file = os.path.join(self.root, self.IndexFile)
+        self.index = self.__load_index__()
+
+    def __load_index__(self) -> dict:
+        index = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'rb') as fd:
+                for entry in self.serializer.read_records(fd):
+                    index[entry['digest']] = entry['size']
+        return index
+
+    @staticmethod
+    def get_digest(data) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def get_path(self, digest: str) -> str:
+        shards = [digest[2 * level:2 * level + 2] for level in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, digest)
+
+    def __contains__(self, digest: str) -> bool:
+        return digest in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get_size(self, digest: str) -> int:
+        return self.index[digest]
+
+    def put(self, data) -> str:
+        '''Store data (bytes or any buffer) and return its digest.  Data that
+        is already stored is not written again.'''
+        digest = self.get_digest(data)
+        with self.lock:
+            if digest in self.index:
+                self.duplicates += 1
+                return digest
+        path = self.get_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp, 'wb') as fd:
+                fd.write(data)
+            os.replace(temp, path)
+        with self.lock:
+            if digest not in self.index:
+                self.index[digest] = len(data)
+                with open(self.index_file, 'ab') as fd:
+                    fd.write(self.serializer.encode({'digest': digest, 'size': len(data)}))
+                self.stored += 1
+        return digest
+
+    def get(self, digest: str) -> memoryview:
+        '''The blob's contents, as a read only memoryview over the mapped
+        file.  The mapping is released when the memoryview (and any slices of
+        it) are released.'''
+        path = self.get_path(digest)
+        if not os.path.exists(path):
+            raise KeyError(f'Blob {digest} is not in {self.root}')
+        with open(path, 'rb') as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return memoryview(b'')
+            return memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def get_bytes(self, digest: str) -> bytes:
+        with self.get(digest) as view:
+            return view.tobytes()
+
+    def verify(self, digest: str) -> bool:
+        '''True if the stored blob still hashes to its name.'''
+        with self.get(digest) as view:
+            return self.get_digest(view) == digest
+
+    def rebuild_index(self) -> 'IndalekoBlobStore':
+        '''Recreate the index from the blobs on disk.'''
+        index = {}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if len(name) == 64 and directory != self.root:
+                    index[name] = os.path.getsize(os.path.join(directory, name))
+        with self.lock:
+            with open(self.index_file + '.tmp', 'wb') as fd:
+                for digest, size in index.items():
+                    fd.write(self.serializer.encode({'digest': digest, 'size': size}))
+            os.replace(self.index_file + '.tmp', self.index_file)
+            self.index = index
+        return self
+
+    def get_stats(self) -> dict:
+        return {
+            'blobs': len(self.index),
+            'bytes': sum(self.index.values()),
+            'stored': self.stored,
+            'duplicates': self.duplicates,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or check a raw data blob store')
+    parser.add_argument('--root', default=IndalekoBlobStore.DefaultBlobDir, help='Blob store directory')
+    parser.add_argument('--verify', action='store_true', default=False, help='Check that every blob matches its digest')
+    parser.add_argument('--rebuild-index', action='store_true', default=False, help='Recreate the index from the blobs on disk')
+    parser.add_argument('--get', default=None, metavar='DIGEST', help='Write the contents of one blob to stdout')
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING, help='Logging level to use')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    store = IndalekoBlobStore(args.root)
+    if args.rebuild_index:
+        store.rebuild_index()
+    if args.get is not None:
+        import sys
+        with store.get(args.get) as view:
+            sys.stdout.buffer.write(view)
+        return
+    if args.verify:
+        bad = [digest for digest in store.index if not store.verify(digest)]
+        for digest in bad:
+            print(f'Blob {digest} does not match its digest')
+        print(f'{len(store) - len(bad)} of {len(store)} blobs verified')
+    stats = store.get_stats()
+    print(f"{stats['blobs']} blobs, {stats['bytes']} bytes in {args.root}")
+
+
+if __name__ == '__main__':
+    main()
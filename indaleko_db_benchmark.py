@@ -0,0 +1,233 @@
+import argparse
+import base64
+import concurrent.futures
+import csv
+import datetime
+import json
+import logging
+import os
+import random
+import time
+import uuid
+
+from indaleko_memorydb import IndalekoMemoryCollection
+from indaleko_normalize import CreationTimestamp, ModificationTimestamp, AccessTimestamp
+
+'''
+Database write benchmark.  This generalizes the old one-off insert tests
+(old/arangodb-insert-test.py and friends): rather than timing a single
+insert_many of UUIDs, it sweeps write strategies, batch sizes and client
+concurrency using documents shaped like IndalekoObject, and writes one CSV
+row per configuration.
+
+Strategies:
+
+* single - one insert call per document
+* batch - insert_many per batch
+* import - bulk import (import_bulk) per batch
+* upsert - IndalekoCollection.upsert_batch per batch.  Before it is timed
+  the collection is loaded with --preload of the documents, which the timed
+  run then writes again with changed contents, so it measures the update
+  path as well as inserts.
+
+Documents are generated from --seed, so runs are reproducible.
+
+It runs against the in-memory stand-in (--backend memory, optionally with a
+simulated round trip latency) or a real ArangoDB server (--backend arango,
+using the usual Indaleko database config.)
+'''
+
+Strategies = ('single', 'batch', 'import', 'upsert')
+
+
+def make_object(index: int, run_id: str, rng: random.Random) -> dict:
+    '''Generate a document that looks like an ingested local file.'''
+    directory = index // 100
+    name = f'file-{index:08d}.{rng.choice(("txt", "docx", "jpg", "py", "pdf"))}'
+    timestamp = datetime.datetime(2023, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 365 * 86400))
+    accessed = timestamp + datetime.timedelta(seconds=rng.randint(0, 86400))
+    size = rng.randint(0, 1 << 24)
+    raw = json.dumps({'st_size': size, 'st_ino': index, 'st_mode': 33188, 'file': name, 'path': f'/bench/{run_id}/dir-{directory}'})
+    return {
+        'Label': name,
+        'URI': f'file:///bench/{run_id}/dir-{directory}/{name}',
+        'ObjectIdentifier': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'LocalIdentifier': f'{run_id}:{index}',
+        'Timestamps': [
+            {'Label': CreationTimestamp, 'Value': timestamp.isoformat()},
+            {'Label': ModificationTimestamp, 'Value': timestamp.isoformat()},
+            {'Label': AccessTimestamp, 'Value': accessed.isoformat()},
+        ],
+        'Size': size,
+        'RawData': base64.b64encode(raw.encode('utf-8')).decode('ascii'),
+        'SemanticAttributes': [],
+    }
+
+
+def modify_object(document: dict, rng: random.Random) -> dict:
+    '''The same object (same URI and identifiers) after its file changed.'''
+    accessed = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=rng.randint(0, 365 * 86400))
+    document = dict(document)
+    document['Size'] = rng.randint(0, 1 << 24)
+    document['Timestamps'] = document['Timestamps'][:2] + [{'Label': AccessTimestamp, 'Value': accessed.isoformat()}]
+    return document
+
+
+class ArangoBenchmarkTarget:
+    '''Adapts an IndalekoCollection to the calls the benchmark makes.'''
+
+    def __init__(self, collection: 'IndalekoCollection') -> None:
+        self.collection = collection
+
+    def insert(self, document: dict):
+        return self.collection.insert(document)
+
+    def insert_many(self, documents: list):
+        return self.collection.collection.insert_many(documents)
+
+    def import_bulk(self, documents: list):
+        return self.collection.collection.import_bulk(documents)
+
+    def upsert_batch(self, documents: list):
+        return self.collection.upsert_batch(documents)
+
+
+class IndalekoDBBenchmark:
+    '''Runs the strategy x batch size x concurrency sweep.'''
+
+    def __init__(self, make_target, backend: str, documents: int, seed: int = 0, preload: float = 1.0) -> None:
+        '''Parameters:
+            make_target: callable() returning an empty target collection for
+                         one run
+
+            backend: name recorded in the results
+
+            documents: number of documents written per run
+
+            seed: seed for the generated documents
+
+            preload: fraction of the documents loaded before an upsert run
+                     is timed (the rest are inserted by the run)
+        '''
+        self.make_target = make_target
+        self.backend = backend
+        self.documents = documents
+        self.seed = seed
+        self.preload = preload
+        self.results = []
+
+    @staticmethod
+    def __write__(target, strategy: str, batch: list) -> int:
+        '''Write one batch, returning the number of documents that failed.'''
+        if strategy == 'single':
+            errors = 0
+            for document in batch:
+                try:
+                    target.insert(document)
+                except Exception:
+                    errors += 1
+            return errors
+        if strategy == 'batch':
+            return sum(1 for r in target.insert_many(batch) if isinstance(r, Exception))
+        if strategy == 'import':
+            return target.import_bulk(batch).get('errors', 0)
+        if strategy == 'upsert':
+            try:
+                return target.upsert_batch(batch)['failed']
+            except Exception as e:
+                # documents are rejected one at a time, but the query itself can fail
+                logging.warning(f'upsert_batch of {len(batch)} documents failed: {e}')
+                return len(batch)
+        raise ValueError(f'Unknown strategy {strategy}')
+
+    def run(self, strategy: str, batch_size: int, concurrency: int) -> dict:
+        rng = random.Random(f'{self.seed}:{strategy}:{batch_size}:{concurrency}')
+        run_id = f'{rng.getrandbits(32):08x}'
+        documents = [make_object(i, run_id, rng) for i in range(self.documents)]
+        target = self.make_target()
+        preloaded = 0
+        if strategy == 'upsert' and self.preload > 0:
+            preloaded = int(len(documents) * self.preload)
+            for i in range(0, preloaded, batch_size):
+                target.upsert_batch(documents[i:min(i + batch_size, preloaded)])
+            documents = [modify_object(document, rng) for document in documents[:preloaded]] + documents[preloaded:]
+        batches = [documents[i:i + batch_size] for i in range(0, len(documents), batch_size)]
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            errors = sum(executor.map(lambda batch: self.__write__(target, strategy, batch), batches))
+        elapsed = time.perf_counter() - start
+        result = {
+            'backend': self.backend,
+            'strategy': strategy,
+            'batch_size': batch_size,
+            'concurrency': concurrency,
+            'documents': self.documents,
+            'preloaded': preloaded,
+            'errors': errors,
+            'seconds': round(elapsed, 6),
+            'documents_per_second': round(self.documents / elapsed, 1) if elapsed > 0 else 0,
+        }
+        logging.info(f'Benchmark result: {result}')
+        self.results.append(result)
+        return result
+
+    def sweep(self, strategies: list, batch_sizes: list, concurrency: list) -> list:
+        for strategy in strategies:
+            # batch size is meaningless for single inserts
+            sizes = [1] if strategy == 'single' else batch_sizes
+            for batch_size in sizes:
+                for workers in concurrency:
+                    result = self.run(strategy, batch_size, workers)
+                    print(f"{result['strategy']:>8} batch={result['batch_size']:<6} workers={result['concurrency']:<3} "
+                          f"{result['documents_per_second']:>12} docs/s ({result['errors']} errors)")
+        return self.results
+
+    def write_csv(self, output_file: str) -> None:
+        if len(self.results) == 0:
+            return
+        with open(output_file, 'wt', newline='') as fd:
+            writer = csv.DictWriter(fd, fieldnames=list(self.results[0].keys()))
+            writer.writeheader()
+            writer.writerows(self.results)
+
+
+def main():
+    starttime = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    parser = argparse.ArgumentParser(description='Benchmark Indaleko database write strategies')
+    parser.add_argument('--backend', choices=['memory', 'arango'], default='memory', help='Where to write')
+    parser.add_argument('--config', '-c', help='Path to the database config file', default='./config/indaleko-db-config.ini')
+    parser.add_argument('--collection', default='BenchmarkObjects', help='Collection used for the benchmark (reset each run)')
+    parser.add_argument('--documents', type=int, default=10000, help='Documents written per run')
+    parser.add_argument('--strategies', nargs='+', choices=Strategies, default=list(Strategies), help='Write strategies to test')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 1000, 10000], help='Batch sizes to test')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16], help='Client worker counts to test')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the generated documents')
+    parser.add_argument('--preload', type=float, default=1.0,
+                        help='Fraction of the documents loaded before each upsert run, so it also measures updates')
+    parser.add_argument('--latency', type=float, default=0.0, help='Simulated round trip (ms) for the memory backend')
+    parser.add_argument('--output', default=f'./data/db-benchmark-{starttime}.csv', help='CSV file for the results')
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING, help='Logging level to use')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    if args.backend == 'memory':
+        make_target = lambda: IndalekoMemoryCollection(args.collection, latency=args.latency / 1000.0)
+    else:
+        from dbsetup import IndalekoDBConfig
+        from indalekocolletions import IndalekoCollection, Indaleko_Collections
+        config = IndalekoDBConfig(args.config)
+        config.start()
+
+        def make_target():
+            collection = IndalekoCollection(config.db, args.collection, reset=True)
+            for name, index in Indaleko_Collections['Objects']['indices'].items():
+                collection.create_index(name, index['type'], index['fields'], index['unique'])
+            return ArangoBenchmarkTarget(collection)
+    benchmark = IndalekoDBBenchmark(make_target, args.backend, args.documents, seed=args.seed, preload=args.preload)
+    benchmark.sweep(args.strategies, args.batch_sizes, args.concurrency)
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    benchmark.write_csv(args.output)
+    print(f'Wrote {len(benchmark.results)} results to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+import email.utils
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+# requests is imported when the first session is created: importing it is a
+# noticeable part of the startup time of the command line tools, most of
+# which (--help, local indexing) never make a request
+
+'''
+This is the HTTP client shared by the cloud ingesters (OneDrive, Google Drive,
+Dropbox.)  It provides:
+
+* a pooled keep-alive session (which can be shared between clients)
+* a token bucket rate limiter
+* retries with exponential backoff that honor Retry-After on 429/503
+* bearer token handling through a token provider, which is asked for the
+  token on every request (so it can refresh proactively) and told to drop
+  the token when the service answers 401
+* per-endpoint latency and error metrics
+
+A token provider is any object with a get_token() method; if it also has a
+clear_token() method that is called on a 401 before retrying.
+MicrosoftGraphCredentials is such an object.
+'''
+
+class IndalekoHttpError(Exception):
+    '''A request failed with a non-retryable status, or ran out of retries.'''
+
+    def __init__(self, status: int, url: str, text: str) -> None:
+        super().__init__(f'HTTP {status} for {url}: {text[:500]}')
+        self.status = status
+        self.url = url
+        self.text = text
+
+
+class IndalekoTokenBucket:
+    '''Allows rate requests per second on average, with bursts of up to
+    capacity requests.'''
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        '''Block until the tokens are available; returns the time waited.'''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                delay = (tokens - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class IndalekoHttpMetrics:
+    '''Request counts, errors and latency, per endpoint.'''
+
+    id_pattern = re.compile(r'^(?=.*\d)[A-Za-z0-9!_\-]{12,}$')
+
+    def __init__(self) -> None:
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_name(method: str, url: str) -> str:
+        '''Group URLs by path, with identifier-like segments replaced, so that
+        e.g. every folder listing counts against the same endpoint.'''
+        path = url.split('?', 1)[0]
+        segments = [('{id}' if IndalekoHttpMetrics.id_pattern.match(x) else x) for x in path.split('/')]
+        return f'{method} ' + '/'.join(segments)
+
+    def record(self, endpoint: str, status: int, latency: float) -> None:
+        with self.lock:
+            entry = self.endpoints.setdefault(endpoint, {'requests': 0, 'errors': 0, 'retries': 0, 'total_latency': 0.0, 'max_latency': 0.0, 'status': {}})
+            entry['requests'] += 1
+            if status is None or status >= 400:
+                entry['errors'] += 1
+            entry['total_latency'] += latency
+            entry['max_latency'] = max(entry['max_latency'], latency)
+            entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+
+    def record_retry(self, endpoint: str) -> None:
+        with self.lock:
+            if endpoint in self.endpoints:
+                self.endpoints[endpoint]['retries'] += 1
+
+    def get_metrics(self) -> dict:
+        with self.lock:
+            metrics = {}
+            for endpoint, entry in self.endpoints.items():
+                metrics[endpoint] = dict(entry)
+                metrics[endpoint]['status'] = dict(entry['status'])
+                metrics[endpoint]['mean_latency'] = entry['total_latency'] / entry['requests'] if entry['requests'] else 0.0
+            return metrics
+
+    def __str__(self) -> str:
+        return json.dumps(self.get_metrics(), indent=4)
+
+
+class IndalekoHttpClient:
+    '''Resilient HTTP client for the cloud ingesters.'''
+
+    RetryStatus = (429, 500, 502, 503, 504)
+
+    def __init__(self, token_provider=None, rate: float = None, burst: float = None,
+                 max_retries: int = 8, backoff: float = 1.0, max_backoff: float = 120.0,
+                 pool_size: int = 16, timeout: float = 60.0, session: 'requests.Session' = None) -> None:
+        '''Parameters:
+            token_provider: object with get_token() (and optionally
+                            clear_token()) used for bearer authentication
+
+            rate, burst: requests per second (and burst size) allowed by the
+                         rate limiter; None disables it
+
+            max_retries: attempts after the first before giving up
+
+            backoff, max_backoff: initial and maximum retry delay in seconds
+
+            pool_size: number of keep-alive connections kept per host
+
+            session: an existing session to share (e.g., between accounts)
+        '''
+        self.token_provider = token_provider
+        self.limiter = IndalekoTokenBucket(rate, burst) if rate else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        if session is None:
+            session = self.create_session(pool_size)
+        self.session = session
+        self.metrics = IndalekoHttpMetrics()
+        self.token_lock = threading.Lock()
+
+    @staticmethod
+    def create_session(pool_size: int = 16) -> 'requests.Session':
+        import requests
+        import requests.adapters
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @staticmethod
+    def get_retry_after(response: 'requests.Response') -> float:
+        '''Seconds requested by a Retry-After header (either form), or None.'''
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def __get_token__(self) -> str:
+        with self.token_lock:
+            return self.token_provider.get_token()
+
+    def __clear_token__(self, stale_token: str) -> None:
+        if not hasattr(self.token_provider, 'clear_token'):
+            return
+        with self.token_lock:
+            # only the first thread to see the stale token clears it
+            if self.token_provider.get_token() == stale_token:
+                self.token_provider.clear_token()
+
+    def __delay__(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def request(self, method: str, url: str, endpoint: str = None, authenticate: bool = True, **kwargs) -> 'requests.Response':
+        '''Issue a request, retrying transient failures.  Returns the response
+        for any 2xx/3xx status; raises IndalekoHttpError otherwise.'''
+        import requests
+        if endpoint is None:
+            endpoint = self.metrics.endpoint_name(method, url)
+        kwargs.setdefault('timeout', self.timeout)
+        headers = dict(kwargs.pop('headers', None) or {})
+        refreshed = False
+        attempt = 0
+        while True:
+            token = None
+            if authenticate and self.token_provider is not None:
+                token = self.__get_token__()
+                headers['Authorization'] = f'Bearer {token}'
+            if self.limiter is not None:
+                self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.metrics.record(endpoint, None, time.monotonic() - start)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.__delay__(attempt)
+                logging.warning(f'{method} {url} failed ({type(e).__name__}: {e}), retrying in {delay:.1f} seconds')
+            else:
+                self.metrics.record(endpoint, response.status_code, time.monotonic() - start)
+                if response.status_code < 400:
+                    return response
+                if response.status_code == 401 and token is not None and not refreshed:
+                    logging.info(f'{method} {url} returned 401, refreshing token')
+                    self.__clear_token__(token)
+                    refreshed = True
+                    continue
+                if response.status_code not in self.RetryStatus or attempt >= self.max_retries:
+                    raise IndalekoHttpError(response.status_code, url, response.text)
+                delay = self.get_retry_after(response)
+                if delay is None:
+                    delay = self.__delay__(attempt)
+                logging.warning(f'{method} {url} returned {response.status_code}, retrying in {delay:.1f} seconds')
+            self.metrics.record_retry(endpoint)
+            time.sleep(delay)
+            attempt += 1
+
+    def get_json(self, url: str, **kwargs) -> dict:
+        return self.request('GET', url, **kwargs).json()
+
+    def post_json(self, url: str, body: dict = None, **kwargs) -> dict:
+        return self.request('POST', url, json=body, **kwargs).json()
+
+    def get_metrics(self) -> dict:
+        return self.metrics.get_metrics()
+
+    def log_metrics(self, level: int = logging.INFO) -> None:
+        for endpoint, entry in self.get_metrics().items():
+            logging.log(level, f"{endpoint}: {entry['requests']} requests, {entry['errors']} errors, {entry['retries']} retries, "
+                               f"mean {entry['mean_latency']:.3f}s, max {entry['max_latency']:.3f}s")
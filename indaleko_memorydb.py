@@ -0,0 +1,155 @@
+import threading
+import time
+import uuid
+
+'''
+This is a local, in-memory stand-in for an ArangoDB collection.  It provides
+the same write and lookup calls that the rest of Indaleko uses on
+IndalekoCollection (insert, insert_many, import_bulk, upsert_batch and
+find_entries) and enforces the unique indices declared in
+Indaleko_Collections, so ingest and benchmark code can be exercised without a
+database server.  An optional per-call latency simulates the network round
+trip to a real server.
+'''
+
+class IndalekoMemoryCollection:
+    '''In-memory stand-in for IndalekoCollection.'''
+
+    def __init__(self, name: str, unique_fields: tuple = ('URI', 'ObjectIdentifier', 'LocalIdentifier'), latency: float = 0.0) -> None:
+        '''Parameters:
+            name: name of the collection
+
+            unique_fields: fields with a unique index
+
+            latency: seconds of simulated round trip time added to each call
+        '''
+        self.name = name
+        self.unique_fields = tuple(unique_fields)
+        self.latency = latency
+        self.documents = {}
+        self.indices = {field: {} for field in self.unique_fields}
+        self.lock = threading.Lock()
+        self.round_trips = 0
+
+    def __round_trip__(self) -> None:
+        self.round_trips += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def __check_unique__(self, document: dict, key: str = None) -> None:
+        for field in self.unique_fields:
+            value = document.get(field)
+            if value is None:
+                continue
+            existing = self.indices[field].get(value)
+            if existing is not None and existing != key:
+                raise ValueError(f'unique constraint violated on {self.name}.{field}: {value}')
+
+    def __store__(self, document: dict, key: str = None) -> dict:
+        if key is None:
+            key = document.get('_key', uuid.uuid4().hex)
+        self.__check_unique__(document, key)
+        old = self.documents.get(key)
+        if old is not None:
+            for field in self.unique_fields:
+                if field in old:
+                    del self.indices[field][old[field]]
+        document = dict(document)
+        document['_key'] = key
+        document['_id'] = f'{self.name}/{key}'
+        self.documents[key] = document
+        for field in self.unique_fields:
+            if field in document:
+                self.indices[field][document[field]] = key
+        return {'_key': key, '_id': document['_id']}
+
+    def insert(self, document: dict) -> dict:
+        self.__round_trip__()
+        with self.lock:
+            return self.__store__(document)
+
+    def insert_many(self, documents: list) -> list:
+        '''Like python-arango's insert_many: failures are returned in place of
+        the metadata rather than raised.'''
+        self.__round_trip__()
+        results = []
+        with self.lock:
+            for document in documents:
+                try:
+                    results.append(self.__store__(document))
+                except ValueError as e:
+                    results.append(e)
+        return results
+
+    def import_bulk(self, documents: list) -> dict:
+        self.__round_trip__()
+        created = errors = 0
+        with self.lock:
+            for document in documents:
+                try:
+                    self.__store__(document)
+                    created += 1
+                except ValueError:
+                    errors += 1
+        return {'created': created, 'errors': errors}
+
+    def upsert_batch(self, documents: list, match_field: str = 'URI', preserve: tuple = ('ObjectIdentifier',),
+                     failed: list = None) -> dict:
+        '''Same semantics as IndalekoCollection.upsert_batch.'''
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        if len(documents) == 0:
+            return counts
+        self.__round_trip__()
+        assert match_field in self.unique_fields, f'{match_field} does not have a unique index'
+        preserve = [field for field in preserve if field != match_field]
+        with self.lock:
+            for document in documents:
+                key = self.indices[match_field].get(document.get(match_field))
+                try:
+                    if key is None:
+                        self.__store__(document)
+                        counts['inserted'] += 1
+                        continue
+                    old = self.documents[key]
+                    changes = {k: v for k, v in document.items() if k not in preserve}
+                    if all(k in old and old[k] == v for k, v in changes.items()):
+                        counts['unchanged'] += 1
+                        continue
+                    updated = dict(old)
+                    updated.update(changes)
+                    self.__store__(updated, key)
+                    counts['updated'] += 1
+                except ValueError:
+                    counts['failed'] += 1
+                    if failed is not None:
+                        failed.append(document)
+        return counts
+
+    def upsert_many(self, documents, batch_size: int = 1000, match_field: str = 'URI', preserve: tuple = ('ObjectIdentifier',),
+                    failed: list = None) -> dict:
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        documents = list(documents)
+        for index in range(0, len(documents), batch_size):
+            for key, value in self.upsert_batch(documents[index:index + batch_size], match_field, preserve, failed).items():
+                counts[key] += value
+        return counts
+
+    def find_entries(self, **kwargs) -> list:
+        self.__round_trip__()
+        with self.lock:
+            if len(kwargs) == 1:
+                field, value = next(iter(kwargs.items()))
+                if field in self.indices:
+                    key = self.indices[field].get(value)
+                    return [] if key is None else [self.documents[key]]
+            return [d for d in self.documents.values() if all(d.get(k) == v for k, v in kwargs.items())]
+
+    def count(self) -> int:
+        return len(self.documents)
+
+    def truncate(self) -> 'IndalekoMemoryCollection':
+        with self.lock:
+            self.documents.clear()
+            for field in self.indices:
+                self.indices[field].clear()
+        return self
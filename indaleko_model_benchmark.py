@@ -0,0 +1,64 @@
+import argparse
+import time
+import tracemalloc
+import uuid
+
+from indaleko import IndalekoObject
+
+'''
+Measures what the runtime classes cost compared with the plain document
+dicts they replace: memory and time to build a batch of objects, and the
+to_dict / from_dict conversion rates.
+'''
+
+def benchmark_model(count : int = 100000) -> dict:
+    '''Compares building count objects as document dicts with building them
+    as IndalekoObjects: construction time and memory, plus the to_dict and
+    from_dict rates.'''
+    timestamps = [{'Label' : '434f7ac1-f71a-4cea-a830-e2ea9a47db5a', 'Value' : '2024-01-01T00:00:00+00:00'}]
+    identifiers = [str(uuid.uuid4()) for _ in range(count)]
+    def measure(build) -> tuple:
+        tracemalloc.start()
+        start = time.perf_counter()
+        items = build()
+        elapsed = time.perf_counter() - start
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return items, elapsed, size
+    documents, dict_seconds, dict_bytes = measure(lambda: [{
+        'URI' : f'file:///{index}',
+        'ObjectIdentifier' : identifiers[index],
+        'Timestamps' : timestamps,
+        'Size' : index,
+        'Label' : 'name',
+    } for index in range(count)])
+    objects, object_seconds, object_bytes = measure(lambda: [
+        IndalekoObject(f'file:///{index}', identifiers[index], timestamps, index, 'name') for index in range(count)
+    ])
+    start = time.perf_counter()
+    IndalekoObject.to_dicts(objects)
+    to_dict_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    IndalekoObject.from_dicts(documents)
+    from_dict_seconds = time.perf_counter() - start
+    return {
+        'count' : count,
+        'dict bytes per object' : dict_bytes / count,
+        'object bytes per object' : object_bytes / count,
+        'dict build seconds' : dict_seconds,
+        'object build seconds' : object_seconds,
+        'to_dict per second' : count / to_dict_seconds,
+        'from_dict per second' : count / from_dict_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the runtime classes with document dicts')
+    parser.add_argument('--count', type=int, default=100000, help='Number of objects to build')
+    args = parser.parse_args()
+    for name, value in benchmark_model(args.count).items():
+        print(f'{name:>24}: {value:,.3f}' if isinstance(value, float) else f'{name:>24}: {value}')
+
+
+if __name__ == '__main__':
+    main()
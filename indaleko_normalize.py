@@ -0,0 +1,443 @@
+import argparse
+import base64
+import datetime
+import json
+import logging
+import os
+import posixpath
+import stat
+
+from indaleko import IndalekoObject, IndalekoRelationship, object_identifier
+from indaleko_serialize import get_serializer, add_serializer_argument, read_records
+from local_index import read_snapshot, get_snapshot_machine
+
+'''
+Normalizers turn the raw metadata the ingesters capture (OneDrive
+driveItems, Google Drive files, Dropbox entries, local file system snapshot
+records) into documents for the
+Objects collection (IndalekoObject.Schema) plus "contains" edges for the
+Relationships collection.  The raw item is preserved (base64 JSON) in RawData,
+or, with a blob store, kept once in the store and named by RawDataDigest (see
+indaleko_blobstore.)
+
+Objects and relationships are built as IndalekoObject and IndalekoRelationship
+instances and converted to documents (to_dicts) only where they are written.
+The normalizers work a page at a time, so they can run inline with a crawl
+(IndalekoNormalizingStream writes the results to the spool, which drains
+through the same upsert path as local data) or over a saved raw output file
+(main() below.)
+
+Identifiers are deterministic: the URI is built from the provider's own item
+id (which survives renames and moves) and the ObjectIdentifier is the name
+based UUID of the URI (indaleko.object_identifier.)  A parent's ObjectIdentifier is therefore known as
+soon as a child names it, the edges can be written before the parent has been
+seen, and re-normalizing the same item gives the same documents (so spooled
+batches are idempotent.)  The Objects document key is the ObjectIdentifier,
+which lets the edges use _from/_to directly.  The LocalIdentifier is
+qualified by provider and account as well: the Objects index on it is unique,
+and an item shared with several accounts has the same provider id in each.
+'''
+
+# semantic labels for timestamps
+CreationTimestamp = '6b3f16ec-52d2-4e9b-afd0-e02a875ec6e6'
+ModificationTimestamp = '434f7ac1-f71a-4cea-a830-e2ea9a47db5a'
+AccessTimestamp = '581b5332-4d37-49c7-892a-854824f5d66f'
+
+# relationship: object1 (a folder) contains object2
+ContainsRelationship = 'cde81295-f171-45be-8607-8100f4611430'
+
+# relationship: object1 (a local file) and object2 (a cloud item) are copies
+# of the same object, kept in sync by the provider's client
+SameObjectRelationship = '8f3c7f0e-5e0a-4d7b-b8a2-2f1d6c9e4a17'
+
+# relationship metadata: how the match was made (e.g., "path+size", "sha1")
+MatchBasisMetadata = 'a4d2b9c1-7e36-4f0a-9d58-3b6e1c2f8a90'
+
+
+class IndalekoNormalizer:
+    '''Base class: maps one provider's raw items to Indaleko objects.'''
+
+    provider = None
+    # raw items go here (by digest) instead of inline, if set
+    blob_store = None
+
+    def __init__(self, account: str) -> None:
+        self.account = account
+        self.objects = 0
+        self.relationships = 0
+        self.deleted = 0
+
+    def set_blob_store(self, blob_store: 'IndalekoBlobStore') -> 'IndalekoNormalizer':
+        self.blob_store = blob_store
+        return self
+
+    def get_uri(self, item_id: str) -> str:
+        return f'{self.provider}://{self.account}/{item_id}'
+
+    def get_local_identifier(self, item_id: str) -> str:
+        return f'{self.provider}:{self.account}:{item_id}'
+
+    def make_object(self, item_id: str, label: str, size: int, timestamps: dict, raw: dict) -> IndalekoObject:
+        '''timestamps maps the semantic label to the (ISO) value; missing
+        values are left out.'''
+        uri = self.get_uri(item_id)
+        identifier = object_identifier(uri)
+        raw_data = json.dumps(raw).encode('utf-8')
+        if self.blob_store is not None:
+            raw_data, raw_data_digest = None, self.blob_store.put(raw_data)
+        else:
+            raw_data, raw_data_digest = base64.b64encode(raw_data).decode('ascii'), None
+        return IndalekoObject(uri, identifier,
+                              [{'Label': name, 'Value': value} for name, value in timestamps.items() if value],
+                              int(size or 0), label=label, local_identifier=self.get_local_identifier(item_id),
+                              raw_data=raw_data, semantic_attributes=[], key=identifier,
+                              raw_data_digest=raw_data_digest)
+
+    @staticmethod
+    def make_relationship(container: str, contained: str) -> IndalekoRelationship:
+        return IndalekoRelationship(container, contained, ContainsRelationship)
+
+    def normalize_item(self, item: dict) -> tuple:
+        '''Returns (object, parent key); the parent key is whatever
+        get_parent_identifier() resolves, or None for no parent.'''
+        assert False, 'normalize_item must be overridden by a subclass'
+
+    def get_parent_identifier(self, parent_key: str, item: dict, document: IndalekoObject) -> str:
+        '''The container's ObjectIdentifier, or None if it cannot (yet) be
+        resolved.'''
+        return object_identifier(self.get_uri(parent_key))
+
+    def get_deleted(self, record: dict) -> dict:
+        '''Identifies a deleted item from a change record.'''
+        return {'URI': self.get_uri(record['id'])}
+
+    def is_deleted(self, item: dict) -> bool:
+        '''True for a raw item that reports a deletion.'''
+        return False
+
+    def normalize_page(self, records: list) -> tuple:
+        '''Normalize one page of raw items (or change records, as written by
+        the incremental modes.)  Returns (objects, relationships, deleted):
+        lists of IndalekoObject, IndalekoRelationship and deletion dicts.'''
+        objects = []
+        relationships = []
+        deleted = []
+        for record in records:
+            if 'change' in record and 'item' in record:
+                if record['change'] in ('deleted', 'removed'):
+                    deleted.append(self.get_deleted(record))
+                    continue
+                record = record['item']
+            if self.is_deleted(record):
+                deleted.append(self.get_deleted(record))
+                continue
+            document, parent_key = self.normalize_item(record)
+            objects.append(document)
+            if parent_key is None:
+                continue
+            parent = self.get_parent_identifier(parent_key, record, document)
+            if parent is not None:
+                relationships.append(self.make_relationship(parent, document.object_identifier))
+        relationships.extend(self.resolve_pending())
+        self.objects += len(objects)
+        self.relationships += len(relationships)
+        self.deleted += len(deleted)
+        return objects, relationships, deleted
+
+    def resolve_pending(self) -> list:
+        '''Relationships that could not be resolved when their item was seen
+        and can be now.'''
+        return []
+
+    def finish(self) -> list:
+        '''Called at the end of the stream; returns any remaining
+        relationships.'''
+        return []
+
+
+class OneDriveNormalizer(IndalekoNormalizer):
+    provider = 'onedrive'
+
+    def normalize_item(self, item: dict) -> tuple:
+        file_system_info = item.get('fileSystemInfo', {})
+        timestamps = {
+            CreationTimestamp: file_system_info.get('createdDateTime', item.get('createdDateTime')),
+            ModificationTimestamp: file_system_info.get('lastModifiedDateTime', item.get('lastModifiedDateTime')),
+            AccessTimestamp: file_system_info.get('lastAccessedDateTime'),
+        }
+        document = self.make_object(item['id'], item.get('name'), item.get('size', 0), timestamps, item)
+        return document, item.get('parentReference', {}).get('id')
+
+    def is_deleted(self, item: dict) -> bool:
+        return 'deleted' in item
+
+
+class GoogleDriveNormalizer(IndalekoNormalizer):
+    provider = 'gdrive'
+
+    def normalize_item(self, item: dict) -> tuple:
+        timestamps = {
+            CreationTimestamp: item.get('createdTime'),
+            ModificationTimestamp: item.get('modifiedTime'),
+            AccessTimestamp: item.get('viewedByMeTime'),
+        }
+        # Google documents have no size
+        document = self.make_object(item['id'], item.get('name'), item.get('size', 0), timestamps, item)
+        parents = item.get('parents') or [None]
+        return document, parents[0]
+
+
+class DropboxNormalizer(IndalekoNormalizer):
+    '''Dropbox entries name their folder by path rather than by id, so the
+    folder ids are remembered by path.  An entry seen before its folder is
+    held until the folder appears.
+
+    With a folder file the map outlives the run: it is loaded at the start
+    and the folders seen are appended to it after every page, so --resume
+    and --incremental runs still resolve the folders listed by earlier
+    runs.'''
+
+    provider = 'dropbox'
+    RootKey = 'root'
+
+    def __init__(self, account: str, folder_file: str = None) -> None:
+        super().__init__(account)
+        self.folders = {'': object_identifier(self.get_uri(self.RootKey))}
+        self.pending = []
+        self.folder_file = folder_file
+        self.new_folders = {}
+        if folder_file is not None and os.path.exists(folder_file):
+            for entry in read_records(folder_file):
+                self.folders[entry['path']] = entry['ObjectIdentifier']
+            logging.info(f'Loaded {len(self.folders) - 1} Dropbox folders from {folder_file}')
+
+    def normalize_item(self, item: dict) -> tuple:
+        timestamps = {
+            ModificationTimestamp: item.get('server_modified'),
+        }
+        document = self.make_object(item['id'], item.get('name'), item.get('size', 0), timestamps, item)
+        path = item['path_lower']
+        if item['.tag'] == 'folder':
+            self.folders[path] = document.object_identifier
+            if self.folder_file is not None:
+                self.new_folders[path] = document.object_identifier
+        return document, posixpath.dirname(path).rstrip('/')
+
+    def normalize_page(self, records: list) -> tuple:
+        result = super().normalize_page(records)
+        self.save_folders()
+        return result
+
+    def save_folders(self) -> None:
+        '''Append the folders seen since the last save to the folder file.'''
+        if len(self.new_folders) == 0:
+            return
+        encode = get_serializer().encode
+        with open(self.folder_file, 'ab') as fd:
+            fd.writelines(encode({'path': path, 'ObjectIdentifier': identifier})
+                          for path, identifier in self.new_folders.items())
+        self.new_folders = {}
+
+    def get_parent_identifier(self, parent_key: str, item: dict, document: IndalekoObject) -> str:
+        parent = self.folders.get(parent_key)
+        if parent is None:
+            self.pending.append((parent_key, document.object_identifier))
+        return parent
+
+    def get_deleted(self, record: dict) -> dict:
+        # deleted entries carry no id, only the path
+        return {'Path': record.get('path', record.get('path_lower'))}
+
+    def is_deleted(self, item: dict) -> bool:
+        return item.get('.tag') == 'deleted'
+
+    def resolve_pending(self) -> list:
+        relationships = []
+        waiting = []
+        for parent_key, contained in self.pending:
+            parent = self.folders.get(parent_key)
+            if parent is None:
+                waiting.append((parent_key, contained))
+            else:
+                relationships.append(self.make_relationship(parent, contained))
+        self.pending = waiting
+        return relationships
+
+    def finish(self) -> list:
+        relationships = self.resolve_pending()
+        self.relationships += len(relationships)
+        if len(self.pending) > 0:
+            logging.warning(f'{len(self.pending)} Dropbox entries are in folders that were never listed; no relationship written for them')
+        return relationships
+
+
+class LocalNormalizer(IndalekoNormalizer):
+    '''Records of a local file system snapshot (local_index, either path
+    encoding.)  The account is the machine (its UUID) and the item id is the
+    file's full path with / separators, so a local file's URI is
+    local://<machine>/<path>.  The snapshot's own URI field is not used: it
+    is not a stable identifier (on Linux it repeats the name, on Windows it
+    omits the directories.)
+
+    The directory the snapshot was taken of is not itself a record, so no
+    edges are written to it; by default it is the directory of the first
+    record.'''
+
+    provider = 'local'
+
+    def __init__(self, account: str, root: str = None) -> None:
+        super().__init__(account)
+        self.root = self.get_item_path(root) if root is not None else None
+
+    @staticmethod
+    def get_item_path(path: str) -> str:
+        return path.replace('\\', '/')
+
+    def get_item_id(self, record: dict) -> str:
+        return self.get_item_path(os.path.join(record['path'], record['file']))
+
+    @staticmethod
+    def get_timestamp(record: dict, field: str) -> str:
+        if field not in record:
+            return None
+        return datetime.datetime.fromtimestamp(record[field], datetime.timezone.utc).isoformat()
+
+    def normalize_item(self, item: dict) -> tuple:
+        if self.root is None:
+            self.root = self.get_item_path(item['path'])
+        timestamps = {
+            CreationTimestamp: self.get_timestamp(item, 'st_birthtime'),
+            ModificationTimestamp: self.get_timestamp(item, 'st_mtime'),
+            AccessTimestamp: self.get_timestamp(item, 'st_atime'),
+        }
+        size = 0 if stat.S_ISDIR(item.get('st_mode', 0)) else item.get('st_size', 0)
+        document = self.make_object(self.get_item_id(item), item['file'], size, timestamps, item)
+        parent = self.get_item_path(item['path'])
+        return document, (None if parent == self.root else parent)
+
+
+Normalizers = {
+    'onedrive' : OneDriveNormalizer,
+    'gdrive' : GoogleDriveNormalizer,
+    'dropbox' : DropboxNormalizer,
+    'local' : LocalNormalizer,
+}
+
+
+class IndalekoNormalizingStream:
+    '''
+    Wraps an IndalekoCrawlStream: each page is written to the raw output (and
+    checkpointed) as before, and is also normalized with the results appended
+    to the spool, to be drained into the Objects and Relationships
+    collections.
+    '''
+
+    def __init__(self, stream: 'IndalekoCrawlStream', normalizer: IndalekoNormalizer, spool: 'IndalekoSpool') -> None:
+        self.stream = stream
+        self.normalizer = normalizer
+        self.spool = spool
+
+    @property
+    def state(self) -> dict:
+        return self.stream.state
+
+    @property
+    def output_file(self) -> str:
+        return self.stream.output_file
+
+    def record_page(self, records: list, state: dict) -> None:
+        objects, relationships, _ = self.normalizer.normalize_page(records)
+        self.spool.append('Objects', IndalekoObject.to_dicts(objects))
+        self.spool.append('Relationships', IndalekoRelationship.to_dicts(relationships))
+        self.stream.record_page(records, state)
+
+    def get_count(self) -> int:
+        return self.stream.get_count()
+
+    def finish(self) -> None:
+        self.spool.append('Relationships', IndalekoRelationship.to_dicts(self.normalizer.finish()))
+        self.spool.seal()
+        if self.normalizer.deleted > 0:
+            logging.info(f'{self.normalizer.deleted} deleted items reported (not removed from the database)')
+        self.stream.finish()
+
+    def close(self) -> None:
+        self.spool.seal()
+        self.stream.close()
+
+
+def get_pages(records, page_size: int = 1000):
+    page = []
+    for record in records:
+        page.append(record)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if len(page) > 0:
+        yield page
+
+
+def read_pages(input_file: str, page_size: int = 1000, serializer: 'IndalekoSerializer' = None):
+    '''Pages of records from a raw output file (a record stream written with
+    serializer, default JSON, or the older single JSON array.)'''
+    yield from get_pages(read_records(input_file, serializer), page_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Normalize raw metadata into Indaleko objects and relationships')
+    parser.add_argument('input', help='Raw output file written by a cloud ingester, or a local file system snapshot')
+    parser.add_argument('--provider', choices=list(Normalizers), required=True, help='Provider that produced the input')
+    parser.add_argument('--account', default=None,
+                        help='Account the input was collected from (local: the machine UUID, taken from the snapshot name by default)')
+    parser.add_argument('--spool', default=None, help='Append the results to this spool directory (for indaleko_spool to upload)')
+    parser.add_argument('--output', default=None, help='Write the results here instead (objects; relationships go next to it)')
+    parser.add_argument('--page-size', type=int, default=1000, help='Records normalized at a time')
+    add_serializer_argument(parser)
+    add_serializer_argument(parser, '--input-format', 'Serialization format of the input')
+    parser.add_argument('--blobs', default=None, help='Keep the raw items in this blob store instead of inline')
+    parser.add_argument('--dropbox-folders', default=None,
+                        help='Dropbox folder map to load and extend (resolves folders listed by earlier runs)')
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING, help='Logging level to use')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    if args.provider == 'local':
+        if args.account is None:
+            args.account = get_snapshot_machine(args.input)
+        pages = get_pages(read_snapshot(args.input, get_serializer(args.input_format)), args.page_size)
+    else:
+        pages = read_pages(args.input, args.page_size, get_serializer(args.input_format))
+    if args.account is None:
+        parser.error('--account is required')
+    if args.provider == 'dropbox':
+        normalizer = DropboxNormalizer(args.account, args.dropbox_folders)
+    else:
+        normalizer = Normalizers[args.provider](args.account)
+    if args.blobs is not None:
+        from indaleko_blobstore import IndalekoBlobStore
+        normalizer.set_blob_store(IndalekoBlobStore(args.blobs))
+    if args.spool is not None:
+        from indaleko_spool import IndalekoSpool
+        spool = IndalekoSpool(args.spool)
+        for page in pages:
+            objects, relationships, _ = normalizer.normalize_page(page)
+            spool.append('Objects', IndalekoObject.to_dicts(objects))
+            spool.append('Relationships', IndalekoRelationship.to_dicts(relationships))
+        spool.append('Relationships', IndalekoRelationship.to_dicts(normalizer.finish()))
+        spool.close()
+        destination = args.spool
+    else:
+        output = args.output if args.output is not None else os.path.splitext(args.input)[0] + '-objects.jsonl'
+        relationships_output = os.path.splitext(output)[0] + '-relationships.jsonl'
+        encode = get_serializer(args.format).encode
+        with open(output, 'wb') as objects_fd, open(relationships_output, 'wb') as relationships_fd:
+            for page in pages:
+                objects, relationships, _ = normalizer.normalize_page(page)
+                objects_fd.writelines(encode(x.to_dict()) for x in objects)
+                relationships_fd.writelines(encode(x.to_dict()) for x in relationships)
+            relationships_fd.writelines(encode(x.to_dict()) for x in normalizer.finish())
+        destination = f'{output} and {relationships_output}'
+    print(f'{normalizer.objects} objects, {normalizer.relationships} relationships ({normalizer.deleted} deletions skipped) to {destination}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+'''
+Field projection profiles for the cloud ingesters.  Left alone, the cloud APIs
+return (or we ask for) far more metadata than we use downstream: thumbnails,
+export links, capability maps and so on.  A profile names the set of fields to
+request from a provider:
+
+* minimal - enough to identify an item and rebuild the tree
+* index - the fields the Indaleko object schema and normalizers use
+* full - everything we know how to ask for
+
+The profiles are translated into each provider's projection mechanism:
+$select for Microsoft Graph, fields= for Google Drive.  Dropbox does not
+support field selection, so its profiles select the optional list_folder
+extras instead.
+'''
+
+ProjectionProfiles = ('minimal', 'index', 'full')
+
+DefaultProfile = 'index'
+
+Projections = {
+    'onedrive' : {
+        'minimal' : [
+            'id', 'name', 'size', 'folder', 'file', 'parentReference',
+            'lastModifiedDateTime', 'deleted',
+        ],
+        'index' : [
+            'id', 'name', 'size', 'folder', 'file', 'parentReference',
+            'createdDateTime', 'lastModifiedDateTime', 'fileSystemInfo',
+            'eTag', 'cTag', 'webUrl', 'package', 'root', 'remoteItem',
+            'shared', 'deleted',
+        ],
+        'full' : None, # Graph returns the whole driveItem without $select
+    },
+    'gdrive' : {
+        'minimal' : [
+            'id', 'name', 'mimeType', 'parents', 'size', 'modifiedTime',
+            'trashed',
+        ],
+        'index' : [
+            'id', 'name', 'mimeType', 'parents', 'size', 'createdTime',
+            'modifiedTime', 'viewedByMeTime', 'trashed', 'driveId',
+            'fileExtension', 'originalFilename', 'md5Checksum',
+            'sha256Checksum', 'headRevisionId', 'version', 'ownedByMe',
+            'shared', 'starred', 'description', 'quotaBytesUsed',
+        ],
+        'full' : [
+            'kind',
+            'driveId',
+            'fileExtension',
+            'md5Checksum',
+            'viewedByMe',
+            'mimeType',
+            'exportLinks',
+            'parents',
+            'thumbnailLink',
+            'shared',
+            'headRevisionId',
+            'webViewLink',
+            'webContentLink',
+            'size',
+            'spaces',
+            'id',
+            'name',
+            'description',
+            'starred',
+            'trashed',
+            'explicitlyTrashed',
+            'createdTime',
+            'modifiedTime',
+            'modifiedByMeTime',
+            'viewedByMeTime',
+            'sharedWithMeTime',
+            'quotaBytesUsed',
+            'version',
+            'originalFilename',
+            'ownedByMe',
+            'fullFileExtension',
+            'properties',
+            'appProperties',
+            'capabilities',
+            'hasAugmentedPermissions',
+            'trashingUser',
+            'thumbnailVersion',
+            'modifiedByMe',
+            'imageMediaMetadata',
+            'videoMediaMetadata',
+            'shortcutDetails',
+            'contentRestrictions',
+            'resourceKey',
+            'linkShareMetadata',
+            'labelInfo',
+            'sha1Checksum',
+            'sha256Checksum',
+        ],
+    },
+    'dropbox' : {
+        'minimal' : {
+            'include_deleted' : False,
+            'include_has_explicit_shared_members' : False,
+            'include_mounted_folders' : True,
+            'include_non_downloadable_files' : True,
+        },
+        'index' : {
+            'include_deleted' : False,
+            'include_has_explicit_shared_members' : False,
+            'include_mounted_folders' : True,
+            'include_non_downloadable_files' : True,
+        },
+        'full' : {
+            'include_deleted' : False,
+            'include_has_explicit_shared_members' : True,
+            'include_mounted_folders' : True,
+            'include_non_downloadable_files' : True,
+            'include_media_info' : True,
+        },
+    },
+}
+
+
+def get_projection(provider: str, profile: str = DefaultProfile):
+    '''Returns the projection for a provider and profile.'''
+    assert provider in Projections, f'Unknown provider {provider}'
+    assert profile in ProjectionProfiles, f'Unknown projection profile {profile}'
+    return Projections[provider][profile]
+
+
+def graph_select(profile: str = DefaultProfile, extra: tuple = ()) -> str:
+    '''Value for the Graph $select query parameter, or None if everything
+    should be returned.  extra lists fields the caller needs regardless of
+    the profile.'''
+    fields = get_projection('onedrive', profile)
+    if fields is None:
+        return None
+    return ','.join(fields + [x for x in extra if x not in fields])
+
+
+def drive_fields(profile: str = DefaultProfile, container: str = 'files', extra: tuple = (), prefix: str = 'nextPageToken') -> str:
+    '''Value for the Drive fields= parameter, e.g.
+    "nextPageToken, files(id, name, ...)".'''
+    fields = get_projection('gdrive', profile)
+    fields = fields + [x for x in extra if x not in fields]
+    projection = f'{container}({", ".join(fields)})'
+    if prefix:
+        return f'{prefix}, {projection}'
+    return projection
+
+
+def dropbox_list_folder_options(profile: str = DefaultProfile) -> dict:
+    '''Optional arguments for Dropbox files/list_folder.'''
+    return dict(get_projection('dropbox', profile))
+
+
+def add_profile_argument(parser) -> None:
+    '''Adds the standard --profile option to an ingester's parser.'''
+    parser.add_argument('--profile', choices=ProjectionProfiles, default=DefaultProfile,
+                        help=f'Metadata projection profile (default: {DefaultProfile})')
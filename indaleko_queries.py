@@ -0,0 +1,214 @@
+import argparse
+import datetime
+import logging
+import os
+import warnings
+
+'''
+This is the library of prepared (parameterized) AQL queries for the common
+Indaleko lookups.  Rather than building ad hoc collection.find() calls, query
+code asks the library for a named query and supplies the bind variables.
+
+When a query is registered, its plan is checked with the ArangoDB explain API.
+If the optimizer falls back to a full collection scan (an
+EnumerateCollectionNode) an IndalekoFullScanWarning is raised, which tells us
+that the indices declared in Indaleko_Collections do not cover that access
+pattern.  Prefix matches are written with STARTS_WITH, which the optimizer
+turns into an index range using ArangoDB's own string collation.  Range
+queries over array members (timestamps) cannot be served by a persistent
+array index (it only answers IN lookups), so that query is expected to warn
+until there is an ArangoSearch view for it.
+'''
+
+class IndalekoFullScanWarning(UserWarning):
+    '''Raised when a prepared query's plan scans an entire collection.'''
+    pass
+
+
+Indaleko_Queries = {
+    'uri prefix' : {
+        'description' : 'Objects whose URI starts with the given prefix',
+        'query' : '''
+            FOR object IN Objects
+                FILTER STARTS_WITH(object.URI, @prefix)
+                SORT object.URI
+                LIMIT @limit
+                RETURN object
+        ''',
+        'parameters' : ['prefix'],
+        'defaults' : {'limit' : 1000},
+        'sample' : {'prefix' : 'file:///'},
+    },
+    'label prefix' : {
+        'description' : 'Objects whose label starts with the given text',
+        'query' : '''
+            FOR object IN Objects
+                FILTER STARTS_WITH(object.Label, @prefix)
+                SORT object.Label
+                LIMIT @limit
+                RETURN object
+        ''',
+        'parameters' : ['prefix'],
+        'defaults' : {'limit' : 1000},
+        'sample' : {'prefix' : '2016'},
+    },
+    'size range' : {
+        'description' : 'Objects with min_size <= Size <= max_size',
+        'query' : '''
+            FOR object IN Objects
+                FILTER object.Size >= @min_size AND object.Size <= @max_size
+                LIMIT @limit
+                RETURN object
+        ''',
+        'parameters' : ['min_size', 'max_size'],
+        'defaults' : {'limit' : 1000},
+        'sample' : {'min_size' : 0, 'max_size' : 4096},
+    },
+    'timestamp range' : {
+        'description' : 'Objects with any timestamp in [start, end)',
+        'query' : '''
+            FOR object IN Objects
+                FILTER LENGTH(object.Timestamps[* FILTER CURRENT.Value >= @start AND CURRENT.Value < @end]) > 0
+                LIMIT @limit
+                RETURN object
+        ''',
+        'parameters' : ['start', 'end'],
+        'defaults' : {'limit' : 1000},
+        'sample' : {'start' : '2023-01-01T00:00:00', 'end' : '2024-01-01T00:00:00'},
+    },
+    'container traversal' : {
+        'description' : 'Objects contained (up to depth levels down) in the given container',
+        'query' : '''
+            FOR object, relationship IN 1..@depth OUTBOUND @container Relationships
+                FILTER relationship.relationship == @relationship
+                LIMIT @limit
+                RETURN object
+        ''',
+        'parameters' : ['container', 'relationship'],
+        'defaults' : {'depth' : 1, 'limit' : 1000},
+        'sample' : {'container' : 'Objects/0', 'relationship' : '00000000-0000-0000-0000-000000000000'},
+    },
+}
+
+
+class IndalekoPreparedQuery:
+    '''A named, parameterized AQL query.'''
+
+    def __init__(self, name: str, query: str, parameters: list, defaults: dict = None, derived: dict = None, sample: dict = None, description: str = None) -> None:
+        '''Parameters:
+            name: name used to look the query up in the library
+
+            query: AQL text using bind variables
+
+            parameters: bind variables the caller must supply
+
+            defaults: bind variables with default values (e.g., limit)
+
+            derived: bind variables computed from the others, as a dict of
+                     name -> callable(bind_vars)
+
+            sample: values used to explain the query at registration time
+        '''
+        self.name = name
+        self.query = query
+        self.parameters = parameters
+        self.defaults = defaults if defaults is not None else {}
+        self.derived = derived if derived is not None else {}
+        self.sample = sample if sample is not None else {}
+        self.description = description
+        self.plan = None
+        self.indexes = []
+        self.full_scans = []
+
+    def bind(self, **kwargs) -> dict:
+        missing = [p for p in self.parameters if p not in kwargs]
+        if len(missing) > 0:
+            raise ValueError(f'Query {self.name} is missing parameters {missing}')
+        bind_vars = dict(self.defaults)
+        bind_vars.update(kwargs)
+        for name, compute in self.derived.items():
+            bind_vars[name] = compute(bind_vars)
+        return bind_vars
+
+    def verify(self, db) -> 'IndalekoPreparedQuery':
+        '''Explain the query with its sample values and record which indices
+        the plan uses.  Warns if the plan scans a whole collection.'''
+        explanation = db.aql.explain(self.query, bind_vars=self.bind(**self.sample))
+        self.plan = explanation.get('plan', explanation) if isinstance(explanation, dict) else explanation
+        self.indexes = []
+        self.full_scans = []
+        for node in self.plan.get('nodes', []):
+            if node['type'] == 'EnumerateCollectionNode':
+                self.full_scans.append(node.get('collection'))
+            elif node['type'] == 'IndexNode':
+                self.indexes.extend(f'{node.get("collection")}:{index.get("name", index.get("id"))}' for index in node.get('indexes', []))
+            elif node['type'] == 'TraversalNode':
+                self.indexes.append('edge')
+        if len(self.full_scans) > 0:
+            message = f'Query {self.name} does a full scan of {self.full_scans}'
+            logging.warning(message)
+            warnings.warn(message, IndalekoFullScanWarning, stacklevel=2)
+        else:
+            logging.info(f'Query {self.name} uses indexes {self.indexes}')
+        return self
+
+
+class IndalekoQueryLibrary:
+    '''The set of prepared queries, verified against a database.'''
+
+    def __init__(self, db, query_cache: 'IndalekoQueryCache' = None, queries: dict = Indaleko_Queries, verify: bool = True) -> None:
+        '''Parameters:
+            db: ArangoDB database object
+
+            query_cache: optional IndalekoQueryCache used by execute()
+
+            queries: query definitions (see Indaleko_Queries)
+
+            verify: if True, explain each query as it is registered
+        '''
+        self.db = db
+        self.query_cache = query_cache
+        self.verify = verify
+        self.queries = {}
+        for name, definition in queries.items():
+            self.register(IndalekoPreparedQuery(name, **definition))
+
+    def register(self, query: IndalekoPreparedQuery) -> 'IndalekoQueryLibrary':
+        assert query.name not in self.queries, f'Duplicate query name {query.name}'
+        if self.verify:
+            query.verify(self.db)
+        self.queries[query.name] = query
+        return self
+
+    def get_query(self, name: str) -> IndalekoPreparedQuery:
+        return self.queries[name]
+
+    def execute(self, name: str, **kwargs) -> list:
+        query = self.queries[name]
+        bind_vars = query.bind(**kwargs)
+        if self.query_cache is not None:
+            return self.query_cache.execute(self.db, query.query, bind_vars)
+        return [document for document in self.db.aql.execute(query.query, bind_vars=bind_vars)]
+
+
+def main():
+    starttime = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    logfile = f'indalekoqueries-{starttime}.log'
+    parser = argparse.ArgumentParser(description='Verify the Indaleko prepared queries against the database')
+    parser.add_argument('--config', '-c', help='Path to the config file', default='./config/indaleko-db-config.ini')
+    parser.add_argument('--log', '-l', help='Log file to use', default=logfile)
+    parser.add_argument('--logdir', help='Log directory to use', default='./logs')
+    args = parser.parse_args()
+    os.makedirs(args.logdir, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(args.logdir, args.log), level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    from dbsetup import IndalekoDBConfig
+    config = IndalekoDBConfig(args.config)
+    config.start()
+    library = IndalekoQueryLibrary(config.db)
+    for name, query in library.queries.items():
+        status = f'FULL SCAN of {query.full_scans}' if len(query.full_scans) > 0 else f'uses {query.indexes}'
+        print(f'{name}: {status}')
+
+
+if __name__ == '__main__':
+    main()
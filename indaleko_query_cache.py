@@ -0,0 +1,176 @@
+import collections
+import json
+import re
+import threading
+
+'''
+A result cache for the query front end.  Interactive querying tends to issue
+the same lookups over and over; with the cache in front of the collection
+query APIs a repeated query is answered from memory instead of going to
+ArangoDB.
+
+Entries are keyed on the normalized query text plus the bind variables.  Each
+collection has a write version which is bumped whenever the collection is
+written through IndalekoCollection (before and after the write, and when the
+collection is reset); an entry remembers the versions of the
+collections it read and is discarded once any of them changes.  Writes made by
+other processes are not seen, so a cache should only be shared by code that
+writes through the same IndalekoCollection objects (or calls
+bump_write_version itself.)
+
+Cached results are shared between callers and must be treated as read-only.
+'''
+
+class IndalekoQueryCache:
+    '''LRU cache of query results with write-version invalidation.'''
+
+    DefaultMaxEntries = 1024
+    DefaultMaxBytes = 64 * 1024 * 1024
+
+    literal_pattern = re.compile(r"('(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|`[^`]*`)|\s+")
+    identifier_pattern = re.compile(r'[A-Za-z_][A-Za-z0-9_\-]*')
+
+    def __init__(self, max_entries: int = DefaultMaxEntries, max_bytes: int = DefaultMaxBytes) -> None:
+        '''Parameters:
+            max_entries: maximum number of cached results
+
+            max_bytes: approximate upper bound on the (JSON encoded) size of
+                       all cached results
+        '''
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.write_versions = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        '''Collapse whitespace outside of string literals so that formatting
+        differences do not produce distinct cache entries.'''
+        return IndalekoQueryCache.literal_pattern.sub(lambda match: match.group(1) or ' ', query.strip())
+
+    @staticmethod
+    def make_key(query: str, bind_vars: dict = None) -> tuple:
+        if bind_vars is None:
+            bind_vars = {}
+        return (IndalekoQueryCache.normalize_query(query), json.dumps(bind_vars, sort_keys=True, default=str))
+
+    def register_collection(self, name: str) -> 'IndalekoQueryCache':
+        with self.lock:
+            self.write_versions.setdefault(name, 0)
+        return self
+
+    def bump_write_version(self, name: str) -> int:
+        '''Record a write to the given collection, invalidating every cached
+        result that read from it.'''
+        with self.lock:
+            self.write_versions[name] = self.write_versions.get(name, 0) + 1
+            return self.write_versions[name]
+
+    def get_write_version(self, name: str) -> int:
+        return self.write_versions.get(name, 0)
+
+    def collections_read(self, query: str, bind_vars: dict = None) -> tuple:
+        '''Best effort list of the collections a query reads: any known
+        collection named in the query text, plus collection bind variables.
+        Over-approximating is harmless, it only makes invalidation more
+        eager.'''
+        names = set()
+        if bind_vars is not None:
+            names.update(value for key, value in bind_vars.items() if key.startswith('@'))
+        for token in self.identifier_pattern.findall(query):
+            if token in self.write_versions:
+                names.add(token)
+        return tuple(sorted(names))
+
+    def __is_current__(self, versions: tuple) -> bool:
+        for name, version in versions:
+            if self.write_versions.get(name, 0) != version:
+                return False
+        return True
+
+    def __remove__(self, key: tuple) -> None:
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def get(self, key: tuple):
+        '''Returns (True, result) for a current cached entry, otherwise
+        (False, None).'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return (False, None)
+            result, versions, _ = entry
+            if not self.__is_current__(versions):
+                self.__remove__(key)
+                self.invalidations += 1
+                self.misses += 1
+                return (False, None)
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return (True, result)
+
+    def put(self, key: tuple, result: list, collections: tuple, versions: tuple = None) -> 'IndalekoQueryCache':
+        '''Store a result.  versions should be the write versions captured
+        before the query ran, so a write that races with the query cannot
+        leave a stale entry behind.  That holds as long as writers bump the
+        version after the write has completed (IndalekoCollection bumps it
+        both before and after each write.)'''
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return self
+        with self.lock:
+            if versions is None:
+                versions = tuple((name, self.write_versions.get(name, 0)) for name in collections)
+            if key in self.entries:
+                self.__remove__(key)
+            self.entries[key] = (result, versions, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.__remove__(next(iter(self.entries)))
+                self.evictions += 1
+        return self
+
+    def lookup(self, query: str, bind_vars: dict, fetch, collections: tuple = None) -> list:
+        '''Return the cached result for (query, bind_vars) or call fetch() to
+        compute it and cache the result.'''
+        key = self.make_key(query, bind_vars)
+        found, result = self.get(key)
+        if found:
+            return result
+        if collections is None:
+            collections = self.collections_read(query, bind_vars)
+        with self.lock:
+            versions = tuple((name, self.write_versions.get(name, 0)) for name in collections)
+        result = list(fetch())
+        self.put(key, result, collections, versions)
+        return result
+
+    def execute(self, db, query: str, bind_vars: dict = None, collections: tuple = None) -> list:
+        '''Run an AQL query through the cache.'''
+        return self.lookup(query, bind_vars, lambda: db.aql.execute(query, bind_vars=bind_vars), collections)
+
+    def clear(self) -> 'IndalekoQueryCache':
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        return self
+
+    def get_stats(self) -> dict:
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+        }
+
+    def __str__(self) -> str:
+        return json.dumps(self.get_stats())
@@ -0,0 +1,294 @@
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import urllib.parse
+import zlib
+
+from indaleko import IndalekoRelationship
+from indaleko_normalize import (Normalizers, LocalNormalizer, read_pages, object_identifier, SameObjectRelationship,
+                                MatchBasisMetadata)
+from indaleko_serialize import get_serializer, add_serializer_argument
+from local_index import read_snapshot, get_snapshot_machine
+
+'''
+Reconciliation of locally synced files with their cloud items.  A OneDrive or
+Dropbox sync folder is indexed twice: by the local indexer (the
+*-local-fs-data snapshots) and by the cloud ingester.  This joins the two
+snapshots and emits a "same object" relationship (SameObjectRelationship,
+local object -> cloud object) for each file present in both, so queries and
+storage accounting do not count synced content twice.
+
+Files match on their path relative to the sync root (case insensitively, as
+both services are) plus their size.  When both sides have a content hash of
+the same kind the hashes must agree as well: the cloud side carries them
+(OneDrive sha1/sha256, Dropbox content_hash), and the local side has them if
+the snapshot recorded them or --verify is given (the local file is hashed,
+for path+size candidates only.)
+
+The join is a hash join: the cloud snapshot is the build side and the local
+snapshot is streamed past it.  For snapshots too large to hold in memory,
+--partitions N first splits both sides by key into N spill files and joins
+the partitions one at a time (a Grace hash join.)
+
+Object identifiers are computed by the normalizers (indaleko.object_identifier
+of the URI the normalizer assigns): the cloud side by the provider's
+normalizer, the local side by LocalNormalizer, with the snapshot's machine
+UUID as its account.  The local Objects the relationships point to are
+written by normalizing the same snapshot:
+
+    indaleko normalize --provider local <snapshot> --spool ...
+'''
+
+DropboxBlockSize = 4 * 1024 * 1024
+
+
+def dropbox_content_hash(file_name: str) -> str:
+    '''Dropbox content_hash: SHA-256 of the concatenated SHA-256 digests of
+    each 4 MB block.'''
+    digests = hashlib.sha256()
+    with open(file_name, 'rb') as fd:
+        while True:
+            block = fd.read(DropboxBlockSize)
+            if not block:
+                break
+            digests.update(hashlib.sha256(block).digest())
+    return digests.hexdigest()
+
+
+def file_digest(file_name: str, algorithm: str) -> str:
+    with open(file_name, 'rb') as fd:
+        return hashlib.file_digest(fd, algorithm).hexdigest()
+
+
+# how to compute each kind of hash for a local file
+LocalHashers = {
+    'sha1' : lambda file_name: file_digest(file_name, 'sha1'),
+    'sha256' : lambda file_name: file_digest(file_name, 'sha256'),
+    'content_hash' : dropbox_content_hash,
+}
+
+
+def normalize_relative_path(path: str, root: str) -> str:
+    '''The path relative to root, with / separators and lower cased, or None
+    if it is not under root.'''
+    path = path.replace('\\', '/')
+    root = root.replace('\\', '/').rstrip('/')
+    if root == '':
+        return path.lstrip('/').lower()
+    if not path.lower().startswith(root.lower() + '/'):
+        return None
+    return path[len(root) + 1:].lower()
+
+
+def local_files(records, local_root: str, machine: str):
+    '''Join rows for the files (not directories) of a local snapshot that
+    are under local_root.'''
+    normalizer = LocalNormalizer(machine)
+    for record in records:
+        if stat.S_ISDIR(record.get('st_mode', 0)):
+            continue
+        full_path = os.path.join(record['path'], record['file'])
+        relative = normalize_relative_path(full_path, local_root)
+        if relative is None:
+            continue
+        yield {
+            'key': [relative, record['st_size']],
+            'ObjectIdentifier': object_identifier(normalizer.get_uri(normalizer.get_item_id(record))),
+            'file': full_path,
+            'hashes': {kind: record[kind] for kind in LocalHashers if kind in record},
+        }
+
+
+def cloud_path(provider: str, item: dict) -> str:
+    if provider == 'onedrive':
+        if 'folder' in item or 'deleted' in item:
+            return None
+        parent = item.get('parentReference', {}).get('path')
+        if parent is None:
+            # delta queries (and so --delta and --watch output) leave the path out
+            raise ValueError(f"OneDrive item {item['id']} has no parent path; reconcile against a full crawl, "
+                             'not delta output')
+        # e.g. /drive/root:/My%20Documents (percent-encoded)
+        parent = urllib.parse.unquote(parent.split(':', 1)[1]) if ':' in parent else ''
+        return f"{parent}/{item['name']}"
+    if provider == 'dropbox':
+        if item.get('.tag') != 'file':
+            return None
+        return item['path_display']
+    raise ValueError(f'Reconciliation is not supported for {provider} (items have no paths)')
+
+
+def cloud_hashes(provider: str, item: dict) -> dict:
+    if provider == 'onedrive':
+        hashes = item.get('file', {}).get('hashes', {})
+        found = {}
+        if 'sha1Hash' in hashes:
+            found['sha1'] = hashes['sha1Hash'].lower()
+        if 'sha256Hash' in hashes:
+            found['sha256'] = hashes['sha256Hash'].lower()
+        return found
+    if 'content_hash' in item:
+        return {'content_hash': item['content_hash']}
+    return {}
+
+
+def cloud_files(provider: str, account: str, records, cloud_root: str = ''):
+    '''Join rows for the files of a cloud snapshot (raw items or change
+    records) that are under cloud_root.'''
+    normalizer = Normalizers[provider](account)
+    for record in records:
+        if 'change' in record and 'item' in record:
+            if record['change'] in ('deleted', 'removed'):
+                continue
+            record = record['item']
+        path = cloud_path(provider, record)
+        if path is None:
+            continue
+        relative = normalize_relative_path(path, cloud_root)
+        if relative is None:
+            continue
+        yield {
+            'key': [relative, int(record.get('size', 0))],
+            'ObjectIdentifier': object_identifier(normalizer.get_uri(record['id'])),
+            'hashes': cloud_hashes(provider, record),
+        }
+
+
+class IndalekoReconciler:
+    '''Hash join of local and cloud join rows.'''
+
+    def __init__(self, partitions: int = 1, verify: bool = False, spill_dir: str = None) -> None:
+        '''Parameters:
+            partitions: number of partitions for the Grace hash join (1 joins
+                        in memory)
+
+            verify: hash local files to compare with the cloud hashes
+
+            spill_dir: where partition files are written (default: a
+                       temporary directory)
+        '''
+        self.partitions = partitions
+        self.verify = verify
+        self.spill_dir = spill_dir
+        self.stats = {'local': 0, 'cloud': 0, 'matched': 0, 'hash mismatch': 0, 'hashed': 0}
+
+    def __check_hashes__(self, local: dict, cloud: dict) -> str:
+        '''Returns the match basis, or None if the contents differ.'''
+        for kind, value in cloud['hashes'].items():
+            local_value = local['hashes'].get(kind)
+            if local_value is None and self.verify and os.path.exists(local['file']):
+                local_value = local['hashes'][kind] = LocalHashers[kind](local['file'])
+                self.stats['hashed'] += 1
+            if local_value is None:
+                continue
+            if local_value.lower() != value.lower():
+                return None
+            return kind
+        return 'path+size'
+
+    def __join__(self, build, probe):
+        table = {}
+        for row in build:
+            self.stats['cloud'] += 1
+            table.setdefault(tuple(row['key']), []).append(row)
+        for local in probe:
+            self.stats['local'] += 1
+            for cloud in table.get(tuple(local['key']), ()):
+                basis = self.__check_hashes__(local, cloud)
+                if basis is None:
+                    self.stats['hash mismatch'] += 1
+                    continue
+                self.stats['matched'] += 1
+                yield IndalekoRelationship(local['ObjectIdentifier'], cloud['ObjectIdentifier'], SameObjectRelationship,
+                                           [{'UUID': MatchBasisMetadata, 'Data': basis}]).to_dict()
+
+    def __partition__(self, rows, prefix: str, directory: str) -> list:
+        # spill files are private to this run, so they use the binary format
+        encode = get_serializer('pickle').encode
+        files = [open(os.path.join(directory, f'{prefix}-{index}.pickle'), 'wb') for index in range(self.partitions)]
+        for row in rows:
+            index = zlib.crc32(row['key'][0].encode('utf-8')) % self.partitions
+            files[index].write(encode(row))
+        for fd in files:
+            fd.close()
+        return [fd.name for fd in files]
+
+    @staticmethod
+    def __read_rows__(file_name: str):
+        with open(file_name, 'rb') as fd:
+            yield from get_serializer('pickle').read_records(fd)
+
+    def reconcile(self, local_rows, cloud_rows):
+        '''Yields the same object relationships.'''
+        if self.partitions <= 1:
+            yield from self.__join__(cloud_rows, local_rows)
+            return
+        directory = tempfile.mkdtemp(prefix='indaleko-reconcile-', dir=self.spill_dir)
+        try:
+            cloud_parts = self.__partition__(cloud_rows, 'cloud', directory)
+            local_parts = self.__partition__(local_rows, 'local', directory)
+            for cloud_part, local_part in zip(cloud_parts, local_parts):
+                yield from self.__join__(self.__read_rows__(cloud_part), self.__read_rows__(local_part))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Link locally synced files to their cloud items')
+    parser.add_argument('--local', required=True, help='Local file system snapshot (output of the local indexer, either path encoding)')
+    parser.add_argument('--local-root', required=True, help='The sync folder on the local machine')
+    parser.add_argument('--machine', default=None, help='UUID of the machine the local snapshot was taken on (default: from the snapshot name)')
+    parser.add_argument('--cloud', required=True, help='Cloud snapshot (output of a full crawl by the cloud ingester)')
+    parser.add_argument('--provider', choices=['onedrive', 'dropbox'], required=True, help='Provider that produced the cloud snapshot')
+    parser.add_argument('--account', required=True, help='Account the cloud snapshot was collected from')
+    parser.add_argument('--cloud-root', default='', help='Folder in the cloud that is synced to --local-root (default: everything)')
+    parser.add_argument('--verify', action='store_true', default=False, help='Hash local files and require the hashes to match')
+    parser.add_argument('--partitions', type=int, default=1, help='Partition both sides to disk first (for snapshots larger than memory)')
+    parser.add_argument('--spool', default=None, help='Append the relationships to this spool directory (for indaleko_spool to upload)')
+    parser.add_argument('--output', default=None, help='Write the relationships to this file instead')
+    add_serializer_argument(parser)
+    add_serializer_argument(parser, '--input-format', 'Serialization format of --local and --cloud')
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING, help='Logging level to use')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    machine = args.machine if args.machine is not None else get_snapshot_machine(args.local)
+    if machine is None:
+        parser.error('--machine is required (the snapshot name does not include it)')
+    reconciler = IndalekoReconciler(partitions=args.partitions, verify=args.verify)
+    input_serializer = get_serializer(args.input_format)
+    local_rows = local_files(read_snapshot(args.local, input_serializer), args.local_root, machine)
+    cloud_rows = cloud_files(args.provider, args.account,
+                             (record for page in read_pages(args.cloud, serializer=input_serializer) for record in page),
+                             args.cloud_root)
+    relationships = reconciler.reconcile(local_rows, cloud_rows)
+    try:
+        if args.spool is not None:
+            from indaleko_spool import IndalekoSpool
+            spool = IndalekoSpool(args.spool)
+            batch = []
+            for relationship in relationships:
+                batch.append(relationship)
+                if len(batch) >= 1000:
+                    spool.append('Relationships', batch)
+                    batch = []
+            spool.append('Relationships', batch)
+            spool.close()
+            destination = args.spool
+        else:
+            destination = args.output if args.output is not None else os.path.splitext(args.cloud)[0] + '-same-objects.jsonl'
+            encode = get_serializer(args.format).encode
+            with open(destination, 'wb') as fd:
+                fd.writelines(encode(relationship) for relationship in relationships)
+    except ValueError as error:
+        parser.error(str(error))
+    stats = reconciler.stats
+    print(f"{stats['matched']} of {stats['local']} local files matched {stats['cloud']} cloud files "
+          f"({stats['hash mismatch']} differ in content, {stats['hashed']} hashed) to {destination}")
+
+
+if __name__ == '__main__':
+    main()
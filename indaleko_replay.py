@@ -0,0 +1,764 @@
+import argparse
+import base64
+import datetime
+import http.server
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.parse
+
+'''
+Offline replay server for the cloud APIs the ingesters use, so crawler
+throughput, concurrency settings and resume logic can be measured repeatably
+without live accounts or network access.
+
+One server answers all three APIs from the same (synthetic or recorded) tree:
+
+* Microsoft Graph at /graph/v1.0: items (with rolled up folder eTag/cTag),
+  folder children with @odata.nextLink paging, JSON $batch, and the delta
+  query
+* Google Drive at /drive/v3: files (including modifiedTime q= filters),
+  changes/startPageToken and changes
+* Dropbox at /dropbox/2: files/list_folder (recursive), list_folder/continue,
+  list_folder/longpoll and users/get_current_account
+
+Faults are injected according to a ReplayConfig: latency on every request,
+and a fraction of requests (including the requests inside a $batch) answered
+with 429 + Retry-After or 503.  Paging tokens and cursors are opaque, and
+stable while the tree changes.
+
+Control endpoints (not subject to fault injection):
+
+* POST /replay/mutate?count=N - change (and delete) N random files, which the
+  delta / changes / continue calls then report (and wakes any longpoll)
+* POST /replay/expire - invalidate every outstanding delta link, start page
+  token and cursor (Graph answers 410, Drive 404, Dropbox 409 reset)
+* GET /replay/stats - requests served, by API and status
+
+Run it standalone (python indaleko_replay.py --serve) and point an ingester
+at it, or run the built in crawler benchmark (--benchmark).
+'''
+
+Epoch = datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class ReplayConfig:
+    '''Fault injection and paging settings.'''
+
+    def __init__(self, latency: float = 0.0, throttle_rate: float = 0.0, retry_after: float = 1.0,
+                 error_rate: float = 0.0, page_size: int = 200, seed: int = None) -> None:
+        '''Parameters:
+            latency: mean seconds added to every request (uniformly jittered
+                     by +/- 50%)
+
+            throttle_rate: fraction of requests answered 429
+
+            retry_after: seconds sent in the Retry-After header of a 429
+
+            error_rate: fraction of requests answered 503
+
+            page_size: largest page returned (clients may ask for less)
+
+            seed: random seed, for repeatable fault sequences
+        '''
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def get_fault(self) -> tuple:
+        '''Returns (status, headers, body) for an injected fault, or None.'''
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.throttle_rate:
+            return 429, {'Retry-After': f'{self.retry_after:g}'}, {'error': {'code': 'TooManyRequests', 'message': 'replay throttle'}}
+        if draw < self.throttle_rate + self.error_rate:
+            return 503, {}, {'error': {'code': 'ServiceUnavailable', 'message': 'replay error'}}
+        return None
+
+    def delay(self) -> None:
+        if self.latency > 0:
+            with self.lock:
+                jitter = 0.5 + self.random.random()
+            time.sleep(self.latency * jitter)
+
+
+def encode_token(token: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(token, separators=(',', ':')).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token: str) -> dict:
+    try:
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+
+
+class ReplayTree:
+    '''
+    The files and folders being served.  Every item carries the tree version
+    at which it last changed, which is what the delta / changes / continue
+    calls report from.
+    '''
+
+    def __init__(self, seed: int = None) -> None:
+        self.items = {}
+        self.children = {None: []}
+        self.version = 1
+        # tokens issued before this version have expired
+        self.floor = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.paths = {}
+        self.subtree_versions = {}
+        self.subtree_at = None
+
+    def add(self, item_id: str, name: str, parent: str = None, folder: bool = False, size: int = 0, modified: datetime.datetime = None) -> dict:
+        item = {
+            'id': item_id,
+            'name': name,
+            'parent': parent,
+            'folder': folder,
+            'size': 0 if folder else size,
+            'modified': modified if modified is not None else Epoch,
+            'version': self.version,
+            'deleted': False,
+        }
+        self.items[item_id] = item
+        self.children.setdefault(parent, []).append(item_id)
+        if folder:
+            self.children.setdefault(item_id, [])
+        return item
+
+    @staticmethod
+    def generate(fanout: int = 4, depth: int = 3, files: int = 20, seed: int = None) -> 'ReplayTree':
+        '''Synthetic tree: every folder down to depth has fanout subfolders
+        and files files.'''
+        tree = ReplayTree(seed)
+        span = (datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc) - Epoch).total_seconds()
+        extensions = ('txt', 'docx', 'jpg', 'py', 'pdf', 'xlsx')
+        folders = [(None, 0)]
+        counter = 0
+        while folders:
+            parent, level = folders.pop()
+            for index in range(files):
+                counter += 1
+                modified = Epoch + datetime.timedelta(seconds=tree.random.random() * span)
+                tree.add(f'F{counter:011d}', f'file-{index:04d}.{tree.random.choice(extensions)}', parent,
+                         size=tree.random.randint(0, 1 << 24), modified=modified)
+            if level < depth:
+                for index in range(fanout):
+                    counter += 1
+                    folder_id = f'D{counter:011d}'
+                    tree.add(folder_id, f'folder-{level}-{index}', parent, folder=True,
+                             modified=Epoch + datetime.timedelta(seconds=tree.random.random() * span))
+                    folders.append((folder_id, level + 1))
+        return tree
+
+    @staticmethod
+    def load(provider: str, records_file: str) -> 'ReplayTree':
+        '''Tree recorded by an ingester (its JSON lines, or JSON array,
+        output.)'''
+        with open(records_file, 'rt') as fd:
+            text = fd.read()
+        records = json.loads(text) if text.lstrip().startswith('[') else [json.loads(line) for line in text.splitlines() if line.strip()]
+        tree = ReplayTree()
+        parse = lambda value: datetime.datetime.fromisoformat(value.replace('Z', '+00:00')) if value else None
+        if provider == 'onedrive':
+            for record in records:
+                parent = record.get('parentReference', {}).get('id')
+                tree.add(record['id'], record['name'], parent, folder='folder' in record,
+                         size=record.get('size', 0), modified=parse(record.get('lastModifiedDateTime')))
+        elif provider == 'gdrive':
+            for record in records:
+                parents = record.get('parents') or [None]
+                tree.add(record['id'], record['name'], parents[0], folder=record.get('mimeType') == DriveFolderType,
+                         size=int(record.get('size', 0)), modified=parse(record.get('modifiedTime')))
+        elif provider == 'dropbox':
+            ids = {record['path_lower']: record['id'] for record in records if 'path_lower' in record and 'id' in record}
+            for record in records:
+                if record.get('.tag') not in ('file', 'folder'):
+                    continue
+                parent = ids.get(record['path_lower'].rsplit('/', 1)[0])
+                tree.add(record['id'], record['name'], parent, folder=record['.tag'] == 'folder',
+                         size=record.get('size', 0), modified=parse(record.get('server_modified')))
+        else:
+            raise ValueError(f'Unknown provider {provider}')
+        # items whose parent was not recorded hang off the root
+        for item in tree.items.values():
+            if item['parent'] is not None and item['parent'] not in tree.items:
+                tree.children[item['parent']].remove(item['id'])
+                item['parent'] = None
+                tree.children[None].append(item['id'])
+        return tree
+
+    def get_path(self, item_id: str) -> str:
+        # iterative, so deep recorded trees do not hit the recursion limit
+        chain = []
+        current = item_id
+        while current is not None and current not in self.paths:
+            chain.append(current)
+            current = self.items[current]['parent']
+        path = '' if current is None else self.paths[current]
+        for x in reversed(chain):
+            path = self.paths[x] = f"{path}/{self.items[x]['name']}"
+        return path
+
+    def get_subtree_version(self, folder_id: str) -> int:
+        '''Latest change at or below the folder (None is the root), which
+        is what the folder's eTag/cTag roll up.'''
+        if self.subtree_at != self.version:
+            versions = {}
+            # post-order walk with an explicit stack (a folder is finished
+            # once all of its subfolders are)
+            stack = [(None, False)]
+            while stack:
+                parent, expanded = stack.pop()
+                children = self.children.get(parent, [])
+                if not expanded:
+                    stack.append((parent, True))
+                    stack.extend((child, False) for child in children if self.items[child]['folder'])
+                    continue
+                latest = self.items[parent]['version'] if parent is not None else 0
+                for child in children:
+                    latest = max(latest, versions[child] if self.items[child]['folder'] else self.items[child]['version'])
+                versions[parent] = latest
+            self.subtree_versions = versions
+            self.subtree_at = self.version
+        return self.subtree_versions[folder_id]
+
+    def mutate(self, count: int = 1, delete_fraction: float = 0.1) -> int:
+        '''Change count random files (deleting some of them); returns the new
+        version.'''
+        with self.changed:
+            self.version += 1
+            files = [item for item in self.items.values() if not item['folder'] and not item['deleted']]
+            for item in self.random.sample(files, min(count, len(files))):
+                item['version'] = self.version
+                if self.random.random() < delete_fraction:
+                    item['deleted'] = True
+                else:
+                    item['size'] = self.random.randint(0, 1 << 24)
+                    item['modified'] = datetime.datetime.now(datetime.timezone.utc)
+            self.changed.notify_all()
+            return self.version
+
+    def expire(self) -> int:
+        with self.lock:
+            self.floor = self.version
+            self.version += 1
+            return self.version
+
+    def wait_for_change(self, version: int, timeout: float) -> bool:
+        '''Block until the tree is newer than version, or timeout.'''
+        with self.changed:
+            return self.changed.wait_for(lambda: self.version > version, timeout)
+
+    def page(self, item_ids, after: str, size: int) -> tuple:
+        '''Keyset paging: the items after the given id.  Returns (items,
+        last id or None when there are no more).'''
+        ordered = sorted(item_ids)
+        if after is not None:
+            ordered = [x for x in ordered if x > after]
+        selected = ordered[:size]
+        more = len(ordered) > size
+        return [self.items[x] for x in selected], (selected[-1] if more else None)
+
+    def listing(self, predicate=None) -> list:
+        return [x for x, item in self.items.items() if not item['deleted'] and (predicate is None or predicate(item))]
+
+    def changes(self, base: int, upto: int, after: str, size: int) -> tuple:
+        '''Items changed in (base, upto], paged by (version, id).'''
+        keyed = sorted((f"{item['version']:012d}/{x}", x) for x, item in self.items.items() if base < item['version'] <= upto)
+        if after is not None:
+            keyed = [k for k in keyed if k[0] > after]
+        selected = keyed[:size]
+        more = len(keyed) > size
+        return [self.items[x] for _, x in selected], (selected[-1][0] if more else None)
+
+
+DriveFolderType = 'application/vnd.google-apps.folder'
+
+
+def timestamp(value: datetime.datetime) -> str:
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class ReplayApis:
+    '''The provider APIs.  Each handler takes (method, path, query, body) and
+    returns (status, headers, body).'''
+
+    def __init__(self, tree: ReplayTree, config: ReplayConfig, base_url: str) -> None:
+        self.tree = tree
+        self.config = config
+        self.base_url = base_url
+
+    @staticmethod
+    def error(status: int, code: str, message: str) -> tuple:
+        return status, {}, {'error': {'code': code, 'message': message}}
+
+    def page_size(self, requested) -> int:
+        if requested is None:
+            return self.config.page_size
+        return max(1, min(int(requested), self.config.page_size))
+
+    # Microsoft Graph
+
+    def graph_item(self, item: dict) -> dict:
+        if item['deleted']:
+            return {'id': item['id'], 'name': item['name'], 'deleted': {'state': 'deleted'},
+                    'parentReference': {'id': item['parent'] or 'root'}}
+        entry = {
+            'id': item['id'],
+            'name': item['name'],
+            'size': item['size'],
+            'createdDateTime': timestamp(Epoch),
+            'lastModifiedDateTime': timestamp(item['modified']),
+            'parentReference': {'id': item['parent'] or 'root', 'path': '/drive/root:' + self.tree.get_path(item['parent']) if item['parent'] else '/drive/root:'},
+        }
+        # folder tags roll up every change below the folder
+        if item['folder']:
+            entry['folder'] = {'childCount': len(self.tree.children.get(item['id'], []))}
+            tag = self.tree.get_subtree_version(item['id'])
+        else:
+            entry['file'] = {'mimeType': 'application/octet-stream'}
+            tag = item['version']
+        entry['eTag'] = f'"{{{item["id"]}}},{tag}"'
+        entry['cTag'] = f'"c:{{{item["id"]}}},{tag}"'
+        return entry
+
+    def graph(self, method: str, path: str, query: dict, body) -> tuple:
+        graph_root = f'{self.base_url}/graph/v1.0'
+        if method == 'POST' and path == '/$batch':
+            return self.graph_batch(body)
+        match = re.fullmatch(r'/me/drive/(?:root|items/([^/]+))', path)
+        if method == 'GET' and match:
+            folder_id = None if match.group(1) in (None, 'root') else match.group(1)
+            if folder_id is not None:
+                if folder_id not in self.tree.items or self.tree.items[folder_id]['deleted']:
+                    return self.error(404, 'itemNotFound', f'Item {folder_id} not found')
+                with self.tree.lock:
+                    return 200, {}, self.graph_item(self.tree.items[folder_id])
+            with self.tree.lock:
+                tag = self.tree.get_subtree_version(None)
+            return 200, {}, {'id': 'root', 'name': 'root', 'root': {}, 'folder': {'childCount': len(self.tree.children[None])},
+                             'eTag': f'"{{root}},{tag}"', 'cTag': f'"c:{{root}},{tag}"'}
+        match = re.fullmatch(r'/me/drive/(?:root|items/([^/]+))/children', path)
+        if method == 'GET' and match:
+            folder_id = None if match.group(1) == 'root' else match.group(1)
+            if folder_id is not None and (folder_id not in self.tree.items or self.tree.items[folder_id]['deleted']):
+                return self.error(404, 'itemNotFound', f'Item {folder_id} not found')
+            with self.tree.lock:
+                children = [x for x in self.tree.children.get(folder_id, []) if not self.tree.items[x]['deleted']]
+                items, last = self.tree.page(children, query.get('$skiptoken'), self.page_size(query.get('$top')))
+                data = {'value': [self.graph_item(item) for item in items]}
+            if last is not None:
+                data['@odata.nextLink'] = f'{graph_root}{path}?' + urllib.parse.urlencode(dict(query, **{'$skiptoken': last}), safe='$,')
+            return 200, {}, data
+        if method == 'GET' and path == '/me/drive/root/delta':
+            token = decode_token(query['token']) if 'token' in query else {'mode': 'list', 'start': None, 'after': None}
+            if token is None:
+                return self.error(400, 'invalidRequest', 'Bad delta token')
+            with self.tree.lock:
+                if token['mode'] == 'list':
+                    start = token['start'] if token['start'] is not None else self.tree.version
+                    if start <= self.tree.floor:
+                        return self.error(410, 'resyncRequired', 'Delta token expired')
+                    items, last = self.tree.page(self.tree.listing(), token['after'], self.page_size(query.get('$top')))
+                    following = {'mode': 'list', 'start': start, 'after': last}
+                    final = {'mode': 'changes', 'base': start, 'upto': None, 'after': None}
+                else:
+                    if token['base'] <= self.tree.floor:
+                        return self.error(410, 'resyncRequired', 'Delta token expired')
+                    upto = token['upto'] if token['upto'] is not None else self.tree.version
+                    items, last = self.tree.changes(token['base'], upto, token['after'], self.page_size(query.get('$top')))
+                    following = {'mode': 'changes', 'base': token['base'], 'upto': upto, 'after': last}
+                    final = {'mode': 'changes', 'base': upto, 'upto': None, 'after': None}
+                data = {'value': [self.graph_item(item) for item in items]}
+            rest = {k: v for k, v in query.items() if k != 'token'}
+            link = lambda t: f'{graph_root}{path}?' + urllib.parse.urlencode(dict(rest, token=encode_token(t)), safe='$,')
+            if last is not None:
+                data['@odata.nextLink'] = link(following)
+            else:
+                data['@odata.deltaLink'] = link(final)
+            return 200, {}, data
+        return self.error(404, 'notFound', f'{method} {path} is not replayed')
+
+    def graph_batch(self, body: dict) -> tuple:
+        requests = body.get('requests', [])
+        if len(requests) > 20:
+            return self.error(400, 'invalidRequest', 'Too many requests in batch')
+        responses = []
+        for request in requests:
+            fault = self.config.get_fault()
+            if fault is not None:
+                status, headers, data = fault
+            else:
+                url = urllib.parse.urlsplit(request['url'])
+                query = dict(urllib.parse.parse_qsl(url.query))
+                status, headers, data = self.graph(request.get('method', 'GET'), url.path, query, request.get('body'))
+            responses.append({'id': request['id'], 'status': status, 'headers': headers, 'body': data})
+        return 200, {}, {'responses': responses}
+
+    # Google Drive
+
+    def drive_file(self, item: dict) -> dict:
+        return {
+            'kind': 'drive#file',
+            'id': item['id'],
+            'name': item['name'],
+            'mimeType': DriveFolderType if item['folder'] else 'application/octet-stream',
+            'parents': [item['parent'] or 'root'],
+            'size': str(item['size']),
+            'createdTime': timestamp(Epoch),
+            'modifiedTime': timestamp(item['modified']),
+            'trashed': False,
+        }
+
+    @staticmethod
+    def drive_predicate(q: str):
+        '''Supports the modifiedTime comparisons the partitioned listing uses,
+        joined with "and".'''
+        if not q:
+            return None
+        terms = []
+        for term in re.split(r'\s+and\s+', q.strip()):
+            match = re.fullmatch(r"modifiedTime\s*(<=|>=|<|>|=)\s*'([^']+)'", term.strip())
+            if match is None:
+                raise ValueError(f'Unsupported query term {term}')
+            value = datetime.datetime.fromisoformat(match.group(2).replace('Z', '+00:00'))
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=datetime.timezone.utc)
+            terms.append((match.group(1), value))
+        compare = {'<': lambda a, b: a < b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b,
+                   '>=': lambda a, b: a >= b, '=': lambda a, b: a == b}
+        return lambda item: all(compare[op](item['modified'], value) for op, value in terms)
+
+    def drive(self, method: str, path: str, query: dict, body) -> tuple:
+        if method != 'GET':
+            return self.error(404, 'notFound', f'{method} {path} is not replayed')
+        if path == '/files':
+            try:
+                predicate = self.drive_predicate(query.get('q'))
+            except ValueError as e:
+                return self.error(400, 'invalid', str(e))
+            token = decode_token(query['pageToken']) if 'pageToken' in query else {'after': None}
+            if token is None:
+                return self.error(400, 'invalid', 'Invalid Value')
+            with self.tree.lock:
+                items, last = self.tree.page(self.tree.listing(predicate), token['after'], self.page_size(query.get('pageSize')))
+                data = {'kind': 'drive#fileList', 'files': [self.drive_file(item) for item in items]}
+            if last is not None:
+                data['nextPageToken'] = encode_token({'after': last})
+            return 200, {}, data
+        if path == '/changes/startPageToken':
+            return 200, {}, {'kind': 'drive#startPageToken', 'startPageToken': encode_token({'base': self.tree.version, 'upto': None, 'after': None})}
+        if path == '/changes':
+            token = decode_token(query.get('pageToken', ''))
+            if token is None or 'base' not in token:
+                return self.error(400, 'invalid', 'Invalid Value')
+            with self.tree.lock:
+                if token['base'] <= self.tree.floor:
+                    return self.error(404, 'notFound', 'Page token expired')
+                upto = token['upto'] if token['upto'] is not None else self.tree.version
+                items, last = self.tree.changes(token['base'], upto, token['after'], self.page_size(query.get('pageSize')))
+                changes = []
+                for item in items:
+                    change = {'kind': 'drive#change', 'changeType': 'file', 'fileId': item['id'], 'removed': item['deleted'], 'time': timestamp(item['modified'])}
+                    if not item['deleted']:
+                        change['file'] = self.drive_file(item)
+                    changes.append(change)
+            data = {'kind': 'drive#changeList', 'changes': changes}
+            if last is not None:
+                data['nextPageToken'] = encode_token({'base': token['base'], 'upto': upto, 'after': last})
+            else:
+                data['newStartPageToken'] = encode_token({'base': upto, 'upto': None, 'after': None})
+            return 200, {}, data
+        return self.error(404, 'notFound', f'{method} {path} is not replayed')
+
+    # Dropbox
+
+    def dropbox_entry(self, item: dict) -> dict:
+        path = self.tree.get_path(item['id'])
+        if item['deleted']:
+            return {'.tag': 'deleted', 'name': item['name'], 'path_lower': path.lower(), 'path_display': path}
+        entry = {'.tag': 'folder' if item['folder'] else 'file', 'id': f"id:{item['id']}", 'name': item['name'],
+                 'path_lower': path.lower(), 'path_display': path}
+        if not item['folder']:
+            entry.update({'size': item['size'], 'server_modified': timestamp(item['modified']),
+                          'client_modified': timestamp(item['modified']), 'rev': f"{item['version']:09x}"})
+        return entry
+
+    def dropbox_error(self, summary: str) -> tuple:
+        return 409, {}, {'error_summary': summary, 'error': {'.tag': summary.split('/')[0]}}
+
+    def dropbox_page(self, token: dict, limit: int) -> tuple:
+        with self.tree.lock:
+            if token['mode'] == 'list':
+                items, last = self.tree.page(self.tree.listing(), token['after'], limit)
+                following = dict(token, after=last)
+                final = {'mode': 'changes', 'base': token['start'], 'upto': None, 'after': None}
+            else:
+                if token['base'] <= self.tree.floor:
+                    return self.dropbox_error('reset/...')
+                upto = token['upto'] if token['upto'] is not None else self.tree.version
+                items, last = self.tree.changes(token['base'], upto, token['after'], limit)
+                following = dict(token, upto=upto, after=last)
+                final = {'mode': 'changes', 'base': upto, 'upto': None, 'after': None}
+            entries = [self.dropbox_entry(item) for item in items]
+        cursor = encode_token(following if last is not None else final)
+        return 200, {}, {'entries': entries, 'cursor': cursor, 'has_more': last is not None}
+
+    def dropbox(self, method: str, path: str, query: dict, body) -> tuple:
+        if method != 'POST':
+            return self.error(404, 'notFound', f'{method} {path} is not replayed')
+        body = body or {}
+        if path == '/users/get_current_account':
+            return 200, {}, {'account_id': 'dbid:replay', 'email': 'replay@example.com', 'name': {'display_name': 'Replay'}}
+        if path == '/files/list_folder':
+            if body.get('path', '') != '':
+                return self.dropbox_error('path/not_found/...')
+            token = {'mode': 'list', 'start': self.tree.version, 'after': None}
+            return self.dropbox_page(token, self.page_size(body.get('limit')))
+        if path == '/files/list_folder/continue':
+            token = decode_token(body.get('cursor', ''))
+            if token is None:
+                return self.dropbox_error('reset/...')
+            return self.dropbox_page(token, self.config.page_size)
+        if path == '/files/list_folder/get_latest_cursor':
+            return 200, {}, {'cursor': encode_token({'mode': 'changes', 'base': self.tree.version, 'upto': None, 'after': None})}
+        if path == '/files/list_folder/longpoll':
+            token = decode_token(body.get('cursor', ''))
+            if token is None:
+                return self.dropbox_error('reset/...')
+            base = token['base'] if token['mode'] == 'changes' else token['start']
+            timeout = min(480, max(30, int(body.get('timeout', 30))))
+            with self.tree.lock:
+                pending = any(base < item['version'] for item in self.tree.items.values())
+            changes = pending or self.tree.wait_for_change(self.tree.version, timeout)
+            return 200, {}, {'changes': changes}
+        return self.error(404, 'notFound', f'{method} {path} is not replayed')
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    Apis = {
+        '/graph/v1.0': 'graph',
+        '/drive/v3': 'drive',
+        '/dropbox/2': 'dropbox',
+    }
+
+    def log_message(self, format, *args) -> None:
+        logging.debug(format % args)
+
+    def reply(self, status: int, headers: dict, data) -> None:
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def dispatch(self, method: str) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length > 0 else b''
+        body = json.loads(raw) if raw.strip() and raw.strip() != b'null' else None
+        server = self.server
+        if url.path.startswith('/replay/'):
+            self.reply(*server.control(method, url.path, query))
+            return
+        for prefix, api in self.Apis.items():
+            if url.path.startswith(prefix + '/'):
+                break
+        else:
+            self.reply(404, {}, {'error': {'code': 'notFound', 'message': self.path}})
+            return
+        server.config.delay()
+        fault = server.config.get_fault()
+        if fault is not None:
+            status, headers, data = fault
+        else:
+            status, headers, data = getattr(server.apis, api)(method, url.path[len(prefix):], query, body)
+        server.record(api, status)
+        self.reply(status, headers, data)
+
+    def do_GET(self) -> None:
+        self.dispatch('GET')
+
+    def do_POST(self) -> None:
+        self.dispatch('POST')
+
+
+class ReplayServer(http.server.ThreadingHTTPServer):
+    '''The replay server.  Use start() to serve from a background thread.'''
+
+    daemon_threads = True
+
+    def __init__(self, tree: ReplayTree, config: ReplayConfig = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        super().__init__((host, port), ReplayHandler)
+        self.tree = tree
+        self.config = config if config is not None else ReplayConfig()
+        self.base_url = f'http://{self.server_address[0]}:{self.server_address[1]}'
+        self.apis = ReplayApis(tree, self.config, self.base_url)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    def get_endpoints(self) -> dict:
+        return {
+            'onedrive': f'{self.base_url}/graph/v1.0',
+            'gdrive': f'{self.base_url}/drive/v3',
+            'dropbox': f'{self.base_url}/dropbox/2',
+        }
+
+    def record(self, api: str, status: int) -> None:
+        with self.stats_lock:
+            entry = self.stats.setdefault(api, {})
+            entry[str(status)] = entry.get(str(status), 0) + 1
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            return {api: dict(entry) for api, entry in self.stats.items()}
+
+    def reset_stats(self) -> None:
+        with self.stats_lock:
+            self.stats.clear()
+
+    def control(self, method: str, path: str, query: dict) -> tuple:
+        if method == 'POST' and path == '/replay/mutate':
+            return 200, {}, {'version': self.tree.mutate(int(query.get('count', 1)), float(query.get('delete', 0.1)))}
+        if method == 'POST' and path == '/replay/expire':
+            return 200, {}, {'version': self.tree.expire()}
+        if method == 'GET' and path == '/replay/stats':
+            return 200, {}, {'version': self.tree.version, 'items': len(self.tree.items), 'requests': self.get_stats()}
+        return 404, {}, {'error': {'code': 'notFound', 'message': path}}
+
+    def start(self) -> 'ReplayServer':
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class ReplayToken:
+    '''Token provider for clients talking to the replay server.'''
+
+    def get_token(self) -> str:
+        return 'replay'
+
+
+def benchmark_onedrive(server: ReplayServer, workers: int, batch_size: int) -> int:
+    from indaleko_http import IndalekoHttpClient
+    from onedrive_index import OneDriveCrawler
+    client = IndalekoHttpClient(token_provider=ReplayToken(), backoff=0.05, max_backoff=2.0, pool_size=workers)
+    crawler = OneDriveCrawler(ReplayToken(), max_workers=workers, client=client, batch_size=batch_size,
+                              endpoint=server.get_endpoints()['onedrive'])
+    return len(crawler.crawl())
+
+
+def benchmark_dropbox(server: ReplayServer, workers: int, batch_size: int) -> int:
+    from dropbox_index import DropboxIngest
+    from indaleko_http import IndalekoHttpClient
+    from IndalekoIngest import IndalekoCrawlStream
+    ingest = DropboxIngest()
+    ingest.ApiEndpoint = ingest.NotifyEndpoint = server.get_endpoints()['dropbox']
+    ingest.data_dir = tempfile.mkdtemp() + '/'
+    ingest.args = argparse.Namespace(profile='index', incremental=False, watch=False, rate=None)
+    ingest.client = IndalekoHttpClient(token_provider=ReplayToken(), backoff=0.05, max_backoff=2.0)
+    stream = IndalekoCrawlStream(os.path.join(ingest.data_dir, 'dropbox.jsonl'))
+    ingest.stream_metadata(stream)
+    stream.finish()
+    return stream.get_count()
+
+
+def benchmark_gdrive(server: ReplayServer, workers: int, batch_size: int) -> int:
+    from gdrive_index import GoogleDriveIngest
+    from indaleko_http import IndalekoHttpClient
+    from IndalekoIngest import IndalekoCrawlStream
+    ingest = GoogleDriveIngest()
+    ingest.DriveEndpoint = server.get_endpoints()['gdrive']
+    ingest.data_dir = tempfile.mkdtemp() + '/'
+    ingest.email = 'replay@example.com'
+    ingest.args = argparse.Namespace(profile='index', incremental=False, workers=workers, partitions=16, rate=None)
+    ingest.client = IndalekoHttpClient(token_provider=ReplayToken(), backoff=0.05, max_backoff=2.0, pool_size=workers)
+    stream = IndalekoCrawlStream(os.path.join(ingest.data_dir, 'gdrive.jsonl'))
+    ingest.stream_metadata(stream)
+    stream.finish()
+    return stream.get_count()
+
+
+Benchmarks = {
+    'onedrive' : benchmark_onedrive,
+    'gdrive' : benchmark_gdrive,
+    'dropbox' : benchmark_dropbox,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline replay server for the cloud storage APIs')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='Port to listen on (0 = any)')
+    parser.add_argument('--records', type=str, default=None, help='Serve a tree recorded by an ingester (see --provider) instead of a synthetic one')
+    parser.add_argument('--provider', choices=['onedrive', 'gdrive', 'dropbox'], default='onedrive', help='Format of --records')
+    parser.add_argument('--fanout', type=int, default=4, help='Subfolders per folder (synthetic tree)')
+    parser.add_argument('--depth', type=int, default=3, help='Folder depth (synthetic tree)')
+    parser.add_argument('--files', type=int, default=20, help='Files per folder (synthetic tree)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean latency per request (ms)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered 503')
+    parser.add_argument('--page-size', type=int, default=200, help='Largest page returned')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed')
+    parser.add_argument('--serve', action='store_true', default=False, help='Serve until interrupted')
+    parser.add_argument('--benchmark', nargs='+', choices=list(Benchmarks), default=None, help='Crawl the tree with these ingesters')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help='Crawler concurrency settings to benchmark')
+    parser.add_argument('--batch', type=int, default=20, help='Graph $batch size for the OneDrive benchmark')
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING, help='Logging level to use')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    if args.records is not None:
+        tree = ReplayTree.load(args.provider, args.records)
+    else:
+        tree = ReplayTree.generate(args.fanout, args.depth, args.files, args.seed)
+    config = ReplayConfig(latency=args.latency / 1000.0, throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+                          error_rate=args.error_rate, page_size=args.page_size, seed=args.seed)
+    server = ReplayServer(tree, config, args.host, args.port if args.serve else 0).start()
+    print(f'Serving {len(tree.items)} items at {server.base_url}')
+    for provider, endpoint in server.get_endpoints().items():
+        print(f'  {provider}: {endpoint}')
+    if args.benchmark is not None:
+        for provider in args.benchmark:
+            for workers in args.workers:
+                server.reset_stats()
+                start = time.perf_counter()
+                count = Benchmarks[provider](server, workers, args.batch)
+                elapsed = time.perf_counter() - start
+                print(f'{provider:>8} workers={workers:<3} {count} items in {elapsed:.2f}s '
+                      f'({count / elapsed:.0f} items/s) requests={server.get_stats()}')
+    if args.serve:
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
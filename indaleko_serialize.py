@@ -0,0 +1,267 @@
+import argparse
+import json
+import logging
+import pickle
+import time
+
+'''
+Serializers for everything the ingesters write: crawl output (JSON lines and
+the older single document files), spool batches and change streams.  Output
+used to be written with json.dump(..., indent=4), which spends much of an
+ingester's CPU time on whitespace and on building a new encoder for every
+call; at tens of millions of records that is a large share of a run.
+
+Every serializer provides the same operations:
+
+* encode(record) / read_records(fd) for record streams.  Records are framed
+  so that a stream can be appended to and resumed at a byte offset (JSON: one
+  record per line; pickle: pickle frames are self delimiting.)
+* dump(document, fd) / load(fd) for a whole document (e.g., a list of
+  records.)
+
+The formats are:
+
+* json: the standard library encoder, compact (no indentation or spaces
+  after separators) and reused across calls.  This is the default.
+* orjson: the same JSON, encoded by orjson, which is several times faster.
+  It is optional: if orjson is not installed, json is used instead.
+* pickle: a binary format, faster than the standard library JSON and able to
+  hold any Python value (datetimes, bytes), but only readable by Python and
+  only safe to load from files you wrote.
+
+read_records() and read_document() read JSON (either JSON serializer) unless
+they are given another serializer.  Pickle files are only read when the
+pickle format is asked for explicitly (--format pickle), since unpickling a
+file can run arbitrary code; a pickle file read as JSON is rejected.  Run
+this module to compare the formats (records per second.)
+'''
+
+DefaultFormat = 'json'
+
+
+class IndalekoSerializer:
+    '''Base class for the serializers.'''
+
+    name = None
+    # True if the encoding is not text (cannot be written to a text file or a
+    # line oriented stream)
+    binary = False
+
+    def encode(self, record) -> bytes:
+        '''One record, framed for a record stream.'''
+        assert False, 'encode must be overridden by a subclass'
+
+    def decode(self, data: bytes):
+        assert False, 'decode must be overridden by a subclass'
+
+    def read_records(self, fd):
+        '''The records of a stream written with encode() (fd is binary.)  An
+        incomplete record at the end (a torn write) is ignored.'''
+        for line in fd:
+            if not line.endswith(b'\n'):
+                logging.warning(f'Ignoring incomplete record at end of {getattr(fd, "name", "stream")}')
+                break
+            if line.strip():
+                yield self.decode(line)
+
+    def dump(self, document, fd) -> None:
+        '''Write a whole document (fd is binary.)'''
+        fd.write(self.encode(document))
+
+    def load(self, fd):
+        return self.decode(fd.read())
+
+
+class JsonSerializer(IndalekoSerializer):
+    '''Compact JSON using one encoder and decoder for every call.'''
+
+    name = 'json'
+
+    def __init__(self) -> None:
+        self.encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, check_circular=False)
+        self.decoder = json.JSONDecoder()
+
+    def encode(self, record) -> bytes:
+        return (self.encoder.encode(record) + '\n').encode('utf-8')
+
+    def decode(self, data: bytes):
+        return self.decoder.decode(data.decode('utf-8'))
+
+
+class OrjsonSerializer(IndalekoSerializer):
+    '''Compact JSON encoded by orjson.'''
+
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        import orjson
+        self.orjson = orjson
+        self.options = orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+
+    def encode(self, record) -> bytes:
+        return self.orjson.dumps(record, option=self.options)
+
+    def decode(self, data: bytes):
+        return self.orjson.loads(data)
+
+
+class PickleSerializer(IndalekoSerializer):
+    '''Binary records: one pickle per record.'''
+
+    name = 'pickle'
+    binary = True
+
+    def encode(self, record) -> bytes:
+        return pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data: bytes):
+        return pickle.loads(data)
+
+    def read_records(self, fd):
+        unpickler = pickle.Unpickler(fd)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                break
+            except pickle.UnpicklingError:
+                logging.warning(f'Ignoring incomplete record at end of {getattr(fd, "name", "stream")}')
+                break
+
+    def load(self, fd):
+        return pickle.load(fd)
+
+
+Serializers = {
+    'json' : JsonSerializer,
+    'orjson' : OrjsonSerializer,
+    'pickle' : PickleSerializer,
+}
+
+Instances = {}
+
+
+def get_serializer(name: str = None) -> IndalekoSerializer:
+    '''The (shared) serializer for a format; orjson falls back to json when
+    orjson is not installed.'''
+    if name is None:
+        name = DefaultFormat
+    assert name in Serializers, f'Unknown serialization format {name}'
+    if name not in Instances:
+        try:
+            Instances[name] = Serializers[name]()
+        except ImportError:
+            logging.warning(f'{name} is not installed, using {DefaultFormat} instead')
+            Instances[name] = get_serializer(DefaultFormat)
+    return Instances[name]
+
+
+def add_serializer_argument(parser, option: str = '--format', help: str = 'Output serialization format') -> None:
+    '''Adds the standard --format option (or another option naming a
+    format, such as --input-format) to a parser.'''
+    parser.add_argument(option, choices=list(Serializers), default=DefaultFormat,
+                        help=f'{help} (default: {DefaultFormat})')
+
+
+def check_not_pickle(fd, serializer: IndalekoSerializer) -> None:
+    '''Refuse to read a pickle file with a text serializer.  Pickle files
+    are never recognized automatically: loading one can run arbitrary code,
+    so they are only read when the caller asks for the pickle format.'''
+    position = fd.tell()
+    first = fd.read(1)
+    fd.seek(position)
+    if first == b'\x80' and not serializer.binary:
+        raise ValueError(f'{getattr(fd, "name", "input")} is a pickle file; ask for the pickle format to read it '
+                         '(only if you trust it)')
+
+
+def read_records(file_name: str, serializer: IndalekoSerializer = None):
+    '''The records of an output file: a record stream, or (JSON only) a
+    single document holding a list of records (the older output files.)
+    serializer is the format the file was written in (default: JSON.)'''
+    if serializer is None:
+        serializer = get_serializer()
+    with open(file_name, 'rb') as fd:
+        check_not_pickle(fd, serializer)
+        if not serializer.binary:
+            first = fd.read(1)
+            while first.isspace():
+                first = fd.read(1)
+            fd.seek(0)
+            if first == b'[':
+                yield from serializer.load(fd)
+                return
+        yield from serializer.read_records(fd)
+
+
+def read_document(file_name: str, serializer: IndalekoSerializer = None):
+    '''A whole document written by dump() (default format: JSON.)'''
+    if serializer is None:
+        serializer = get_serializer()
+    with open(file_name, 'rb') as fd:
+        check_not_pickle(fd, serializer)
+        return serializer.load(fd)
+
+
+def write_document(file_name: str, document, serializer: IndalekoSerializer = None) -> None:
+    if serializer is None:
+        serializer = get_serializer()
+    with open(file_name, 'wb') as fd:
+        serializer.dump(document, fd)
+
+
+def benchmark_serializers(count: int = 100000) -> list:
+    '''Encode and decode rates (records per second) for each available
+    format, using records shaped like a cloud item and a local stat entry.'''
+    records = []
+    for index in range(count):
+        if index % 2:
+            records.append({
+                'id': f'01BYE5RZ6QN3ZWBTUFOFD3GSPGOHDJD{index:08d}', 'name': f'Document {index}.docx',
+                'size': index * 37, 'createdDateTime': '2023-04-01T10:11:12Z',
+                'lastModifiedDateTime': '2024-02-03T04:05:06Z',
+                'parentReference': {'id': '01BYE5RZ56Y2GOVW7725BZO354PWSELRRZ', 'path': '/drive/root:/Documents/Reports'},
+                'file': {'mimeType': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                         'hashes': {'quickXorHash': 'dGhpcyBpcyBub3QgYSByZWFsIGhhc2g='}},
+            })
+        else:
+            records.append({
+                'st_mode': 33188, 'st_ino': 1000000 + index, 'st_dev': 2049, 'st_nlink': 1, 'st_uid': 1000,
+                'st_gid': 1000, 'st_size': index * 91, 'st_atime': 1700000000.123 + index,
+                'st_mtime': 1700000000.456, 'st_ctime': 1700000000.789, 'file': f'file-{index}.txt',
+                'path': '/home/user/projects/indaleko/data', 'URI': f'\\\\?\\Volume{{{index}}}\\file-{index}.txt',
+            })
+    results = []
+    baseline = time.perf_counter()
+    encoded = [json.dumps(record, indent=4) for record in records]
+    elapsed = time.perf_counter() - baseline
+    results.append({'format': 'json (indent=4)', 'encode': count / elapsed, 'decode': None,
+                    'bytes': sum(len(x) for x in encoded) / count})
+    for name in Serializers:
+        serializer = get_serializer(name)
+        if serializer.name != name:
+            continue
+        start = time.perf_counter()
+        encoded = [serializer.encode(record) for record in records]
+        encode_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for data in encoded:
+            serializer.decode(data)
+        decode_seconds = time.perf_counter() - start
+        results.append({'format': name, 'encode': count / encode_seconds, 'decode': count / decode_seconds,
+                        'bytes': sum(len(x) for x in encoded) / count})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the serialization formats')
+    parser.add_argument('--count', type=int, default=100000, help='Number of records to encode')
+    args = parser.parse_args()
+    print(f"{'format':>16} {'encode/s':>12} {'decode/s':>12} {'bytes/record':>13}")
+    for result in benchmark_serializers(args.count):
+        decode = f"{result['decode']:12,.0f}" if result['decode'] is not None else f"{'-':>12}"
+        print(f"{result['format']:>16} {result['encode']:12,.0f} {decode} {result['bytes']:13.1f}")
+
+
+if __name__ == '__main__':
+    main()
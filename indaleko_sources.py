@@ -0,0 +1,144 @@
+import logging
+import threading
+import uuid
+
+from indaleko import IndalekoSource
+
+'''
+Process wide registry of the metadata sources (IndalekoSource.)  Every record
+names its source by UUID; without a registry each lookup of a source (or of
+its database key) would be a query against the Sources collection.
+
+The registry loads the Sources collection once, on first use, and interns one
+IndalekoSource per identifier, so every caller resolving the same identifier
+gets the same object (with its database key already set.)  Identifiers that
+are not in the collection are looked up individually once and remembered, as
+are misses, so hot ingest and query loops never query for sources.  Sources
+registered through the registry are written to the collection and interned
+immediately.
+
+Sources added to the collection by another process are not seen until
+reload() is called.
+'''
+
+class IndalekoSourceRegistry:
+    '''Interned IndalekoSource objects, by identifier.'''
+
+    def __init__(self, collection: 'IndalekoCollection' = None) -> None:
+        '''Parameters:
+            collection: the Sources IndalekoCollection; without one the
+                        registry only holds the sources registered with it
+        '''
+        self.collection = collection
+        self.lock = threading.Lock()
+        self.sources = {}
+        self.missing = set()
+        self.loaded = False
+        self.lookups = 0
+
+    @staticmethod
+    def get_identifier(identifier) -> uuid.UUID:
+        if isinstance(identifier, uuid.UUID):
+            return identifier
+        return uuid.UUID(str(identifier))
+
+    def __intern__(self, source: IndalekoSource) -> IndalekoSource:
+        return self.sources.setdefault(source.get_source_identifier(), source)
+
+    def load(self) -> 'IndalekoSourceRegistry':
+        '''Read the whole Sources collection (once; see reload.)'''
+        with self.lock:
+            if self.loaded:
+                return self
+            if self.collection is not None:
+                self.lookups += 1
+                for document in self.collection.query(f'FOR source IN {self.collection.name} RETURN source',
+                                                      collections=(self.collection.name,)):
+                    try:
+                        self.__intern__(IndalekoSource.from_dict(document))
+                    except (TypeError, ValueError, AttributeError):
+                        logging.warning(f"Ignoring malformed source document {document.get('_key')}")
+                logging.debug(f'Loaded {len(self.sources)} sources')
+            self.loaded = True
+        return self
+
+    def reload(self) -> 'IndalekoSourceRegistry':
+        '''Forget what was loaded and read the collection again.  Sources
+        already handed out stay valid; they are interned again.'''
+        with self.lock:
+            self.loaded = False
+            self.missing.clear()
+        return self.load()
+
+    def get(self, identifier) -> IndalekoSource:
+        '''The interned source for an identifier (UUID or string), or None if
+        there is no such source.'''
+        identifier = self.get_identifier(identifier)
+        source = self.sources.get(identifier)
+        if source is not None:
+            return source
+        if not self.loaded:
+            self.load()
+            source = self.sources.get(identifier)
+            if source is not None:
+                return source
+        with self.lock:
+            if identifier in self.sources:
+                return self.sources[identifier]
+            if identifier in self.missing or self.collection is None:
+                return None
+            self.lookups += 1
+            documents = self.collection.find_entries(identifier=str(identifier))
+            if len(documents) == 0:
+                self.missing.add(identifier)
+                return None
+            return self.__intern__(IndalekoSource.from_dict(documents[0]))
+
+    def get_db_key(self, identifier) -> str:
+        '''The Sources document key for an identifier (None if unknown.)'''
+        source = self.get(identifier)
+        return source.get_db_key() if source is not None else None
+
+    def register(self, source: IndalekoSource) -> IndalekoSource:
+        '''Intern a source, storing it in the collection if it is new.
+        Returns the interned source, which is not necessarily the one passed
+        in.'''
+        existing = self.get(source.get_source_identifier())
+        if existing is not None:
+            return existing
+        with self.lock:
+            identifier = source.get_source_identifier()
+            if identifier in self.sources:
+                return self.sources[identifier]
+            if self.collection is not None:
+                result = self.collection.insert(source.to_document())
+                source.set_db_key(result['_key'])
+            self.missing.discard(identifier)
+            return self.__intern__(source)
+
+    def __contains__(self, identifier) -> bool:
+        return self.get(identifier) is not None
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def get_stats(self) -> dict:
+        return {'sources': len(self.sources), 'missing': len(self.missing), 'lookups': self.lookups}
+
+
+DefaultRegistry = None
+DefaultRegistryLock = threading.Lock()
+
+
+def get_source_registry(collection: 'IndalekoCollection' = None) -> IndalekoSourceRegistry:
+    '''The process wide registry.  The first call that passes a collection
+    binds the registry to it; later calls can omit it.'''
+    global DefaultRegistry
+    with DefaultRegistryLock:
+        if DefaultRegistry is None:
+            DefaultRegistry = IndalekoSourceRegistry(collection)
+        elif collection is not None and DefaultRegistry.collection is None:
+            DefaultRegistry.collection = collection
+            DefaultRegistry.loaded = False
+            DefaultRegistry.missing.clear()
+        return DefaultRegistry
@@ -0,0 +1,504 @@
+import argparse
+import datetime
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: a file another process has open cannot be renamed, which is
+    # what keeps recovery away from live segments there
+    fcntl = None
+
+from indaleko_serialize import IndalekoSerializer, get_serializer
+
+'''
+The spool decouples metadata collection from the database.  Ingesters append
+batches of documents to local segment files (at disk speed) and a background
+drainer uploads them to ArangoDB at whatever rate the database will accept.
+Segments survive restarts: a new process picks up where the previous one
+stopped, and a segment is only deleted once every batch in it has been
+committed.
+
+Each segment is a file of JSON lines (written by a text indaleko_serialize
+serializer), one batch per line:
+
+    {"collection": "Objects", "documents": [...]}
+
+A segment being written has the suffix '.open'; once it is sealed it is
+renamed to '.ready' and becomes eligible for draining.  The drainer records
+its progress through a segment (a byte offset) in a matching '.offset' file.
+The writer holds an exclusive lock (flock) on its open segment, so a process
+starting up only recovers (seals) the open segments whose writer has exited;
+segments of live writers are left alone.  A drainer likewise locks the ready
+segment it is draining, so two drainers (say the indaleko spool command and
+one running inside an ingester) never upload the same segment.
+
+Batches the database rejects for good (a unique index violation, a schema
+error, a malformed document) are moved to the dead letter file
+(dead-letter.jsonl, one batch per line with the error) instead of blocking
+the batches behind them.  When only some documents of a batch are rejected
+(the upload function raises IndalekoRejectedDocuments), only those are
+dead lettered.
+
+Delivery is at-least-once: a batch that was uploaded right before a crash
+will be uploaded again, so the upload function should be idempotent (e.g.,
+IndalekoCollection.upsert_batch.)
+'''
+
+class IndalekoSpool:
+    '''A directory of append-only segment files holding pending DB writes.'''
+
+    DefaultSpoolDir = './data/spool'
+    DefaultSegmentSize = 64 * 1024 * 1024
+    DeadLetterFile = 'dead-letter.jsonl'
+    # an unlocked, empty open segment younger than this may belong to a writer
+    # that has created it but not locked it yet
+    StaleSegmentAge = 60
+
+    def __init__(self, spool_dir: str = DefaultSpoolDir, segment_size: int = DefaultSegmentSize, sync: bool = False,
+                 serializer: IndalekoSerializer = None, recover: bool = True) -> None:
+        '''Parameters:
+            spool_dir: directory where the segments are kept
+
+            segment_size: once a segment reaches this many bytes it is sealed
+                          and a new one is started
+
+            sync: if True, fsync after every append (slower, but a batch is
+                  durable once append returns)
+
+            serializer: encodes the batches (json or orjson; the drainer
+                        relies on one batch per line)
+
+            recover: if True, seal the segments left open by writers that
+                     have exited (False leaves the spool untouched, e.g. to
+                     report its status)
+        '''
+        self.serializer = serializer if serializer is not None else get_serializer()
+        assert not self.serializer.binary, 'Spool segments must be written with a text serializer'
+        self.spool_dir = spool_dir
+        self.segment_size = segment_size
+        self.sync = sync
+        self.lock = threading.Lock()
+        self.current = None
+        self.current_name = None
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.next_sequence = self.__recover__(recover)
+
+    def __segment_name__(self, sequence: int, suffix: str) -> str:
+        return os.path.join(self.spool_dir, f'segment-{sequence:012d}{suffix}')
+
+    @staticmethod
+    def get_sequence(file_name: str) -> int:
+        return int(os.path.basename(file_name).split('.')[0].split('-')[1])
+
+    def __recover__(self, recover: bool) -> int:
+        '''Seal any segments left open by processes that have exited and
+        return the next free sequence number.'''
+        sequence = 0
+        for name in os.listdir(self.spool_dir):
+            if not name.startswith('segment-'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            sequence = max(sequence, self.get_sequence(path) + 1)
+            if recover and name.endswith('.open'):
+                self.__recover_segment__(path)
+        return sequence
+
+    def __recover_segment__(self, path: str) -> bool:
+        '''Seal an open segment unless its writer is still alive.'''
+        ready = path[:-len('.open')] + '.ready'
+        try:
+            fd = open(path, 'rb')
+        except FileNotFoundError:
+            return False
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logging.debug(f'Spool segment {path} is still being written')
+                    return False
+                status = os.fstat(fd.fileno())
+                if status.st_size == 0 and time.time() - status.st_mtime < self.StaleSegmentAge:
+                    return False
+            else:
+                fd.close()
+            logging.info(f'Recovering spool segment {path}')
+            os.replace(path, ready)
+            return True
+        except (FileNotFoundError, PermissionError):
+            # sealed by its writer meanwhile, or (Windows) still open
+            return False
+        finally:
+            fd.close()
+
+    def __open_segment__(self) -> None:
+        while True:
+            name = self.__segment_name__(self.next_sequence, '.open')
+            self.next_sequence += 1
+            if os.path.exists(name[:-len('.open')] + '.ready'):
+                continue
+            try:
+                # another writer may have taken this sequence number
+                descriptor = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0))
+            except FileExistsError:
+                continue
+            break
+        self.current = os.fdopen(descriptor, 'ab')
+        if fcntl is not None:
+            fcntl.flock(self.current.fileno(), fcntl.LOCK_EX)
+        self.current_name = name
+
+    def __seal__(self) -> None:
+        if self.current is None:
+            return
+        self.current.flush()
+        os.fsync(self.current.fileno())
+        self.current.close()
+        try:
+            os.replace(self.current_name, self.current_name[:-len('.open')] + '.ready')
+        except FileNotFoundError:
+            # recovered by another process after the lock was released; the
+            # data is complete, so it was sealed just the same
+            pass
+        logging.debug(f'Sealed spool segment {self.current_name}')
+        self.current = None
+        self.current_name = None
+
+    def append(self, collection: str, documents: list) -> 'IndalekoSpool':
+        '''Add a batch of documents destined for the given collection.'''
+        if len(documents) == 0:
+            return self
+        line = self.serializer.encode({'collection': collection, 'documents': documents})
+        with self.lock:
+            if self.current is None:
+                self.__open_segment__()
+            self.current.write(line)
+            if self.sync:
+                self.current.flush()
+                os.fsync(self.current.fileno())
+            if self.current.tell() >= self.segment_size:
+                self.__seal__()
+        return self
+
+    def seal(self) -> 'IndalekoSpool':
+        '''Seal the segment currently being written (if any) so that it can be
+        drained.'''
+        with self.lock:
+            if self.current is not None and self.current.tell() > 0:
+                self.__seal__()
+        return self
+
+    def close(self) -> None:
+        self.seal()
+
+    def has_pending_writes(self) -> bool:
+        with self.lock:
+            return self.current is not None and self.current.tell() > 0
+
+    def ready_segments(self) -> list:
+        '''Sealed segments, oldest first.'''
+        segments = [os.path.join(self.spool_dir, x) for x in os.listdir(self.spool_dir) if x.startswith('segment-') and x.endswith('.ready')]
+        return sorted(segments, key=self.get_sequence)
+
+    def is_empty(self) -> bool:
+        return len(self.ready_segments()) == 0 and not self.has_pending_writes()
+
+    @staticmethod
+    def get_offset(segment: str) -> int:
+        offset_file = segment + '.offset'
+        if not os.path.exists(offset_file):
+            return 0
+        with open(offset_file, 'rt') as fd:
+            return int(fd.read().strip() or 0)
+
+    @staticmethod
+    def set_offset(segment: str, offset: int) -> None:
+        offset_file = segment + '.offset'
+        with open(offset_file + '.tmp', 'wt') as fd:
+            fd.write(str(offset))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(offset_file + '.tmp', offset_file)
+
+    @staticmethod
+    def remove_segment(segment: str) -> None:
+        os.remove(segment)
+        if os.path.exists(segment + '.offset'):
+            os.remove(segment + '.offset')
+
+    def get_dead_letter_file(self) -> str:
+        return os.path.join(self.spool_dir, self.DeadLetterFile)
+
+    def dead_letter(self, collection: str, documents: list, error: Exception) -> None:
+        '''Set aside a batch the database will not accept.'''
+        line = self.serializer.encode({'collection': collection, 'documents': documents,
+                                       'error': f'{type(error).__name__}: {error}',
+                                       'time': datetime.datetime.now(datetime.timezone.utc).isoformat()})
+        with self.lock:
+            with open(self.get_dead_letter_file(), 'ab') as fd:
+                fd.write(line)
+                fd.flush()
+                os.fsync(fd.fileno())
+
+    def dead_letter_count(self) -> int:
+        '''Number of batches in the dead letter file.'''
+        if not os.path.exists(self.get_dead_letter_file()):
+            return 0
+        with open(self.get_dead_letter_file(), 'rb') as fd:
+            return sum(1 for line in fd if line.strip())
+
+
+class IndalekoRejectedDocuments(Exception):
+    '''Raised by an upload function when the database stored a batch except
+    for some of its documents.'''
+
+    def __init__(self, documents: list, message: str) -> None:
+        super().__init__(message)
+        self.documents = documents
+
+
+def is_unavailable(error: Exception) -> bool:
+    '''True if the database could not be reached at all (nothing can be
+    uploaded until it is back.)  requests exceptions derive from OSError.'''
+    return isinstance(error, (OSError, ConnectionError, TimeoutError)) or \
+        type(error).__name__ == 'ServerConnectionError'
+
+
+def is_transient(error: Exception) -> bool:
+    '''True for failures that may succeed on retry: the database was
+    unavailable or overloaded (5xx, 429) or the batch lost a write-write
+    conflict (ArangoDB error 1200.)  Anything else, such as a unique
+    constraint violation (1210) or a schema error, fails the same way every
+    time.'''
+    if is_unavailable(error):
+        return True
+    http_code = getattr(error, 'http_code', None)
+    if isinstance(http_code, int) and (http_code >= 500 or http_code == 429):
+        return True
+    return getattr(error, 'error_code', None) == 1200
+
+
+class IndalekoSpoolDrainer(threading.Thread):
+    '''Background thread that uploads spooled batches to the database.'''
+
+    DefaultStopTimeout = 60.0
+
+    def __init__(self, spool: IndalekoSpool, upload, poll_interval: float = 1.0, max_backoff: float = 60.0,
+                 max_attempts: int = 8) -> None:
+        '''Parameters:
+            spool: the spool to drain
+
+            upload: callable(collection_name, documents) that commits a batch
+                    and raises an exception if it could not
+                    (IndalekoRejectedDocuments if only some documents were
+                    refused)
+
+            poll_interval: how long to wait when there is nothing to do
+
+            max_backoff: upper bound (seconds) of the retry delay when the
+                         database is unavailable
+
+            max_attempts: attempts at a batch that keeps failing with a
+                          transient error before it is dead lettered (while
+                          the database cannot be reached at all, retries go
+                          on until the drainer is stopped)
+        '''
+        super().__init__(name='IndalekoSpoolDrainer', daemon=True)
+        self.spool = spool
+        self.upload = upload
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.stop_event = threading.Event()
+        self.drain_on_stop = True
+        self.abandon_event = threading.Event()
+        self.batches = 0
+        self.documents = 0
+        self.failures = 0
+        self.dead_lettered = 0
+
+    def __interrupted__(self) -> bool:
+        return self.stop_event.is_set() and not self.drain_on_stop
+
+    def __upload_with_retry__(self, collection: str, documents: list) -> bool:
+        '''Upload a batch, retrying transient failures.  Returns False if
+        draining was interrupted; a batch that cannot be uploaded is dead
+        lettered (and True returned, so draining moves past it.)'''
+        delay = self.poll_interval
+        attempts = 0
+        while True:
+            try:
+                self.upload(collection, documents)
+                return True
+            except IndalekoRejectedDocuments as e:
+                self.failures += 1
+                logging.error(f'{len(e.documents)} of {len(documents)} documents were not stored in {collection} ({e}), '
+                              f'moving them to {self.spool.get_dead_letter_file()}')
+                self.spool.dead_letter(collection, e.documents, e)
+                self.dead_lettered += 1
+                return True
+            except Exception as e:
+                self.failures += 1
+                if not is_unavailable(e):
+                    attempts += 1
+                if not is_transient(e) or attempts >= self.max_attempts:
+                    logging.error(f'Upload of {len(documents)} documents to {collection} failed ({type(e).__name__}: {e}), '
+                                  f'moving the batch to {self.spool.get_dead_letter_file()}')
+                    self.spool.dead_letter(collection, documents, e)
+                    self.dead_lettered += 1
+                    return True
+                logging.warning(f'Upload of {len(documents)} documents to {collection} failed ({type(e).__name__}: {e}), retrying in {delay} seconds')
+            if self.__interrupted__() or self.abandon_event.wait(delay):
+                return False
+            delay = min(delay * 2, self.max_backoff)
+
+    def drain_segment(self, segment: str) -> bool:
+        '''Upload the remaining batches of a segment and delete it.  A segment
+        another drainer is working on is skipped.  Returns False if draining
+        was interrupted.'''
+        try:
+            fd = open(segment, 'rb')
+        except FileNotFoundError:
+            # drained by another drainer meanwhile
+            return True
+        with fd:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(fd.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    logging.debug(f'Spool segment {segment} is being drained by another drainer')
+                    return True
+                if not os.path.exists(segment):
+                    # the other drainer finished it before we got the lock
+                    return True
+            offset = IndalekoSpool.get_offset(segment)
+            fd.seek(offset)
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    # torn write from a crash: the batch was never acknowledged
+                    logging.warning(f'Discarding incomplete batch at end of {segment}')
+                    break
+                batch = self.spool.serializer.decode(line)
+                dead_lettered = self.dead_lettered
+                if not self.__upload_with_retry__(batch['collection'], batch['documents']):
+                    return False
+                offset += len(line)
+                IndalekoSpool.set_offset(segment, offset)
+                if self.dead_lettered == dead_lettered:
+                    self.batches += 1
+                    self.documents += len(batch['documents'])
+                if self.__interrupted__():
+                    return False
+            # removed while still locked, so no other drainer can start on it
+            IndalekoSpool.remove_segment(segment)
+        logging.debug(f'Drained spool segment {segment}')
+        return True
+
+    def drain(self) -> bool:
+        '''Drain everything that is currently spooled.'''
+        self.spool.seal()
+        for segment in self.spool.ready_segments():
+            if not self.drain_segment(segment):
+                return False
+        return True
+
+    def run(self) -> None:
+        while True:
+            segments = self.spool.ready_segments()
+            if len(segments) == 0:
+                if self.spool.has_pending_writes():
+                    # nothing sealed yet, don't let data sit in the open segment
+                    self.spool.seal()
+                    continue
+                if self.stop_event.is_set():
+                    break
+                self.stop_event.wait(self.poll_interval)
+                continue
+            for segment in segments:
+                if not self.drain_segment(segment):
+                    return
+            if self.__interrupted__():
+                break
+            if self.spool.ready_segments() == segments:
+                # every segment is locked by another drainer
+                if self.abandon_event.wait(self.poll_interval):
+                    break
+
+    def stop(self, drain: bool = True, timeout: float = DefaultStopTimeout) -> None:
+        '''Stop the drainer.  If drain is True, first upload everything that
+        is already spooled, waiting at most timeout seconds (None waits for
+        as long as it takes, e.g. while the database is down.)  Whatever is
+        not uploaded by then stays in the spool for the next drainer.'''
+        self.drain_on_stop = drain
+        if not drain:
+            self.abandon_event.set()
+        self.stop_event.set()
+        self.join(timeout)
+        if self.is_alive() and drain:
+            logging.warning(f'Spool drainer did not finish within {timeout} seconds, leaving the rest spooled')
+            self.drain_on_stop = False
+            self.abandon_event.set()
+            # an upload in flight is allowed to complete
+            self.join(timeout)
+
+
+def collection_uploader(db, match_field: str = 'URI', match_fields: dict = None):
+    '''Returns an upload function for IndalekoSpoolDrainer that upserts
+    batches into the named collections of the given database.  match_fields
+    overrides match_field per collection; relationships (which have no URI)
+    are matched on their key by default.'''
+    from indalekocolletions import IndalekoCollection, Indaleko_Collections
+    collections = {}
+    if match_fields is None:
+        match_fields = {'Relationships': '_key'}
+
+    def upload(collection: str, documents: list) -> None:
+        if collection not in collections:
+            edge = Indaleko_Collections.get(collection, {}).get('edge', False)
+            collections[collection] = IndalekoCollection(db, collection, edge=edge)
+        failed = []
+        collections[collection].upsert_batch(documents, match_field=match_fields.get(collection, match_field), failed=failed)
+        if len(failed) > 0:
+            # most likely a unique index other than the one matched on
+            raise IndalekoRejectedDocuments(failed, f'{len(failed)} documents could not be upserted')
+    return upload
+
+
+def main():
+    starttime = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    logfile = f'indalekospool-{starttime}.log'
+    parser = argparse.ArgumentParser(description='Drain spooled Indaleko writes into the database')
+    parser.add_argument('--config', '-c', help='Path to the config file', default='./config/indaleko-db-config.ini')
+    parser.add_argument('--spool', help='Spool directory', default=IndalekoSpool.DefaultSpoolDir)
+    parser.add_argument('--status', action='store_true', default=False, help='Report what is spooled and exit')
+    parser.add_argument('--log', '-l', help='Log file to use', default=logfile)
+    parser.add_argument('--logdir', help='Log directory to use', default='./logs')
+    args = parser.parse_args()
+    os.makedirs(args.logdir, exist_ok=True)
+    logging.basicConfig(filename=os.path.join(args.logdir, args.log), level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.status and not os.path.isdir(args.spool):
+        print(f'No spool in {args.spool}')
+        return
+    # reporting the status must not seal other processes' segments
+    spool = IndalekoSpool(args.spool, recover=not args.status)
+    segments = spool.ready_segments()
+    pending = sum(os.path.getsize(x) - IndalekoSpool.get_offset(x) for x in segments)
+    print(f'{len(segments)} spooled segment(s), {pending} bytes pending, {spool.dead_letter_count()} dead lettered batch(es)')
+    if args.status or len(segments) == 0:
+        return
+    from dbsetup import IndalekoDBConfig
+    config = IndalekoDBConfig(args.config)
+    config.start()
+    drainer = IndalekoSpoolDrainer(spool, collection_uploader(config.db))
+    start = datetime.datetime.now()
+    drainer.drain()
+    print(f'Uploaded {drainer.documents} documents in {drainer.batches} batches in {datetime.datetime.now() - start}'
+          f' ({drainer.dead_lettered} batch(es) dead lettered)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from indaleko import Commands
+
+'''
+Start up time benchmark for the indaleko command line.  Each command is run
+with --help in a fresh interpreter (a cold start: nothing is imported yet, as
+for any short invocation) several times, and the median wall time is compared
+with a target.  The exit status is 1 if any command misses the target, so this
+can guard against a heavy import creeping back into a module's top level.
+
+--help exercises the path every invocation takes: the dispatcher, the
+command's module imports and its argument parser; it stops before any
+credentials, network or database access.
+'''
+
+DefaultTarget = 0.5
+DefaultRuns = 5
+
+
+def time_command(command: str, runs: int = DefaultRuns) -> dict:
+    '''Median and minimum seconds for "indaleko COMMAND --help".'''
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indaleko.py')
+    times = []
+    error = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, script, command, '--help'], capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            error = (result.stderr.strip().splitlines() or ['failed'])[-1]
+            break
+    return {'command': command, 'median': statistics.median(times), 'min': min(times), 'error': error}
+
+
+def time_interpreter(runs: int = DefaultRuns) -> float:
+    '''Median seconds for an interpreter that does nothing (the floor.)'''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], capture_output=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the start up time of the indaleko commands')
+    parser.add_argument('commands', nargs='*', default=None, help='Commands to time (default: all of them)')
+    parser.add_argument('--runs', type=int, default=DefaultRuns, help='Runs per command')
+    parser.add_argument('--target', type=float, default=DefaultTarget,
+                        help=f'Maximum median start up time in seconds (default: {DefaultTarget})')
+    args = parser.parse_args()
+    commands = args.commands if args.commands else [command for command in Commands if command != 'startup-benchmark']
+    for command in commands:
+        assert command in Commands, f'Unknown command {command}'
+    print(f'interpreter alone: {time_interpreter(args.runs) * 1000:.0f} ms')
+    failures = 0
+    for command in commands:
+        result = time_command(command, args.runs)
+        if result['error'] is not None:
+            status = f"FAILED ({result['error']})"
+            failures += 1
+        elif result['median'] > args.target:
+            status = f'SLOW (target {args.target * 1000:.0f} ms)'
+            failures += 1
+        else:
+            status = 'ok'
+        print(f"{command:>20}: {result['median'] * 1000:6.0f} ms median, {result['min'] * 1000:6.0f} ms min  {status}")
+    if failures > 0:
+        print(f'{failures} of {len(commands)} commands failed or missed the target')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,5 @@
 import argparse
-from arango import ArangoClient
 from indaleko import IndalekoObject, IndalekoRelationship, IndalekoSource
-from dbsetup import IndalekoDBConfig
 import logging
 import datetime
 import os
@@ -33,18 +31,24 @@ class IndalekoIndex:
 
 class IndalekoCollection:
 
-    def __init__(self, db, name: str, edge: bool = False, reset: bool = False) -> None:
+    def __init__(self, db, name: str, edge: bool = False, reset: bool = False, query_cache: 'IndalekoQueryCache' = None) -> None:
         '''Parameters:
             db: ArangoDB database object (with appropriate credentials)
             name: name of the collection
             edge: if True, the collection is an edge collection
             reset: if True, the collection is deleted and recreated
+            query_cache: optional IndalekoQueryCache; reads go through it
+                         and writes invalidate it
         '''
         self.db = db
         self.name = name
         self.edge = edge
+        self.query_cache = query_cache
+        if self.query_cache is not None:
+            self.query_cache.register_collection(name)
         if reset and db.has_collection(name):
             db.delete_collection(name)
+            self.__note_write__()
         if not db.has_collection(name):
             db.create_collection(name, edge=edge)
         self.collection = db.collection(self.name)
@@ -55,10 +59,129 @@ class IndalekoCollection:
         return self
 
     def find_entries(self, **kwargs):
+        if self.query_cache is not None:
+            return self.query_cache.lookup(f'find {self.name}', kwargs,
+                                           lambda: self.collection.find(kwargs),
+                                           (self.name,))
         return [document for document in self.collection.find(kwargs)]
 
+    def query(self, query: str, bind_vars: dict = None, collections: tuple = None) -> list:
+        '''Run an AQL query, through the query cache if there is one.
+        collections lists the collections the query reads; if omitted the
+        cache works it out from the query text.'''
+        if self.query_cache is not None:
+            return self.query_cache.execute(self.db, query, bind_vars, collections)
+        return [document for document in self.db.aql.execute(query, bind_vars=bind_vars)]
+
+    def __note_write__(self) -> None:
+        if self.query_cache is not None:
+            self.query_cache.bump_write_version(self.name)
+
     def insert(self, document: dict) -> 'IndalekoCollection':
-        return self.collection.insert(document)
+        # The version is bumped before the write (so cached results are
+        # dropped) and again after it: a query that runs while the write is
+        # in progress captures the first bump and may see the old data, and
+        # the second bump keeps its result from being served.
+        self.__note_write__()
+        try:
+            return self.collection.insert(document)
+        finally:
+            self.__note_write__()
+
+    def upsert_batch(self, documents: list, match_field: str = 'URI', preserve: tuple = ('ObjectIdentifier',),
+                     failed: list = None) -> dict:
+        '''Insert or update a batch of documents in a single round trip.
+
+            documents: list of documents to store
+
+            match_field: the (uniquely indexed) field used to decide if a
+                         document already exists, e.g. 'URI',
+                         'ObjectIdentifier' or 'LocalIdentifier'
+
+            preserve: fields that are never overwritten on an existing
+                      document (by default the ObjectIdentifier, so a
+                      re-index does not change the identity of an object)
+
+            failed: if given, the documents that could not be written are
+                    appended to this list
+
+        The deduplication happens on the server: one AQL UPSERT per batch,
+        which uses the unique index on match_field for the lookup.  A document
+        that is already stored as given is not written at all (it keeps its
+        _rev.)  Errors are handled per document: a document that cannot be
+        written (e.g., it violates another unique index) is skipped and the
+        rest of the batch is still written.  Returns a dict with the number of
+        documents inserted, updated, unchanged and failed.
+        '''
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        if len(documents) == 0:
+            return counts
+        # UPSERT requires a literal search document, so the field name is
+        # placed in the query text rather than passed as a bind variable.
+        assert match_field.isidentifier(), f'Invalid match field {match_field}'
+        preserve = [field for field in preserve if field != match_field]
+        query = f'''
+            LET candidates = (
+                FOR index IN 0..LENGTH(@documents) - 1
+                    LET doc = @documents[index]
+                    LET changes = UNSET(doc, @preserve)
+                    LET old = FIRST(FOR existing IN @@collection FILTER existing.{match_field} == doc.{match_field} LIMIT 1 RETURN existing)
+                    RETURN {{ index, doc, changes, unchanged : old != null AND MATCHES(old, changes) }}
+            )
+            LET written = (
+                FOR candidate IN candidates
+                    FILTER NOT candidate.unchanged
+                    UPSERT {{ {match_field} : candidate.doc.{match_field} }}
+                    INSERT candidate.doc
+                    UPDATE candidate.changes
+                    IN @@collection
+                    OPTIONS {{ ignoreErrors : true }}
+                    RETURN {{ index : candidate.index, status : OLD == null ? 'inserted' : 'updated' }}
+            )
+            RETURN {{ unchanged : candidates[* FILTER CURRENT.unchanged RETURN CURRENT.index], written }}
+        '''
+        bind_vars = {
+            'documents' : documents,
+            'preserve' : preserve,
+            '@collection' : self.name,
+        }
+        self.__note_write__()
+        try:
+            result = next(iter(self.db.aql.execute(query, bind_vars=bind_vars)))
+        finally:
+            # see insert()
+            self.__note_write__()
+        done = set(result['unchanged'])
+        counts['unchanged'] = len(done)
+        for entry in result['written']:
+            counts[entry['status']] += 1
+            done.add(entry['index'])
+        # with ignoreErrors a document that could not be written returns nothing
+        rejected = [document for index, document in enumerate(documents) if index not in done]
+        counts['failed'] = len(rejected)
+        if len(rejected) > 0:
+            logging.warning(f'upsert_batch into {self.name}: {len(rejected)} of {len(documents)} documents could not be written')
+            if failed is not None:
+                failed.extend(rejected)
+        logging.debug(f'upsert_batch into {self.name} on {match_field}: {counts}')
+        return counts
+
+    def upsert_many(self, documents, batch_size: int = 1000, match_field: str = 'URI', preserve: tuple = ('ObjectIdentifier',),
+                    failed: list = None) -> dict:
+        '''Upsert an iterable of documents, batch_size documents per round
+        trip.  Returns the combined inserted/updated/unchanged/failed counts.'''
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                for key, value in self.upsert_batch(batch, match_field, preserve, failed).items():
+                    counts[key] += value
+                batch = []
+        if len(batch) > 0:
+            for key, value in self.upsert_batch(batch, match_field, preserve, failed).items():
+                counts[key] += value
+        return counts
 
 Indaleko_Collections = {
         'Objects': {
@@ -80,6 +203,16 @@ Indaleko_Collections = {
                     'unique' : True,
                     'type' : 'persistent'
                 },
+                'label' : {
+                    'fields' : ['Label'],
+                    'unique' : False,
+                    'type' : 'persistent'
+                },
+                'size' : {
+                    'fields' : ['Size'],
+                    'unique' : False,
+                    'type' : 'persistent'
+                },
             },
         },
         'Relationships' : {
@@ -135,6 +268,7 @@ def main():
     args = parser.parse_args()
     logging.basicConfig(filename=os.path.join(args.logdir, args.log), level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
     logging.info(f'Begin Indaleko Collections test at {starttime}')
+    from dbsetup import IndalekoDBConfig
     config = IndalekoDBConfig()
     config.start()
     collections = config.db.collections()
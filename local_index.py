@@ -6,6 +6,12 @@ import uuid
 import datetime
 import datetime
 import platform
+import re
+
+import functools
+
+from indaleko_serialize import add_serializer_argument, read_document
+
 
 
 class ContainerRelationship:
@@ -51,6 +57,125 @@ class FileSystemObject:
         FileSystemObject += 1
 
 
+class IndalekoPathDictionary:
+    '''
+    Dictionary encoding of the directories of a snapshot.  Each directory is
+    given a small integer ID and stored once, as (parent ID, name); the
+    directory the walk started at is stored with no parent and its full path
+    as the name.  Records then carry the ID of their directory instead of the
+    full path, and full paths are rebuilt on demand (resolve), with the most
+    recently used ones cached.
+    '''
+
+    DefaultCacheSize = 4096
+
+    def __init__(self, directories: list = None, cache_size: int = DefaultCacheSize) -> None:
+        self.directories = directories if directories is not None else []
+        self.pending = {} # path -> ID, for directories not yet walked
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self.__resolve__)
+
+    def add_directory(self, parent_id: int, name: str, path: str = None) -> int:
+        '''Add a directory (parent_id None for the root of the walk); path
+        is its full path, if it will be looked up with take_id().'''
+        directory_id = len(self.directories)
+        self.directories.append((parent_id, name))
+        if path is not None:
+            self.pending[path] = directory_id
+        return directory_id
+
+    def take_id(self, path: str) -> int:
+        '''The ID of a directory added with its path; the path is forgotten
+        (os.walk visits each directory once.)'''
+        return self.pending.pop(path)
+
+    def __resolve__(self, directory_id: int) -> str:
+        parent_id, name = self.directories[directory_id]
+        if parent_id is None:
+            return name
+        return os.path.join(self.resolve(parent_id), name)
+
+    def get_path(self, directory_id: int, name: str) -> str:
+        return os.path.join(self.resolve(directory_id), name)
+
+    def to_list(self) -> list:
+        return [list(entry) for entry in self.directories]
+
+    @staticmethod
+    def from_list(directories: list, cache_size: int = DefaultCacheSize) -> 'IndalekoPathDictionary':
+        return IndalekoPathDictionary([tuple(entry) for entry in directories], cache_size)
+
+
+PathEncodings = ('full', 'dictionary')
+
+
+def get_stat_dict(file_path: str) -> dict:
+    '''The st_ fields of a file, or None if it cannot be stat'ed.'''
+    try:
+        stat_data = os.stat(file_path)
+    except:
+        # at least for now, we just skip errors
+        logging.warning(f'Unable to stat {file_path}')
+        return None
+    return {key : getattr(stat_data, key) for key in dir(stat_data) if key.startswith('st_')}
+
+
+def walk_dictionary_encoded(path: str, uri_prefix: str = None) -> dict:
+    '''The dictionary encoded version of a platform's
+    walk_files_and_directories: the records name their directory by ID
+    ('parent') rather than by path, and carry no URI.  The snapshot holds the
+    directory table and how to rebuild the URIs: uri_prefix joined with the
+    name (as on Windows), or, if it is None, the full path joined with the
+    name (as on Linux.)'''
+    dictionary = IndalekoPathDictionary()
+    dictionary.add_directory(None, path, path)
+    records = []
+    for root, dirs, files in os.walk(path):
+        parent_id = dictionary.take_id(root)
+        for name in dirs:
+            dictionary.add_directory(parent_id, name, os.path.join(root, name))
+        for name in files + dirs:
+            stat_dict = get_stat_dict(os.path.join(root, name))
+            if stat_dict is not None:
+                stat_dict['file'] = name
+                stat_dict['parent'] = parent_id
+                records.append(stat_dict)
+    return {
+        'Encoding': 'dictionary',
+        'URIPrefix': uri_prefix,
+        'Directories': dictionary.to_list(),
+        'Records': records,
+    }
+
+
+def decode_snapshot(snapshot):
+    '''The records of a snapshot (either encoding) with their path and URI.'''
+    if isinstance(snapshot, list):
+        yield from snapshot
+        return
+    assert snapshot.get('Encoding') == 'dictionary', 'Unknown snapshot encoding'
+    dictionary = IndalekoPathDictionary.from_list(snapshot['Directories'])
+    uri_prefix = snapshot.get('URIPrefix')
+    for record in snapshot['Records']:
+        record = dict(record)
+        root = dictionary.resolve(record.pop('parent'))
+        record['path'] = root
+        name = record['file']
+        record['URI'] = os.path.join(uri_prefix if uri_prefix is not None else os.path.join(root, name), name)
+        yield record
+
+
+def read_snapshot(file_name: str, serializer: 'IndalekoSerializer' = None):
+    '''The records of a local file system snapshot, in either encoding
+    (written with serializer, default JSON.)'''
+    yield from decode_snapshot(read_document(file_name, serializer))
+
+
+def get_snapshot_machine(file_name: str) -> str:
+    '''The machine UUID in a snapshot's file name (machine=<uuid>), or None.'''
+    match = re.search(r'machine=([0-9a-fA-F-]{36})', os.path.basename(file_name))
+    return match.group(1) if match is not None else None
+
+
 class LocalFileSystemMetadata:
 
     def __init__(self):
@@ -104,6 +229,9 @@ class LocalIngest:
         self.parser.add_argument('--output', type=str, default=self.DefaultOutputFile,
                             help='Name and location of where to save the fetched metadata')
         self.parser.add_argument('--confdir', type=str, default=self.DefaultConfigDir, help='Directory to use for config file')
+        add_serializer_argument(self.parser)
+        self.parser.add_argument('--path-encoding', choices=PathEncodings, default='full',
+                            help='full: every record has its path and URI; dictionary: records name their directory by ID in a directory table (smaller snapshots)')
         self.parser.add_argument('--config', type=str, default=self.DefaultConfigFile,
                             help='Name and location from whence to retrieve the Microsoft Graph Config info')
 
@@ -0,0 +1,157 @@
+import argparse
+import concurrent.futures
+import datetime
+import json
+import logging
+import time
+
+from indaleko_http import IndalekoHttpClient
+from indaleko_projections import DefaultProfile, add_profile_argument
+from IndalekoIngest import IndalekoCrawlStream
+
+'''
+Multi-account cloud ingestion.  Each of the single account ingesters handles
+one (interactively chosen) account per run; this crawls every account listed
+in an accounts file concurrently in one process, so the total wall time is
+close to that of the slowest account rather than the sum of all of them.
+
+All accounts share one HTTP connection pool, but each has its own client with
+its own rate limit (the service quotas are per account), and each writes its
+own output stream (the same resumable JSON lines output the ingesters write.)
+
+The accounts file is a JSON list; each entry names the provider and the
+account, plus the provider specific credentials:
+
+    [
+        {"provider": "onedrive", "account": "someone@outlook.com",
+         "cache_file": "data/msgraph-cache.bin", "config": "data/msgraph-parameters.json",
+         "rate": 10},
+        {"provider": "dropbox", "account": "someone@example.com",
+         "token_file": "data/dropbox-token-someone.json", "rate": 5}
+    ]
+
+OneDrive accounts must already have a token in the cache file (sign in once
+with onedrive_index.py); several accounts can share one cache file (they share
+one in-memory token cache, which is saved whenever a token is refreshed.)
+'''
+
+Providers = ('onedrive', 'dropbox')
+
+
+def ingest_onedrive(entry: dict, session, profile: str, workers: int) -> dict:
+    from onedrive_index import MicrosoftGraphCredentials, OneDriveCrawler
+    cred = MicrosoftGraphCredentials(config=entry.get('config', 'data/msgraph-parameters.json'),
+                                     cache_file=entry.get('cache_file', 'data/msgraph-cache.bin'),
+                                     username=entry['account'])
+    client = IndalekoHttpClient(token_provider=cred, rate=entry.get('rate'), session=session)
+    crawler = OneDriveCrawler(cred, max_workers=workers, client=client, profile=profile)
+    stream = IndalekoCrawlStream(entry.get('output', cred.get_output_file_name()))
+    try:
+        crawler.crawl(on_page=stream.record_page)
+    except BaseException:
+        stream.close()
+        raise
+    stream.finish()
+    client.log_metrics()
+    return {'output': stream.output_file, 'records': stream.get_count()}
+
+
+def ingest_dropbox(entry: dict, session, profile: str, workers: int) -> dict:
+    from dropbox_index import DropboxCredentials, DropboxIngest
+    ingest = DropboxIngest()
+    ingest.args = argparse.Namespace(token=entry['token_file'], rate=entry.get('rate'), profile=profile,
+                                     incremental=entry.get('incremental', False), watch=False,
+                                     output=entry.get('output'), resume=None)
+    ingest.client = IndalekoHttpClient(token_provider=DropboxCredentials(entry['token_file']),
+                                       rate=entry.get('rate'), session=session)
+    ingest.account = entry.get('account')
+    ingest.start = datetime.datetime.utcnow()
+    ingest.stream_to_output()
+    return {'output': ingest.output_file, 'records': ingest.stream.get_count()}
+
+
+Ingesters = {
+    'onedrive' : ingest_onedrive,
+    'dropbox' : ingest_dropbox,
+}
+
+
+class IndalekoMultiAccountIngest:
+    '''Crawls a list of accounts concurrently.'''
+
+    def __init__(self, accounts: list, max_accounts: int = None, pool_size: int = 64,
+                 workers: int = 4, profile: str = DefaultProfile) -> None:
+        '''Parameters:
+            accounts: account entries (see the module description)
+
+            max_accounts: accounts crawled at the same time (default: all)
+
+            pool_size: size of the shared connection pool
+
+            workers: requests in flight per account (where the provider's
+                     crawler is concurrent)
+
+            profile: projection profile (see indaleko_projections)
+        '''
+        for entry in accounts:
+            assert entry.get('provider') in Providers, f'Unknown provider in account entry {entry}'
+            assert 'account' in entry, f'Account entry {entry} has no account'
+        self.accounts = accounts
+        self.max_accounts = max_accounts if max_accounts is not None else max(1, len(accounts))
+        self.session = IndalekoHttpClient.create_session(pool_size)
+        self.workers = workers
+        self.profile = profile
+        self.results = []
+
+    @staticmethod
+    def load_accounts(accounts_file: str) -> list:
+        with open(accounts_file, 'rt') as fd:
+            return json.load(fd)
+
+    def __ingest__(self, entry: dict) -> dict:
+        result = {'provider': entry['provider'], 'account': entry['account'], 'output': None, 'records': 0, 'error': None}
+        start = time.monotonic()
+        try:
+            result.update(Ingesters[entry['provider']](entry, self.session, self.profile, self.workers))
+        except Exception as e:
+            # one failing account must not stop the others
+            logging.exception(f"Ingesting {entry['provider']} account {entry['account']} failed")
+            result['error'] = f'{type(e).__name__}: {e}'
+        result['seconds'] = round(time.monotonic() - start, 3)
+        return result
+
+    def run(self) -> list:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_accounts) as executor:
+            self.results = list(executor.map(self.__ingest__, self.accounts))
+        return self.results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Crawl several cloud storage accounts concurrently')
+    parser.add_argument('--accounts', type=str, default='data/cloud-accounts.json',
+                        help='JSON file listing the accounts to crawl')
+    parser.add_argument('--max-accounts', type=int, default=None,
+                        help='Accounts crawled at the same time (default: all of them)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Requests in flight per account')
+    parser.add_argument('--pool', type=int, default=64,
+                        help='Size of the shared HTTP connection pool')
+    add_profile_argument(parser)
+    parser.add_argument('--loglevel', type=int, default=logging.WARNING,
+                        help='Logging level to use (lower number = more logging)')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel)
+    ingest = IndalekoMultiAccountIngest(IndalekoMultiAccountIngest.load_accounts(args.accounts),
+                                        max_accounts=args.max_accounts, pool_size=args.pool,
+                                        workers=args.workers, profile=args.profile)
+    start = time.monotonic()
+    results = ingest.run()
+    elapsed = time.monotonic() - start
+    for result in results:
+        status = result['error'] if result['error'] is not None else f"{result['records']} records to {result['output']}"
+        print(f"{result['provider']:>8} {result['account']}: {status} ({result['seconds']} seconds)")
+    print(f"{len(results)} accounts in {elapsed:.1f} seconds (sum of account times {sum(r['seconds'] for r in results):.1f} seconds)")
+
+
+if __name__ == '__main__':
+    main()
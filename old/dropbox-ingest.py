@@ -1,6 +1,10 @@
 import os
 import json
 import argparse
+import sys
+# the shared modules live in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indaleko_serialize import get_serializer, add_serializer_argument, write_document
 import dropbox
 
 
@@ -68,10 +72,10 @@ def main():
                         help='Name of the database to use (overrides config file)')
     parser.add_argument('--reset', action='store_true',
                         default=False, help='Clean database before running')
+    add_serializer_argument(parser)
     args = parser.parse_args()
     dropbox_contents = get_dropbox_metadata()
-    with open(args.output, 'wt') as output_file:
-        json.dump(dropbox_contents, output_file, indent=4)
+    write_document(args.output, dropbox_contents, get_serializer(args.format))
 
 
 if __name__ == "__main__":
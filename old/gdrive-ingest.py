@@ -5,6 +5,10 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 import argparse
+import sys
+# the shared modules live in the directory above this one
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indaleko_serialize import get_serializer, add_serializer_argument, write_document
 
 SCOPES = ['https://www.googleapis.com/auth/drive.metadata.readonly']
 FILE_METADATA_FIELDS = [
@@ -155,10 +159,10 @@ def main():
                         help='Name of the database to use (overrides config file)')
     parser.add_argument('--reset', action='store_true',
                         default=False, help='Clean database before running')
+    add_serializer_argument(parser)
     args = parser.parse_args()
     gdrive_contents = get_drive_metadata()
-    with open(args.output, 'wt') as output_file:
-        json.dump(gdrive_contents, output_file, indent=4)
+    write_document(args.output, gdrive_contents, get_serializer(args.format))
 
 if __name__ == "__main__":
     main()
@@ -1,20 +1,58 @@
 import argparse
+import collections
+import concurrent.futures
+import heapq
 import json
 import os
-import msal
-import requests
 import logging
 import sys
 import datetime
+import threading
+import time
+from indaleko_http import IndalekoHttpClient, IndalekoHttpError
+from indaleko_projections import DefaultProfile, graph_select, add_profile_argument
+from IndalekoIngest import IndalekoCrawlStream
+from indaleko_normalize import OneDriveNormalizer, IndalekoNormalizingStream
+from indaleko_spool import IndalekoSpool
+from indaleko_blobstore import IndalekoBlobStore
+from indaleko_serialize import get_serializer, add_serializer_argument
+
+# One token cache per cache file, shared by every MicrosoftGraphCredentials in
+# the process: if each kept its own copy, each save would overwrite the file
+# with that copy and drop the tokens the other accounts had refreshed.
+TokenCaches = {}
+TokenCachesLock = threading.Lock()
+
+
+def get_token_cache(cache_file: str) -> tuple:
+    '''The shared msal token cache for a cache file, and the lock that
+    serializes saving it.'''
+    key = os.path.abspath(cache_file)
+    with TokenCachesLock:
+        if key not in TokenCaches:
+            import msal
+            cache = msal.SerializableTokenCache()
+            if os.path.exists(cache_file):
+                logging.info('Cache file exists, deserializing')
+                with open(cache_file, 'r') as fd:
+                    cache.deserialize(fd.read())
+            TokenCaches[key] = (cache, threading.Lock())
+        return TokenCaches[key]
+
 
 class MicrosoftGraphCredentials:
 
-    def __init__(self, config: str = 'data/msgraph-parameters.json', cache_file: str = 'data/msgraph-cache.bin'):
+    def __init__(self, config: str = 'data/msgraph-parameters.json', cache_file: str = 'data/msgraph-cache.bin', username: str = None):
+        '''If username is given, that account is used from the token cache
+        without prompting (and it is an error if it has no cached token), so
+        several accounts can be used unattended in one process.'''
         self.__chosen_account__ = -1
+        self.username = username
         self.config = json.load(open(config, 'rt'))
         self.cache_file = cache_file
         self.__load_cache__()
         self.__output_file_name__ = None
+        import msal # slow to import, so only loaded once credentials are needed
         # Note: this will prompt for credentials, if needed
         self.app = msal.PublicClientApplication(self.config['client_id'],
                                                 authority=self.config['authority'],
@@ -34,11 +72,7 @@ class MicrosoftGraphCredentials:
     def __load_cache__(self):
         if hasattr(self, 'cache'):
             return
-        self.cache = msal.SerializableTokenCache()
-        if os.path.exists(self.cache_file):
-            logging.info('Cache file exists, deserializing')
-            self.cache.deserialize(open(self.cache_file, 'r').read())
-            logging.info(f'Loaded cache: {self.cache}')
+        self.cache, self.cache_lock = get_token_cache(self.cache_file)
         return self
 
 
@@ -46,6 +80,11 @@ class MicrosoftGraphCredentials:
         if self.__chosen_account__ >= 0:
             return self.__chosen_account__
         accounts = self.app.get_accounts()
+        if self.username is not None:
+            for index, account in enumerate(accounts):
+                if account.get('username', '').lower() == self.username.lower():
+                    self.__chosen_account__ = index
+            return self.__chosen_account__
         if accounts:
             choice = -1
             while choice == -1:
@@ -76,10 +115,28 @@ class MicrosoftGraphCredentials:
         return self.__output_file_name__
 
     def get_output_file_name(self):
-        return f'data/microsoft-onedrive-data-{self.get_account_name()}-{datetime.datetime.now(datetime.UTC)}-data.json'.replace(' ', '_').replace(':', '-')
+        return f'data/microsoft-onedrive-data-{self.get_account_name()}-{datetime.datetime.now(datetime.UTC)}-data.jsonl'.replace(' ', '_').replace(':', '-')
+
+    def get_changes_file_name(self):
+        return f'data/microsoft-onedrive-changes-{self.get_account_name()}-{datetime.datetime.now(datetime.UTC)}-changes.jsonl'.replace(' ', '_').replace(':', '-')
+
+    def get_delta_state_file_name(self):
+        '''The delta link for an account is kept next to the token cache.'''
+        account = self.get_account_name().replace(' ', '_').replace(':', '-')
+        return os.path.join(os.path.dirname(self.cache_file), f'msgraph-delta-{account}.json')
+
+    def get_folder_cache_file_name(self):
+        account = self.get_account_name().replace(' ', '_').replace(':', '-')
+        return os.path.join(os.path.dirname(self.cache_file), f'msgraph-folders-{account}.json')
+
+    def token_expires_soon(self, margin: int = 300) -> bool:
+        '''True if the current token expires within margin seconds.'''
+        return getattr(self, 'token_expires', 0) - margin < time.time()
 
     def __get_token__(self):
-        if hasattr(self, 'token') and self.token is not None:
+        # Refresh proactively: a token close to expiry is re-acquired (MSAL
+        # uses the refresh token silently) rather than waiting for a 401.
+        if hasattr(self, 'token') and self.token is not None and not self.token_expires_soon():
             return self.token
         self.token = None
         result = None
@@ -89,6 +146,8 @@ class MicrosoftGraphCredentials:
                 self.chosen_account = self.__choose_account__()
         if self.__chosen_account__ >= 0:
             result = self.app.acquire_token_silent(self.config['scope'], account=accounts[self.__chosen_account__])
+        if result is None and self.username is not None:
+            raise ValueError(f'No cached token for {self.username} in {self.cache_file}; sign in once interactively first')
         if result is None:
             logging.info('Suitable token not found in cache. Request from user.')
             flow = self.app.initiate_device_flow(scopes=self.config['scope'])
@@ -104,12 +163,20 @@ class MicrosoftGraphCredentials:
             self.token = None
         else:
             self.token = result['access_token']
+            self.token_expires = time.time() + int(result.get('expires_in', 3600))
+            if self.cache.has_state_changed:
+                self.__save_cache__()
         return self.token
 
     def __save_cache__(self):
+        '''Write the (shared) cache, replacing the file atomically.'''
         if hasattr(self, 'cache') and getattr(self, 'cache') is not None:
-            print(type(self.cache))
-            open(self.cache_file, 'w').write(self.cache.serialize())
+            with self.cache_lock:
+                temp = f'{self.cache_file}.{os.getpid()}.tmp'
+                with open(temp, 'w') as fd:
+                    fd.write(self.cache.serialize())
+                os.replace(temp, self.cache_file)
+                self.cache.has_state_changed = False
 
     def __del__(self):
         if hasattr(self, 'cache') and self.cache is not None and self.cache.has_state_changed:
@@ -121,74 +188,396 @@ class MicrosoftGraphCredentials:
     def clear_token(self) -> 'MicrosoftGraphCredentials':
         '''Use this to clear a stale or invalid token.'''
         self.token = None
+        self.token_expires = 0
         return self
 
-def get_onedrive_metadata_recursive(cred: MicrosoftGraphCredentials, folder_id=None):
+class OneDriveResyncRequired(Exception):
+    '''The service no longer accepts a saved delta link (HTTP 410 Gone).'''
+    pass
+
+
+class OneDriveCrawler:
+    '''
+    Crawls the metadata of a OneDrive account.  Rather than recursing once per
+    subfolder, the crawler keeps a frontier of pending requests (folder
+    listings and their @odata.nextLink continuation pages) and keeps up to
+    max_workers of them in flight at once.  Since the frontier is a queue,
+    deep trees cannot exhaust the stack.
+
+    Up to batch_size pending requests are combined into a single JSON $batch
+    call.  Requests that are throttled or fail transiently inside a batch are
+    put back on the frontier once their Retry-After has passed.
+    '''
+
+    GraphEndpoint = 'https://graph.microsoft.com/v1.0'
+
+    MaxBatchSize = 20 # Graph limit on requests per $batch call
+
+    def __init__(self, cred: MicrosoftGraphCredentials, max_workers: int = 8, client: IndalekoHttpClient = None, rate: float = None, profile: str = DefaultProfile, batch_size: int = MaxBatchSize, endpoint: str = None, folder_cache: 'OneDriveFolderCache' = None):
+        '''Parameters:
+            cred: credentials for the account (the token provider)
+
+            max_workers: number of requests kept in flight
+
+            client: shared HTTP client; by default one is created with a
+                    connection pool sized for max_workers
 
-    def get_headers():
+            rate: requests per second allowed (None for no limit)
+
+            profile: projection profile (see indaleko_projections)
+
+            batch_size: folder pages combined into one JSON $batch request
+                        (1 disables batching)
+
+            endpoint: Graph root to use instead of GraphEndpoint (e.g., the
+                      indaleko_replay server)
+
+            folder_cache: OneDriveFolderCache used to skip unchanged folders
+        '''
+        assert 1 <= batch_size <= self.MaxBatchSize, f'batch_size must be between 1 and {self.MaxBatchSize}'
+        self.cred = cred
+        if endpoint is not None:
+            self.GraphEndpoint = endpoint
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.folder_cache = folder_cache
+        # the folder cache needs the tags, whatever the profile
+        self.select = graph_select(profile, extra=('cTag', 'eTag') if folder_cache is not None else ())
+        if client is None:
+            client = IndalekoHttpClient(token_provider=cred, rate=rate, pool_size=max_workers)
+        self.client = client
+        self.requests = 0
+
+    def with_select(self, endpoint: str) -> str:
+        if self.select is None:
+            return endpoint
+        return f'{endpoint}?$select={self.select}'
+
+    def get_item_endpoint(self, folder_id: str = None) -> str:
+        if folder_id is None:
+            return self.with_select(f'{self.GraphEndpoint}/me/drive/root')
+        return self.with_select(f'{self.GraphEndpoint}/me/drive/items/{folder_id}')
+
+    def get_children_endpoint(self, folder_id: str = None) -> str:
+        if folder_id is None:
+            return self.with_select(f'{self.GraphEndpoint}/me/drive/root/children')
+        return self.with_select(f'{self.GraphEndpoint}/me/drive/items/{folder_id}/children')
+
+    def fetch_page(self, endpoint: str) -> dict:
+        '''Fetch one page of a folder listing.'''
+        self.requests += 1
+        try:
+            return self.client.get_json(endpoint)
+        except IndalekoHttpError as e:
+            if e.status == 410:
+                raise OneDriveResyncRequired(e.text)
+            raise
+
+    def relative_url(self, endpoint: str) -> str:
+        '''JSON batch requests use URLs relative to the Graph version root.'''
+        if endpoint.startswith(self.GraphEndpoint):
+            return endpoint[len(self.GraphEndpoint):]
+        return endpoint
+
+    def fetch_batch(self, entries: list) -> list:
+        '''Fetch up to MaxBatchSize frontier entries with one $batch call.
+        Returns a list of (entry, status, headers, body), one per entry.'''
+        body = {'requests': [{'id': str(index), 'method': 'GET', 'url': self.relative_url(entry[0])}
+                             for index, entry in enumerate(entries)]}
+        self.requests += 1
+        data = self.client.post_json(f'{self.GraphEndpoint}/$batch', body)
+        results = []
+        for response in data['responses']:
+            entry = entries[int(response['id'])]
+            results.append((entry, response['status'], response.get('headers', {}), response.get('body')))
+        return results
+
+    def __fetch_entry__(self, entry: tuple) -> list:
+        return [(entry, 200, {}, self.fetch_page(entry[0]))]
+
+    def __defer__(self, entry: tuple, status: int, headers: dict, body, deferred: list) -> None:
+        '''Handle a request that failed inside a batch: throttling and
+        transient errors are retried after Retry-After (or an exponential
+        backoff); anything else is logged and dropped.'''
+        endpoint, attempts = entry
+        if status not in IndalekoHttpClient.RetryStatus + (401,):
+            logging.warning(f'Dropping {endpoint}: {status} {body}')
+            return
+        if attempts >= self.client.max_retries:
+            raise IndalekoHttpError(status, endpoint, json.dumps(body))
+        delay = None
+        retry_after = {k.lower(): v for k, v in headers.items()}.get('retry-after')
+        if retry_after is not None:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                pass
+        if delay is None:
+            delay = min(self.client.max_backoff, self.client.backoff * (2 ** attempts))
+        logging.info(f'Batched request for {endpoint} returned {status}, retrying in {delay} seconds')
+        heapq.heappush(deferred, (time.monotonic() + delay, id(entry), (endpoint, attempts + 1)))
+
+    def crawl(self, folder_id: str = None, on_page=None, state: dict = None) -> list:
+        '''Return the metadata for every item below the given folder (the
+        root of the drive by default.)
+
+        If on_page is given, items are not accumulated; instead
+        on_page(items, state) is called as results arrive, where state is the
+        pending frontier (a checkpoint).  Passing a saved state back in
+        resumes the crawl from that point.
+
+        With a folder cache, folders whose tag has not changed since the
+        cached listing are served from the cache without being listed.'''
+        metadata_list = []
+        page = []
+        folder_cache = self.folder_cache
+        if folder_cache is not None and state is not None:
+            # the partial listings of the interrupted run are gone
+            logging.info('Resuming a crawl, not using the folder cache')
+            folder_cache = None
+        self.listings = {} # children endpoint -> folder id (folder cache only)
+        self.collected = {} # folder id -> listing so far (folder cache only)
+        # frontier entries are (endpoint, attempts)
+        frontier = collections.deque()
+        if state is not None:
+            frontier.extend((endpoint, attempts) for endpoint, attempts in state['frontier'])
+        elif folder_cache is not None:
+            root = self.fetch_page(self.get_item_endpoint(folder_id))
+            self.__visit_folder__(folder_cache, root['id'], self.get_tag(root), frontier, page)
+        else:
+            frontier.append((self.get_children_endpoint(folder_id), 0))
+        if len(page) > 0:
+            if on_page is None:
+                metadata_list.extend(page)
+            else:
+                on_page(page, self.get_state(frontier, [], {}))
+        deferred = [] # heap of (not before, tie breaker, entry)
+        pending = {} # future -> the frontier entries it is fetching
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while frontier or pending or deferred:
+                now = time.monotonic()
+                while deferred and deferred[0][0] <= now:
+                    frontier.append(heapq.heappop(deferred)[2])
+                while frontier and len(pending) < self.max_workers:
+                    if self.batch_size > 1:
+                        batch = [frontier.popleft() for _ in range(min(self.batch_size, len(frontier)))]
+                        pending[executor.submit(self.fetch_batch, batch)] = batch
+                    else:
+                        entry = frontier.popleft()
+                        pending[executor.submit(self.__fetch_entry__, entry)] = [entry]
+                timeout = max(0.0, deferred[0][0] - now) if deferred else None
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                done, _ = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+                page = []
+                for future in done:
+                    del pending[future]
+                    for entry, status, headers, data in future.result():
+                        if status != 200:
+                            self.__defer__(entry, status, headers, data, deferred)
+                            continue
+                        for item in data['value']:
+                            page.append(item)
+                            if 'folder' not in item:
+                                continue
+                            if folder_cache is not None:
+                                self.__visit_folder__(folder_cache, item['id'], self.get_tag(item), frontier, page)
+                            else:
+                                frontier.append((self.get_children_endpoint(item['id']), 0))
+                        if folder_cache is not None:
+                            self.__collect__(folder_cache, entry[0], data)
+                        if data.get('@odata.nextLink'):
+                            frontier.append((data['@odata.nextLink'], 0))
+                if on_page is None:
+                    metadata_list.extend(page)
+                elif len(done) > 0:
+                    on_page(page, self.get_state(frontier, deferred, pending))
+        if folder_cache is not None:
+            folder_cache.save()
+            logging.info(f'Folder cache: {folder_cache.hits} folders reused, {folder_cache.misses} listed')
+        logging.info(f'Crawled {len(metadata_list)} items with {self.requests} requests')
+        return metadata_list
+
+    @staticmethod
+    def get_tag(item: dict) -> str:
+        return item.get('cTag') or item.get('eTag')
+
+    def __visit_folder__(self, folder_cache: 'OneDriveFolderCache', folder_id: str, tag: str, frontier, page: list) -> None:
+        '''Serve a folder (and its unchanged subfolders) from the cache, or
+        queue the listing of those that changed.'''
+        folders = [(folder_id, tag)]
+        while folders:
+            folder_id, tag = folders.pop()
+            children = folder_cache.reuse(folder_id, tag)
+            if children is None:
+                endpoint = self.get_children_endpoint(folder_id)
+                self.listings[endpoint] = folder_id
+                self.collected[folder_id] = {'tag': tag, 'children': []}
+                frontier.append((endpoint, 0))
+                continue
+            page.extend(children)
+            folders.extend((child['id'], self.get_tag(child)) for child in children if 'folder' in child)
+
+    def __collect__(self, folder_cache: 'OneDriveFolderCache', endpoint: str, data: dict) -> None:
+        '''Accumulate a folder listing; once its last page has arrived the
+        listing goes into the cache.'''
+        folder_id = self.listings.pop(endpoint, None)
+        if folder_id is None:
+            return
+        self.collected[folder_id]['children'].extend(data['value'])
+        if data.get('@odata.nextLink'):
+            self.listings[data['@odata.nextLink']] = folder_id
+            return
+        listing = self.collected.pop(folder_id)
+        folder_cache.put(folder_id, listing['tag'], listing['children'])
+
+    @staticmethod
+    def get_state(frontier, deferred: list, pending: dict) -> dict:
+        '''Everything still to be fetched: queued, waiting to be retried, or
+        in flight.'''
+        entries = list(frontier) + [x[2] for x in deferred] + [e for entries in pending.values() for e in entries]
+        return {'frontier': [[endpoint, attempts] for endpoint, attempts in entries]}
+
+
+class OneDriveFolderCache:
+    '''
+    Persistent per-folder cache of child listings, keyed by the folder's cTag
+    (or eTag.)  These tags change whenever anything below the folder changes,
+    so a folder whose tag is the same as when it was cached has the same
+    contents, all the way down, and need not be listed.  This is for drives
+    (and shared folders) where the delta query is not available.
+
+    Each crawl builds a new cache from the listings it fetched and the cached
+    listings it reused, which replaces the old one once the crawl completes
+    (folders that have gone are dropped.)
+    '''
+
+    def __init__(self, cache_file: str) -> None:
+        self.cache_file = cache_file
+        self.folders = {}
+        if os.path.exists(cache_file):
+            with open(cache_file, 'rt') as fd:
+                self.folders = json.load(fd).get('folders', {})
+        self.current = {}
+        self.hits = 0
+        self.misses = 0
+
+    def reuse(self, folder_id: str, tag: str) -> list:
+        '''The cached children of the folder if its tag is unchanged, else
+        None.'''
+        entry = self.folders.get(folder_id)
+        if tag is None or entry is None or entry['tag'] != tag:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.current[folder_id] = entry
+        return entry['children']
+
+    def put(self, folder_id: str, tag: str, children: list) -> None:
+        if tag is not None:
+            self.current[folder_id] = {'tag': tag, 'children': children}
+
+    def save(self) -> None:
+        with open(self.cache_file + '.tmp', 'wt') as fd:
+            json.dump({'folders': self.current, 'timestamp': datetime.datetime.now(datetime.UTC).isoformat()}, fd)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+        self.folders = self.current
+        self.current = {}
+
+
+class OneDriveDeltaSync:
+    '''
+    Incremental sync built on the Microsoft Graph delta query.  The first run
+    enumerates the whole drive; every run ends with an @odata.deltaLink which
+    is saved per account (next to the token cache), and the next run starts
+    from it so only the items changed since then are fetched.
+
+    The output is a change stream (JSON lines), one record per item:
+
+        {"change": "changed" | "deleted", "id": "...", "item": {...}}
+    '''
+
+    def __init__(self, cred: MicrosoftGraphCredentials, crawler: OneDriveCrawler = None, state_file: str = None):
+        self.cred = cred
+        self.crawler = crawler if crawler is not None else OneDriveCrawler(cred, max_workers=1)
+        self.state_file = state_file if state_file is not None else cred.get_delta_state_file_name()
+        self.delta_link = self.__load_state__()
+
+    def __load_state__(self) -> str:
+        if not os.path.exists(self.state_file):
+            return None
+        with open(self.state_file, 'rt') as fd:
+            return json.load(fd).get('deltaLink')
+
+    def __save_state__(self, delta_link: str) -> None:
+        state = {'deltaLink': delta_link, 'timestamp': datetime.datetime.now(datetime.UTC).isoformat()}
+        with open(self.state_file + '.tmp', 'wt') as fd:
+            json.dump(state, fd, indent=4)
+        os.replace(self.state_file + '.tmp', self.state_file)
+        self.delta_link = delta_link
+
+    def reset(self) -> 'OneDriveDeltaSync':
+        '''Forget the saved delta link; the next sync is a full enumeration.'''
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        self.delta_link = None
+        return self
+
+    @staticmethod
+    def to_change(item: dict) -> dict:
         return {
-            'Authorization': f'Bearer {cred.get_token()}'
+            'change': 'deleted' if 'deleted' in item else 'changed',
+            'id': item['id'],
+            'item': item,
         }
-    headers = get_headers()
-    metadata_list = []
-
-    if folder_id is None:
-        endpoint = 'https://graph.microsoft.com/v1.0/me/drive/root/children'
-    else:
-        endpoint = f'https://graph.microsoft.com/v1.0/me/drive/items/{folder_id}/children'
-
-    while endpoint:
-        response = requests.get(endpoint, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
-            for item in data['value']:
-                metadata_list.append(item)
-                if item.get('folder'):
-                    # Recursively fetch metadata for subfolder
-                    subfolder_id = item['id']
-                    metadata_list.extend(
-                        get_onedrive_metadata_recursive(cred, subfolder_id))
-            endpoint = data.get('@odata.nextLink')
-        else:
-            print(f"Error: {response.status_code} - {response.text}")
-            if 401 == response.status_code: # seems to indicate a stale token
-                cred.clear_token()
-                headers = get_headers()
-            # try again
-    return metadata_list
-
-
-'''
-def get_onedrive_metadata(cred: MicrosoftGraphCredentials):
-    headers = {
-        'Authorization': f'Bearer {cred.get_token()}'
-    }
-    metadata_list = []
-
-    endpoint = 'https://graph.microsoft.com/v1.0/me/drive/root/children'
-    while endpoint:
-        response = requests.get(endpoint, headers=headers)
-        if response.status_code == 200:
-            data = response.json()
+
+    def sync(self, on_change) -> int:
+        '''Fetch the changes since the last sync, calling on_change(record)
+        for each one.  The new delta link is saved only after every change has
+        been delivered, so an interrupted sync is repeated rather than lost.
+        Returns the number of changes.'''
+        endpoint = self.delta_link
+        if endpoint is None:
+            logging.info('No delta link saved, enumerating the whole drive')
+            endpoint = self.crawler.with_select(f'{self.crawler.GraphEndpoint}/me/drive/root/delta')
+        count = 0
+        while True:
+            try:
+                data = self.crawler.fetch_page(endpoint)
+            except OneDriveResyncRequired:
+                if count > 0 or self.delta_link is None:
+                    raise
+                logging.warning('Delta link expired, starting over with a full enumeration')
+                self.reset()
+                endpoint = self.crawler.with_select(f'{self.crawler.GraphEndpoint}/me/drive/root/delta')
+                continue
             for item in data['value']:
-                metadata_list.append(item)
-            endpoint = data.get('@odata.nextLink')
-        else:
-            print(f"Error: {response.status_code} - {response.text}")
-            endpoint = None
-    return metadata_list
-'''
+                on_change(self.to_change(item))
+                count += 1
+            if '@odata.nextLink' in data:
+                endpoint = data['@odata.nextLink']
+                continue
+            self.__save_state__(data['@odata.deltaLink'])
+            return count
+
+
+def get_onedrive_metadata(cred: MicrosoftGraphCredentials, folder_id=None, max_workers: int = 8, rate: float = None, profile: str = DefaultProfile, batch_size: int = OneDriveCrawler.MaxBatchSize) -> list:
+    crawler = OneDriveCrawler(cred, max_workers, rate=rate, profile=profile, batch_size=batch_size)
+    metadata = crawler.crawl(folder_id)
+    crawler.client.log_metrics()
+    return metadata
+
 
 def main():
-    # First, let's figure out the name we're using
-    graphcreds = MicrosoftGraphCredentials()
-    # Now parse the arguments
+    # Parse the arguments first, so that --help (and argument errors) do not
+    # wait for the credentials
     logging_levels = sorted(set([l for l in logging.getLevelNamesMapping()]))
     parser = argparse.ArgumentParser()
     parser.add_argument('--loglevel', type=int, default=logging.WARNING, choices=logging_levels,
                         help='Logging level to use (lower number = more logging)')
-    parser.add_argument('--output', type=str, default=graphcreds.get_output_file_name(),
-                        help='Name and location of where to save the fetched metadata')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Name and location of where to save the fetched metadata (default: named after the account)')
     parser.add_argument('--config', type=str, default='msgraph-config.json',
                         help='Name and location from whence to retrieve the Microsoft Graph Config info')
     parser.add_argument('--host', type=str,
@@ -203,15 +592,67 @@ def main():
                         help='Name of the database to use (overrides config file)')
     parser.add_argument('--reset', action='store_true',
                         default=False, help='Clean database before running')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of folder pages to fetch concurrently')
+    parser.add_argument('--batch', type=int, default=OneDriveCrawler.MaxBatchSize,
+                        help='Folder pages per Graph $batch request (1 disables batching)')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Maximum Graph requests per second (default: no limit)')
+    add_profile_argument(parser)
+    add_serializer_argument(parser)
+    parser.add_argument('--resume', type=str, default=None,
+                        help='Resume the interrupted crawl that was writing this output file')
+    parser.add_argument('--spool', type=str, default=None,
+                        help='Also normalize each page into Indaleko objects and append them to this spool directory')
+    parser.add_argument('--blobs', type=str, default=None,
+                        help='With --spool, keep the raw items in this blob store instead of inline')
+    parser.add_argument('--folder-cache', action='store_true', default=False,
+                        help='Skip folders whose cTag/eTag is unchanged since the last crawl (cached listings are reused)')
+    parser.add_argument('--delta', action='store_true', default=False,
+                        help='Only fetch the changes since the last --delta run (writes a change stream)')
+    parser.add_argument('--delta-reset', action='store_true', default=False,
+                        help='Discard the saved delta link and start a new change stream from scratch')
     args = parser.parse_args()
     print("args:", args)
+    graphcreds = MicrosoftGraphCredentials()
+    if args.output is None:
+        args.output = graphcreds.get_output_file_name()
+    if args.delta or args.delta_reset:
+        delta = OneDriveDeltaSync(graphcreds, OneDriveCrawler(graphcreds, max_workers=1, rate=args.rate, profile=args.profile))
+        if args.delta_reset:
+            delta.reset()
+        output = graphcreds.get_changes_file_name()
+        start = datetime.datetime.now(datetime.UTC)
+        encode = get_serializer(args.format).encode
+        with open(output, 'wb') as output_file:
+            count = delta.sync(lambda change: output_file.write(encode(change)))
+        end = datetime.datetime.now(datetime.UTC)
+        print(f'Saved {count} changes to {output} in {end-start} seconds')
+        return
+    # The crawl is written a page at a time, with a checkpoint next to the
+    # output, so an interrupted crawl can be resumed with --resume.
+    output = args.resume if args.resume is not None else args.output
+    stream = IndalekoCrawlStream(output, resume=args.resume is not None, serializer=get_serializer(args.format))
+    if args.spool is not None:
+        normalizer = OneDriveNormalizer(graphcreds.get_account_name())
+        if args.blobs is not None:
+            normalizer.set_blob_store(IndalekoBlobStore(args.blobs))
+        stream = IndalekoNormalizingStream(stream, normalizer, IndalekoSpool(args.spool))
+    folder_cache = OneDriveFolderCache(graphcreds.get_folder_cache_file_name()) if args.folder_cache else None
+    crawler = OneDriveCrawler(graphcreds, max_workers=args.workers, rate=args.rate, profile=args.profile, batch_size=args.batch, folder_cache=folder_cache)
     start = datetime.datetime.now(datetime.UTC)
-    metadata = get_onedrive_metadata_recursive(graphcreds)
+    try:
+        crawler.crawl(on_page=stream.record_page, state=stream.state)
+    except BaseException:
+        stream.close()
+        print(f'Crawl interrupted after {stream.get_count()} records; rerun with --resume {output}')
+        raise
+    stream.finish()
     end = datetime.datetime.now(datetime.UTC)
-    if len(metadata) > 0:
-        with open(args.output, 'wt') as output_file:
-            json.dump(metadata, output_file, indent=4)
-        print(f'Saved {len(metadata)} records to {args.output} in {end-start} seconds ({(end-start)/len(metadata)} seconds per record)')
+    crawler.client.log_metrics()
+    count = stream.get_count()
+    if count > 0:
+        print(f'Saved {count} records to {output} in {end-start} seconds ({(end-start)/count} seconds per record)')
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indaleko_http import IndalekoHttpClient
+from indaleko_replay import ReplayConfig, ReplayServer, ReplayToken, ReplayTree
+
+
+@pytest.fixture
+def replay():
+    '''A replay server over a small synthetic tree, with short pages so a
+    crawl takes several of them.'''
+    tree = ReplayTree.generate(fanout=2, depth=2, files=4, seed=7)
+    server = ReplayServer(tree, ReplayConfig(page_size=5, seed=7)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def replay_client():
+    return IndalekoHttpClient(token_provider=ReplayToken(), backoff=0.01, max_backoff=0.1)
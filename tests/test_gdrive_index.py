@@ -0,0 +1,83 @@
+import argparse
+
+import pytest
+
+from gdrive_index import GoogleDriveIngest
+from indaleko_serialize import read_records
+from IndalekoIngest import IndalekoCrawlStream
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_ingest(server, client, data_dir, incremental: bool = False) -> GoogleDriveIngest:
+    ingest = GoogleDriveIngest()
+    ingest.DriveEndpoint = server.get_endpoints()['gdrive']
+    ingest.data_dir = str(data_dir) + '/'
+    ingest.email = 'replay@example.com'
+    ingest.args = argparse.Namespace(profile='index', incremental=incremental, workers=2, partitions=4, rate=None)
+    ingest.client = client
+    return ingest
+
+
+def live_ids(server) -> list:
+    return sorted(x for x, item in server.tree.items.items() if not item['deleted'])
+
+
+def test_partitioned_listing(replay, replay_client, tmp_path):
+    output = str(tmp_path / 'gdrive.jsonl')
+    stream = IndalekoCrawlStream(output)
+    make_ingest(replay, replay_client, tmp_path).stream_metadata(stream)
+    stream.finish()
+    ids = [record['id'] for record in read_records(output)]
+    assert sorted(ids) == live_ids(replay)
+
+
+def test_interrupted_listing_resumes(replay, replay_client, tmp_path):
+    output = str(tmp_path / 'gdrive.jsonl')
+    stream = IndalekoCrawlStream(output)
+    record_page = stream.record_page
+    pages = []
+
+    def interrupt(records, state):
+        record_page(records, state)
+        pages.append(records)
+        if len(pages) == 2:
+            raise Interrupted()
+
+    stream.record_page = interrupt
+    with pytest.raises(Interrupted):
+        make_ingest(replay, replay_client, tmp_path).stream_metadata(stream)
+    stream.close()
+    resumed = IndalekoCrawlStream(output, resume=True)
+    make_ingest(replay, replay_client, tmp_path).stream_metadata(resumed)
+    resumed.finish()
+    ids = [record['id'] for record in read_records(output)]
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == live_ids(replay)
+
+
+def test_incremental_run_reads_the_changes_feed(replay, replay_client, tmp_path):
+    first = IndalekoCrawlStream(str(tmp_path / 'full.jsonl'))
+    make_ingest(replay, replay_client, tmp_path).stream_metadata(first)
+    first.finish()
+    replay.tree.mutate(count=3, delete_fraction=0.0)
+    changes = IndalekoCrawlStream(str(tmp_path / 'changes.jsonl'))
+    make_ingest(replay, replay_client, tmp_path, incremental=True).stream_metadata(changes)
+    changes.finish()
+    records = list(read_records(str(tmp_path / 'changes.jsonl')))
+    assert 0 < len(records) <= 3
+    assert all(record['change'] == 'changed' for record in records)
+
+
+def test_expired_start_page_token_falls_back_to_a_listing(replay, replay_client, tmp_path):
+    first = IndalekoCrawlStream(str(tmp_path / 'full.jsonl'))
+    make_ingest(replay, replay_client, tmp_path).stream_metadata(first)
+    first.finish()
+    replay.tree.expire()
+    changes = IndalekoCrawlStream(str(tmp_path / 'changes.jsonl'))
+    make_ingest(replay, replay_client, tmp_path, incremental=True).stream_metadata(changes)
+    changes.finish()
+    records = list(read_records(str(tmp_path / 'changes.jsonl')))
+    assert sorted(record['id'] for record in records) == live_ids(replay)
@@ -0,0 +1,43 @@
+import json
+import os
+
+from local_index import IndalekoPathDictionary, decode_snapshot, walk_dictionary_encoded
+
+
+def make_tree(root) -> set:
+    paths = set()
+    for directory in ('a', 'a/b', 'a/b/c', 'd'):
+        os.makedirs(root / directory, exist_ok=True)
+        paths.add(str(root / directory))
+    for name in ('top.txt', 'a/one.txt', 'a/b/c/deep.txt', 'd/two.txt'):
+        (root / name).write_text(name)
+        paths.add(str(root / name))
+    return paths
+
+
+def test_dictionary_round_trip():
+    dictionary = IndalekoPathDictionary()
+    root = dictionary.add_directory(None, '/data')
+    child = dictionary.add_directory(root, 'child')
+    grandchild = dictionary.add_directory(child, 'grandchild')
+    restored = IndalekoPathDictionary.from_list(json.loads(json.dumps(dictionary.to_list())))
+    assert restored.get_path(grandchild, 'x.txt') == os.path.join('/data', 'child', 'grandchild', 'x.txt')
+    assert restored.resolve(root) == '/data'
+
+
+def test_dictionary_encoded_snapshot_decodes_to_full_paths(tmp_path):
+    expected = make_tree(tmp_path)
+    snapshot = walk_dictionary_encoded(str(tmp_path))
+    assert snapshot['Encoding'] == 'dictionary'
+    # each directory is stored once
+    assert len(snapshot['Directories']) == 5
+    snapshot = json.loads(json.dumps(snapshot))
+    records = list(decode_snapshot(snapshot))
+    assert set(os.path.join(record['path'], record['file']) for record in records) == expected
+    for record in records:
+        assert record['URI'] == os.path.join(record['path'], record['file'], record['file'])
+
+
+def test_full_path_snapshots_pass_through():
+    records = [{'path': '/data', 'file': 'a.txt', 'URI': '/data/a.txt/a.txt'}]
+    assert list(decode_snapshot(records)) == records
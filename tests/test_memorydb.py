@@ -0,0 +1,46 @@
+from indaleko_memorydb import IndalekoMemoryCollection
+
+
+def make_document(uri: str, identifier: str, **fields) -> dict:
+    document = {'URI': uri, 'ObjectIdentifier': identifier, 'Size': 0}
+    document.update(fields)
+    return document
+
+
+def test_upsert_counts():
+    collection = IndalekoMemoryCollection('Objects')
+    counts = collection.upsert_batch([make_document('a', '1'), make_document('b', '2')])
+    assert counts == {'inserted': 2, 'updated': 0, 'unchanged': 0, 'failed': 0}
+    counts = collection.upsert_batch([make_document('a', '1'), make_document('b', '2', Size=10)])
+    assert counts == {'inserted': 0, 'updated': 1, 'unchanged': 1, 'failed': 0}
+    assert collection.find_entries(URI='b')[0]['Size'] == 10
+
+
+def test_upsert_preserves_object_identifier():
+    collection = IndalekoMemoryCollection('Objects')
+    collection.upsert_batch([make_document('a', '1')])
+    counts = collection.upsert_batch([make_document('a', '9', Size=5)])
+    assert counts['updated'] == 1
+    stored = collection.find_entries(URI='a')[0]
+    assert stored['ObjectIdentifier'] == '1'
+    assert stored['Size'] == 5
+
+
+def test_upsert_failures_are_per_document():
+    collection = IndalekoMemoryCollection('Objects')
+    collection.upsert_batch([make_document('a', '1')])
+    failed = []
+    # 'b' reuses the ObjectIdentifier of 'a', which is also uniquely indexed
+    counts = collection.upsert_batch([make_document('b', '1'), make_document('c', '3')], failed=failed)
+    assert counts == {'inserted': 1, 'updated': 0, 'unchanged': 0, 'failed': 1}
+    assert failed == [make_document('b', '1')]
+    assert collection.find_entries(URI='b') == []
+    assert collection.count() == 2
+
+
+def test_upsert_many_sums_batches():
+    collection = IndalekoMemoryCollection('Objects')
+    documents = [make_document(f'uri-{index}', f'id-{index}') for index in range(25)]
+    assert collection.upsert_many(documents, batch_size=10)['inserted'] == 25
+    assert collection.round_trips == 3
+    assert collection.upsert_many(documents, batch_size=10)['unchanged'] == 25
@@ -0,0 +1,84 @@
+from indaleko import object_identifier, relationship_key
+from indaleko_normalize import (ContainsRelationship, DropboxNormalizer, LocalNormalizer, OneDriveNormalizer,
+                                get_pages)
+
+
+def onedrive_item(item_id: str, name: str, parent: str = None, folder: bool = False) -> dict:
+    item = {'id': item_id, 'name': name, 'size': 0 if folder else 10,
+            'lastModifiedDateTime': '2024-01-01T00:00:00Z'}
+    if parent is not None:
+        item['parentReference'] = {'id': parent}
+    if folder:
+        item['folder'] = {'childCount': 1}
+    return item
+
+
+def test_object_identifiers_are_derived_from_the_uri():
+    normalizer = OneDriveNormalizer('someone@example.com')
+    objects, relationships, deleted = normalizer.normalize_page([onedrive_item('ITEM1', 'a.txt', parent='ROOT')])
+    document = objects[0].to_dict()
+    assert document['URI'] == 'onedrive://someone@example.com/ITEM1'
+    assert document['ObjectIdentifier'] == object_identifier(document['URI'])
+    assert document['_key'] == document['ObjectIdentifier']
+    assert document['LocalIdentifier'] == 'onedrive:someone@example.com:ITEM1'
+    assert deleted == []
+    edge = relationships[0].to_dict()
+    parent = object_identifier('onedrive://someone@example.com/ROOT')
+    assert edge['_from'] == f'Objects/{parent}'
+    assert edge['_to'] == f"Objects/{document['ObjectIdentifier']}"
+    assert edge['_key'] == relationship_key(parent, ContainsRelationship, document['ObjectIdentifier'])
+
+
+def test_identifiers_are_stable_and_qualified_by_account():
+    item = onedrive_item('ITEM1', 'a.txt')
+    first = OneDriveNormalizer('one@example.com').normalize_page([item])[0][0].to_dict()
+    again = OneDriveNormalizer('one@example.com').normalize_page([item])[0][0].to_dict()
+    other = OneDriveNormalizer('two@example.com').normalize_page([item])[0][0].to_dict()
+    assert first == again
+    assert first['ObjectIdentifier'] != other['ObjectIdentifier']
+    assert first['LocalIdentifier'] != other['LocalIdentifier']
+
+
+def test_change_records_and_deletions():
+    normalizer = OneDriveNormalizer('someone@example.com')
+    records = [
+        {'change': 'changed', 'id': 'A', 'item': onedrive_item('A', 'a.txt')},
+        {'change': 'deleted', 'id': 'B', 'item': {'id': 'B', 'deleted': {}}},
+    ]
+    objects, _, deleted = normalizer.normalize_page(records)
+    assert [x.uri for x in objects] == ['onedrive://someone@example.com/A']
+    assert len(deleted) == 1
+    assert normalizer.deleted == 1
+
+
+def dropbox_entry(tag: str, path: str) -> dict:
+    return {'.tag': tag, 'id': f'id:{path}', 'name': path.rsplit('/', 1)[1], 'path_lower': path, 'path_display': path}
+
+
+def test_dropbox_entries_wait_for_their_folder(tmp_path):
+    folder_file = str(tmp_path / 'folders.jsonl')
+    normalizer = DropboxNormalizer('someone@example.com', folder_file)
+    _, relationships, _ = normalizer.normalize_page([dropbox_entry('file', '/docs/a.txt')])
+    assert relationships == []
+    objects, relationships, _ = normalizer.normalize_page([dropbox_entry('folder', '/docs')])
+    folder = objects[0].object_identifier
+    root = object_identifier('dropbox://someone@example.com/root')
+    assert [(x.object1, x.object2) for x in relationships][0] == (root, folder)
+    assert relationships[1].object1 == folder
+    # a later run resolves the folder from the folder file
+    later = DropboxNormalizer('someone@example.com', folder_file)
+    _, relationships, _ = later.normalize_page([dropbox_entry('file', '/docs/b.txt')])
+    assert [x.object1 for x in relationships] == [folder]
+
+
+def test_local_identifiers_use_the_full_path():
+    normalizer = LocalNormalizer('0b6a1cc4-7a5f-4b55-8d62-3b1b87e0f6a1', root='/home/user')
+    record = {'path': '/home/user/docs', 'file': 'a.txt', 'st_mode': 0o100644, 'st_size': 3, 'st_mtime': 0}
+    document, parent = normalizer.normalize_item(record)
+    assert document.uri == 'local://0b6a1cc4-7a5f-4b55-8d62-3b1b87e0f6a1//home/user/docs/a.txt'
+    assert document.object_identifier == object_identifier(document.uri)
+    assert parent == '/home/user/docs'
+
+
+def test_get_pages():
+    assert [len(page) for page in get_pages(range(7), page_size=3)] == [3, 3, 1]
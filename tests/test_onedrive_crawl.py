@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from indaleko_replay import ReplayToken
+from indaleko_serialize import read_records
+from IndalekoIngest import IndalekoCrawlCheckpoint, IndalekoCrawlStream
+from onedrive_index import OneDriveCrawler
+
+
+class Interrupted(Exception):
+    pass
+
+
+def make_crawler(server, client, batch_size: int = 1) -> OneDriveCrawler:
+    return OneDriveCrawler(ReplayToken(), max_workers=1, client=client, batch_size=batch_size,
+                           endpoint=server.get_endpoints()['onedrive'])
+
+
+def test_crawl_lists_every_item(replay, replay_client):
+    items = make_crawler(replay, replay_client, batch_size=4).crawl()
+    assert sorted(item['id'] for item in items) == sorted(replay.tree.items)
+
+
+def test_interrupted_crawl_resumes_from_checkpoint(replay, replay_client, tmp_path):
+    output = str(tmp_path / 'onedrive.jsonl')
+    stream = IndalekoCrawlStream(output)
+    pages = []
+
+    def on_page(records, state):
+        stream.record_page(records, state)
+        pages.append(len(records))
+        if len(pages) == 3:
+            raise Interrupted()
+
+    with pytest.raises(Interrupted):
+        make_crawler(replay, replay_client).crawl(on_page=on_page)
+    stream.close()
+    written = stream.get_count()
+    assert 0 < written < len(replay.tree.items)
+
+    resumed = IndalekoCrawlStream(output, resume=True)
+    assert resumed.get_count() == written
+    assert len(resumed.state['frontier']) > 0
+    make_crawler(replay, replay_client).crawl(on_page=resumed.record_page, state=resumed.state)
+    resumed.finish()
+
+    ids = [record['id'] for record in read_records(output)]
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(replay.tree.items)
+    assert not os.path.exists(IndalekoCrawlCheckpoint.for_output(output).checkpoint_file)
+
+
+def test_resume_discards_records_after_the_checkpoint(tmp_path):
+    output = str(tmp_path / 'out.jsonl')
+    stream = IndalekoCrawlStream(output)
+    stream.record_page([{'id': 'a'}], {'frontier': [['next', 0]]})
+    # written, but the process died before the checkpoint was saved
+    stream.sink.write_records([{'id': 'b'}])
+    stream.close()
+    resumed = IndalekoCrawlStream(output, resume=True)
+    resumed.finish()
+    assert [record['id'] for record in read_records(output)] == ['a']
@@ -0,0 +1,84 @@
+from indaleko_memorydb import IndalekoMemoryCollection
+from indaleko_query_cache import IndalekoQueryCache
+from indalekocolletions import IndalekoCollection
+
+
+def test_whitespace_outside_literals_is_collapsed():
+    assert IndalekoQueryCache.normalize_query('  FOR d IN\n  Objects\tRETURN d ') == 'FOR d IN Objects RETURN d'
+
+
+def test_whitespace_inside_literals_is_kept():
+    spaced = IndalekoQueryCache.make_key("FILTER d.Label=='a  b'")
+    single = IndalekoQueryCache.make_key("FILTER d.Label=='a b'")
+    assert spaced != single
+    assert spaced[0] == "FILTER d.Label=='a  b'"
+    assert IndalekoQueryCache.normalize_query('FILTER d.x=="a  \\" b"') == 'FILTER d.x=="a  \\" b"'
+
+
+class MemoryDatabase:
+    '''Just enough of the python-arango database API for IndalekoCollection,
+    backed by IndalekoMemoryCollection.'''
+
+    class Collection(IndalekoMemoryCollection):
+
+        def find(self, filters: dict) -> list:
+            return self.find_entries(**filters)
+
+    def __init__(self) -> None:
+        self.collections = {}
+
+    def has_collection(self, name: str) -> bool:
+        return name in self.collections
+
+    def create_collection(self, name: str, edge: bool = False) -> None:
+        self.collections[name] = self.Collection(name)
+
+    def delete_collection(self, name: str) -> None:
+        del self.collections[name]
+
+    def collection(self, name: str) -> 'MemoryDatabase.Collection':
+        return self.collections[name]
+
+
+def test_lookup_is_cached_until_a_write():
+    cache = IndalekoQueryCache()
+    objects = IndalekoCollection(MemoryDatabase(), 'Objects', query_cache=cache)
+    assert objects.find_entries(URI='a') == []
+    assert objects.find_entries(URI='a') == []
+    assert cache.get_stats()['hits'] == 1
+    objects.insert({'URI': 'a', 'ObjectIdentifier': '1'})
+    assert [document['URI'] for document in objects.find_entries(URI='a')] == ['a']
+    assert cache.get_stats()['invalidations'] == 1
+
+
+def test_writes_only_invalidate_their_collection():
+    cache = IndalekoQueryCache()
+    db = MemoryDatabase()
+    objects = IndalekoCollection(db, 'Objects', query_cache=cache)
+    relationships = IndalekoCollection(db, 'Relationships', query_cache=cache)
+    objects.find_entries(URI='a')
+    relationships.insert({'_key': 'r'})
+    objects.find_entries(URI='a')
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['invalidations'] == 0
+
+
+def test_reset_invalidates():
+    cache = IndalekoQueryCache()
+    db = MemoryDatabase()
+    objects = IndalekoCollection(db, 'Objects', query_cache=cache)
+    objects.insert({'URI': 'a', 'ObjectIdentifier': '1'})
+    assert len(objects.find_entries(URI='a')) == 1
+    objects = IndalekoCollection(db, 'Objects', reset=True, query_cache=cache)
+    assert objects.find_entries(URI='a') == []
+
+
+def test_result_fetched_during_a_write_is_not_kept():
+    cache = IndalekoQueryCache()
+    cache.register_collection('Objects')
+    key = cache.make_key('FOR d IN Objects RETURN d')
+    versions = (('Objects', cache.get_write_version('Objects')),)
+    # the write completes after the query captured the versions
+    cache.bump_write_version('Objects')
+    cache.put(key, ['stale'], ('Objects',), versions)
+    assert cache.get(key) == (False, None)
@@ -0,0 +1,75 @@
+import hashlib
+
+import pytest
+
+from indaleko_normalize import MatchBasisMetadata, SameObjectRelationship
+from indaleko_reconcile import IndalekoReconciler, cloud_files, cloud_path, local_files
+
+Machine = '0b6a1cc4-7a5f-4b55-8d62-3b1b87e0f6a1'
+
+
+def local_record(path: str, name: str, size: int, **fields) -> dict:
+    record = {'path': path, 'file': name, 'st_mode': 0o100644, 'st_size': size}
+    record.update(fields)
+    return record
+
+
+def onedrive_file(item_id: str, parent: str, name: str, size: int, sha1: str = None) -> dict:
+    item = {'id': item_id, 'name': name, 'size': size, 'file': {'hashes': {}},
+            'parentReference': {'path': f'/drive/root:{parent}'}}
+    if sha1 is not None:
+        item['file']['hashes']['sha1Hash'] = sha1.upper()
+    return item
+
+
+def make_rows(count: int):
+    local = [local_record(f'/sync/dir{index % 5}', f'file{index}.txt', index) for index in range(count)]
+    cloud = [onedrive_file(f'ID{index}', f'/dir{index % 5}', f'file{index}.txt', index) for index in range(count)]
+    return (list(local_files(local, '/sync', Machine)),
+            list(cloud_files('onedrive', 'someone@example.com', cloud)))
+
+
+def test_join_matches_path_and_size():
+    local = [local_record('/sync/Docs', 'A.txt', 3), local_record('/sync/Docs', 'b.txt', 4),
+             local_record('/elsewhere', 'c.txt', 5)]
+    cloud = [onedrive_file('ID1', '/docs', 'a.txt', 3), onedrive_file('ID2', '/Docs', 'b.txt', 40)]
+    reconciler = IndalekoReconciler()
+    edges = list(reconciler.reconcile(local_files(local, '/sync', Machine),
+                                      cloud_files('onedrive', 'someone@example.com', cloud)))
+    assert len(edges) == 1
+    assert edges[0]['relationship'] == SameObjectRelationship
+    assert edges[0]['metadata'] == [{'UUID': MatchBasisMetadata, 'Data': 'path+size'}]
+    assert reconciler.stats['local'] == 2
+    assert reconciler.stats['cloud'] == 2
+
+
+def test_hashes_must_agree():
+    sha1 = hashlib.sha1(b'abc').hexdigest()
+    local = [local_record('/sync', 'a.txt', 3, sha1=sha1), local_record('/sync', 'b.txt', 3, sha1=sha1)]
+    cloud = [onedrive_file('ID1', '', 'a.txt', 3, sha1=sha1), onedrive_file('ID2', '', 'b.txt', 3, sha1='0' * 40)]
+    reconciler = IndalekoReconciler()
+    edges = list(reconciler.reconcile(local_files(local, '/sync', Machine),
+                                      cloud_files('onedrive', 'someone@example.com', cloud)))
+    assert [edge['metadata'][0]['Data'] for edge in edges] == ['sha1']
+    assert reconciler.stats['hash mismatch'] == 1
+
+
+def test_grace_partitions_give_the_same_result(tmp_path):
+    local, cloud = make_rows(200)
+    in_memory = IndalekoReconciler().reconcile(local, cloud)
+    partitioned = IndalekoReconciler(partitions=7, spill_dir=str(tmp_path)).reconcile(local, cloud)
+    key = lambda edge: edge['_key']
+    assert sorted(in_memory, key=key) == sorted(partitioned, key=key)
+    # the spill files are removed once the join is done
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_cloud_paths_are_unquoted():
+    item = onedrive_file('ID1', '/My%20Documents', 'a b.txt', 1)
+    assert cloud_path('onedrive', item) == '/My Documents/a b.txt'
+
+
+def test_delta_items_are_rejected():
+    item = {'id': 'ID1', 'name': 'a.txt', 'file': {}, 'parentReference': {'id': 'PARENT'}}
+    with pytest.raises(ValueError):
+        cloud_path('onedrive', item)
@@ -0,0 +1,148 @@
+import os
+import time
+
+import pytest
+
+from indaleko_spool import fcntl
+from indaleko_spool import IndalekoRejectedDocuments, IndalekoSpool, IndalekoSpoolDrainer
+
+
+def write_open_segment(spool_dir: str, sequence: int, batches: list, age: float = 0.0) -> str:
+    '''An open segment as left behind by a writer that has exited.'''
+    spool = IndalekoSpool(spool_dir, recover=False)
+    path = os.path.join(spool_dir, f'segment-{sequence:012d}.open')
+    with open(path, 'wb') as fd:
+        fd.writelines(spool.serializer.encode(batch) for batch in batches)
+    if age > 0:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+
+def drain(spool: IndalekoSpool, upload, **kwargs) -> IndalekoSpoolDrainer:
+    drainer = IndalekoSpoolDrainer(spool, upload, poll_interval=0.0, **kwargs)
+    drainer.drain()
+    return drainer
+
+
+def test_recovers_segments_of_exited_writers(tmp_path):
+    batch = {'collection': 'Objects', 'documents': [{'URI': 'a'}]}
+    write_open_segment(str(tmp_path), 0, [batch])
+    spool = IndalekoSpool(str(tmp_path))
+    assert [os.path.basename(x) for x in spool.ready_segments()] == ['segment-000000000000.ready']
+    uploaded = []
+    drain(spool, lambda collection, documents: uploaded.append((collection, documents)))
+    assert uploaded == [('Objects', [{'URI': 'a'}])]
+    assert spool.is_empty()
+
+
+def test_leaves_live_and_young_segments_alone(tmp_path):
+    writer = IndalekoSpool(str(tmp_path), sync=True)
+    writer.append('Objects', [{'URI': 'a'}])
+    # an unlocked empty segment may belong to a writer that is just starting
+    write_open_segment(str(tmp_path), 5, [])
+    other = IndalekoSpool(str(tmp_path))
+    assert other.ready_segments() == []
+    writer.close()
+    assert len(other.ready_segments()) == 1
+
+
+def test_drain_resumes_from_offset(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    for index in range(3):
+        spool.append('Objects', [{'URI': str(index)}])
+    spool.seal()
+    uploaded = []
+    upload = lambda collection, documents: uploaded.append(documents[0]['URI'])
+    # stopped without draining: the first batch is uploaded, then it gives up
+    drainer = IndalekoSpoolDrainer(spool, upload, poll_interval=0.0)
+    drainer.stop_event.set()
+    drainer.drain_on_stop = False
+    assert not drainer.drain()
+    assert uploaded == ['0']
+    drain(IndalekoSpool(str(tmp_path)), upload)
+    assert uploaded == ['0', '1', '2']
+
+
+@pytest.mark.skipif(fcntl is None, reason='segment locks need fcntl')
+def test_skips_segments_locked_by_another_drainer(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    spool.append('Objects', [{'URI': 'a'}])
+    spool.seal()
+    segment = spool.ready_segments()[0]
+    uploaded = []
+    upload = lambda collection, documents: uploaded.extend(documents)
+    with open(segment, 'rb') as fd:
+        fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+        drain(spool, upload)
+        assert uploaded == []
+    drain(spool, upload)
+    assert uploaded == [{'URI': 'a'}]
+    assert spool.is_empty()
+
+
+def test_dead_letters_rejected_batches(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    spool.append('Objects', [{'URI': 'bad'}])
+    spool.append('Objects', [{'URI': 'good'}])
+    spool.seal()
+    uploaded = []
+
+    def upload(collection, documents):
+        if documents[0]['URI'] == 'bad':
+            raise ValueError('schema violation')
+        uploaded.extend(documents)
+
+    drainer = drain(spool, upload)
+    assert uploaded == [{'URI': 'good'}]
+    assert drainer.dead_lettered == 1
+    assert spool.dead_letter_count() == 1
+    assert spool.is_empty()
+
+
+def test_dead_letters_after_repeated_transient_failures(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    spool.append('Objects', [{'URI': 'a'}])
+    spool.seal()
+    error = RuntimeError('conflict')
+    error.error_code = 1200
+    attempts = []
+
+    def upload(collection, documents):
+        attempts.append(documents)
+        raise error
+
+    drainer = drain(spool, upload, max_attempts=3)
+    assert len(attempts) == 3
+    assert drainer.dead_lettered == 1
+
+
+def test_dead_letters_only_rejected_documents(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    spool.append('Objects', [{'URI': 'a'}, {'URI': 'b'}])
+    spool.seal()
+
+    def upload(collection, documents):
+        raise IndalekoRejectedDocuments([documents[1]], '1 documents could not be upserted')
+
+    drain(spool, upload)
+    with open(spool.get_dead_letter_file(), 'rb') as fd:
+        entry = spool.serializer.decode(fd.readline())
+    assert entry['documents'] == [{'URI': 'b'}]
+
+
+def test_stop_gives_up_while_database_is_down(tmp_path):
+    spool = IndalekoSpool(str(tmp_path))
+    spool.append('Objects', [{'URI': 'a'}])
+    spool.seal()
+
+    def upload(collection, documents):
+        raise ConnectionError('database is down')
+
+    drainer = IndalekoSpoolDrainer(spool, upload, poll_interval=0.01, max_backoff=0.05)
+    drainer.start()
+    start = time.monotonic()
+    drainer.stop(timeout=0.2)
+    assert not drainer.is_alive()
+    assert time.monotonic() - start < 1.0
+    assert len(spool.ready_segments()) == 1
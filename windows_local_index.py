@@ -1,4 +1,5 @@
 import local_index
+from indaleko_serialize import get_serializer, write_document
 import datetime
 import os
 import re
@@ -171,11 +172,14 @@ def main():
     # now I have the path being parsed, let's figure out the drive GUID
     li.set_output_file(construct_windows_output_file_name(args.path))
     args = li.parse_args()
-    data = walk_files_and_directories(args.path, machine_config)
+    if args.path_encoding == 'dictionary':
+        uri_prefix = convert_windows_path_to_guid_uri(args.path, machine_config) if platform.system() == 'Windows' else None
+        data = local_index.walk_dictionary_encoded(args.path, uri_prefix)
+    else:
+        data = walk_files_and_directories(args.path, machine_config)
     # now I just need to save the data
     output_file = os.path.join(args.outdir, args.output).replace(':', '_')
-    with open(output_file, 'wt') as fd:
-        json.dump(data, fd, indent=4)
+    write_document(output_file, data, get_serializer(args.format))
 
 
 